@@ -0,0 +1,63 @@
+"""add trigram search indexes
+
+Revision ID: 3f1c2a9d8e47
+Revises: 
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d8e47'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (索引名, 表名, 列) —— 子串/模糊匹配用 GIN 三元组索引
+TRIGRAM_INDEXES = [
+    ("ix_commit_info_message_trgm", "commit_info", "final_commit_message"),
+    ("ix_commit_info_repository_name_trgm", "commit_info", "repository_name"),
+    ("ix_users_username_trgm", "users", "username"),
+    ("ix_users_email_trgm", "users", "email"),
+    ("ix_users_full_name_trgm", "users", "full_name"),
+]
+
+# 自动补全前缀匹配用 lower(column) text_pattern_ops 索引
+PREFIX_INDEXES = [
+    ("ix_users_username_lower_prefix", "users", "username"),
+    ("ix_users_email_lower_prefix", "users", "email"),
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # CONCURRENTLY 不能在事务中执行，避免建索引期间锁表
+    with op.get_context().autocommit_block():
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON {table} USING gin ({column} gin_trgm_ops)"
+            )
+        for name, table, column in PREFIX_INDEXES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON {table} (lower({column}) text_pattern_ops)"
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    with op.get_context().autocommit_block():
+        for name, _, _ in TRIGRAM_INDEXES + PREFIX_INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
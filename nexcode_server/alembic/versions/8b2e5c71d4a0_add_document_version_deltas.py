@@ -0,0 +1,36 @@
+"""add document version deltas
+
+Revision ID: 8b2e5c71d4a0
+Revises: 3f1c2a9d8e47
+Create Date: 2026-10-19 12:00:00.000000
+
+已有版本仍为完整内容（关键帧），升级后运行
+scripts/convert_versions_to_deltas.py 分批改存为反向差异。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e5c71d4a0'
+down_revision: Union[str, None] = '3f1c2a9d8e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("document_versions", sa.Column("delta", sa.JSON(), nullable=True))
+    op.add_column("document_versions", sa.Column("base_version_id", sa.Integer(), nullable=True))
+    # 按文档取版本链时按 id 顺序扫描
+    op.create_index(
+        "ix_document_versions_document_id_id", "document_versions", ["document_id", "id"]
+    )
+
+
+def downgrade() -> None:
+    # 降级前需先还原差异版本的完整内容，否则这些版本的内容会丢失
+    op.drop_index("ix_document_versions_document_id_id", table_name="document_versions")
+    op.drop_column("document_versions", "base_version_id")
+    op.drop_column("document_versions", "delta")
@@ -0,0 +1,58 @@
+"""add keyset pagination indexes
+
+Revision ID: c4d9e1f27a63
+Revises: 8b2e5c71d4a0
+Create Date: 2026-10-19 14:00:00.000000
+
+列表接口按 (排序键, id) 键集分页，行比较条件和排序可直接走以下复合索引。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d9e1f27a63'
+down_revision: Union[str, None] = '8b2e5c71d4a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (索引名, 表名, 列)
+KEYSET_INDEXES = [
+    ("ix_commit_info_created_at_id", "commit_info", ["created_at", "id"]),
+    ("ix_commit_info_user_id_created_at_id", "commit_info", ["user_id", "created_at", "id"]),
+    ("ix_users_created_at_id", "users", ["created_at", "id"]),
+    ("ix_documents_updated_at_id", "documents", ["updated_at", "id"]),
+    (
+        "ix_document_versions_document_id_version_number_id",
+        "document_versions",
+        ["document_id", "version_number", "id"],
+    ),
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, columns in KEYSET_INDEXES:
+            op.create_index(name, table, columns)
+        return
+
+    # CONCURRENTLY 不能在事务中执行，避免在大表上建索引期间锁表
+    with op.get_context().autocommit_block():
+        for name, table, columns in KEYSET_INDEXES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, _ in KEYSET_INDEXES:
+            op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, _, _ in KEYSET_INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
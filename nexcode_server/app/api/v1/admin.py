@@ -9,9 +9,23 @@ from app.models.database import User, CommitInfo, UserSession, APIKey, SystemSet
 from app.models.user_schemas import SystemSettingsResponse, SystemSettingsUpdate
 from app.services.auth_service import auth_service
 from app.core.config import settings
+from app.core.pagination import Paginator
+from app.core.search import text_match
 import os
 import psutil
 from app.services.commit_service import commit_service
+from app.services.collaboration_service import collaboration_manager
+from app.services.document_storage_service import document_storage_service
+from app.services.version_store import version_store
+from app.services.diff_service import diff_service
+from app.services.document_cache import document_cache
+from app.services.document_search_service import document_search_service
+from app.services.api_key_usage import api_key_usage
+from app.services.auth_cache import auth_cache
+from app.services.count_cache import count_cache
+from app.services.lease_manager import lease_manager
+from app.services.rate_limiter import rate_limiter
+from app.services.sharedb_service import get_sharedb_service
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -64,12 +78,8 @@ async def get_system_stats(
         avg_rating_result = await db.execute(avg_rating_stmt)
         avg_rating = avg_rating_result.scalar() or 0
         
-        # 获取API调用统计（从API密钥使用次数计算）
-        api_calls_stmt = select(func.sum(APIKey.usage_count)).where(
-            APIKey.is_active == True
-        )
-        api_calls_result = await db.execute(api_calls_stmt)
-        api_calls_today = api_calls_result.scalar() or 0
+        # 获取当天API调用数（实时计数器）
+        api_calls_today = await api_key_usage.get_calls_today()
         
         return {
             "system": {
@@ -246,7 +256,7 @@ async def get_realtime_metrics(admin_user: CurrentSuperUser):
     """获取实时监控指标"""
     try:
         return {
-            "active_connections": 15,
+            "active_connections": collaboration_manager.get_metrics()["connections"],
             "requests_per_minute": 45,
             "cpu_usage": psutil.cpu_percent(),
             "memory_usage": psutil.virtual_memory().percent,
@@ -259,6 +269,36 @@ async def get_realtime_metrics(admin_user: CurrentSuperUser):
             detail=f"获取实时监控数据失败: {str(e)}"
         )
 
+@router.get("/monitoring/collaboration")
+async def get_collaboration_metrics(admin_user: CurrentSuperUser):
+    """获取协作WebSocket连接、发送队列深度和发送延迟指标"""
+    return {
+        **collaboration_manager.get_metrics(),
+        "storage": document_storage_service.get_metrics(),
+        "versions": version_store.get_metrics(),
+        "diffs": diff_service.get_metrics(),
+        "search": document_search_service.get_metrics(),
+        "counts": count_cache.get_metrics(),
+        "auth_cache": auth_cache.get_metrics(),
+        "api_key_usage": api_key_usage.get_metrics(),
+        "rate_limit": rate_limiter.get_metrics(),
+        "document_cache": document_cache.get_metrics(),
+        "sharedb": get_sharedb_service().get_metrics(),
+        "leases": lease_manager.get_metrics(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.post("/monitoring/sharedb/compaction")
+async def trigger_sharedb_compaction(admin_user: CurrentSuperUser):
+    """立即触发 ShareDB 操作日志压缩，进度可通过协作监控接口查看"""
+    sharedb = get_sharedb_service()
+    sharedb.trigger_compaction()
+    return {
+        "triggered": True,
+        **sharedb.get_metrics(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 @router.get("/users/analytics")
 async def get_users_analytics(
     admin_user: CurrentSuperUser,
@@ -307,12 +347,12 @@ async def get_all_commits(
     repository_name: Optional[str] = None,
     username: Optional[str] = None,
     start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，提供时忽略 skip")
 ):
-    """获取所有提交记录（管理员）"""
+    """获取所有提交记录（管理员），按 (created_at, id) 键集分页"""
+    paginator = Paginator([(CommitInfo.created_at, True), (CommitInfo.id, True)], cursor, limit, skip)
     try:
-        from sqlalchemy import select, and_, or_
-        from app.models.database import CommitInfo, User
         from sqlalchemy.orm import selectinload
         
         # 构建查询
@@ -321,11 +361,11 @@ async def get_all_commits(
         conditions = []
         
         if repository_name:
-            conditions.append(CommitInfo.repository_name.ilike(f"%{repository_name}%"))
+            conditions.append(text_match(db, [CommitInfo.repository_name], repository_name))
         
         if username:
             # 子查询查找用户ID
-            user_subquery = select(User.id).where(User.username.ilike(f"%{username}%"))
+            user_subquery = select(User.id).where(text_match(db, [User.username], username))
             conditions.append(CommitInfo.user_id.in_(user_subquery))
         
         if start_date:
@@ -334,14 +374,12 @@ async def get_all_commits(
         if end_date:
             conditions.append(CommitInfo.created_at <= end_date)
         
-        if conditions:
-            stmt = stmt.where(and_(*conditions))
-        
         # 排序和分页
-        stmt = stmt.order_by(CommitInfo.created_at.desc()).offset(skip).limit(limit)
+        result = await db.execute(paginator.apply(stmt.where(*conditions)))
+        commits, next_cursor = paginator.page(result.scalars().all())
         
-        result = await db.execute(stmt)
-        commits = result.scalars().all()
+        # 总数（近似，缓存后在后台刷新）
+        total = await count_cache.count(db, select(func.count(CommitInfo.id)).where(*conditions))
         
         # 转换为响应格式
         commit_list = []
@@ -373,9 +411,10 @@ async def get_all_commits(
         
         return {
             "commits": commit_list,
-            "total": len(commit_list),
-            "skip": skip,
-            "limit": limit
+            "total": total,
+            "skip": paginator.offset,
+            "limit": limit,
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -4,6 +4,7 @@ from typing import Optional
 from datetime import timedelta
 
 from app.core.dependencies import DatabaseSession, OptionalUser
+from app.services.auth_cache import auth_cache
 from app.services.auth_service import auth_service
 from app.models.user_schemas import Token, UserCASLogin, UserResponse, UserLogin, UserCreate
 
@@ -248,6 +249,7 @@ async def logout(
             if session:
                 session.is_active = False
                 await db.commit()
+                await auth_cache.invalidate_user(current_user.id)
     
     # 清除Cookie
     response.delete_cookie(key="session_token")
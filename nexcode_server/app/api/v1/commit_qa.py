@@ -1,19 +1,28 @@
 from fastapi import APIRouter
 from app.models.schemas import CommitQARequest, CommitQAResponse
 from app.core.llm_client import get_llm_solution
+from app.core.dependencies import DatabaseSession, OptionalUser
+from app.services.retrieval_service import retrieval_service
 
 router = APIRouter()
 
 @router.post("/commit-qa", response_model=CommitQAResponse)
-async def commit_qa(request: CommitQARequest):
+async def commit_qa(request: CommitQARequest, db: DatabaseSession, current_user: OptionalUser):
     """
     提交相关问答
     """
     try:
+        # 从用户的提交历史和协作文档中检索相关片段
+        user_id = current_user.id if current_user and request.use_history else None
+        retrieved_context, sources = await retrieval_service.build_qa_context(
+            db, user_id, request.question, request.top_k, request.context_token_budget
+        )
+
         # 准备LLM请求数据
         llm_data = {
             "question": request.question,
-            "context": request.context or {}
+            "context": request.context or {},
+            "retrieved_context": retrieved_context
         }
         
         # 调用LLM，传递CLI的API配置
@@ -25,6 +34,6 @@ async def commit_qa(request: CommitQARequest):
             model_name=request.model_name
         )
         
-        return CommitQAResponse(answer=answer)
+        return CommitQAResponse(answer=answer, sources=sources)
     except Exception as e:
-        return CommitQAResponse(answer=f"Error processing question: {str(e)}") 
\ No newline at end of file
+        return CommitQAResponse(answer=f"Error processing question: {str(e)}")
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, HTTPException, status, Query, Response
 from typing import List, Optional
 from datetime import datetime
 
 from app.core.dependencies import CurrentUser, CurrentSuperUser, DatabaseSession
+from app.core.pagination import set_page_headers
 from app.services.commit_service import commit_service
 from app.models.user_schemas import (
     CommitInfoCreate, CommitInfoUpdate, CommitInfoResponse,
@@ -29,15 +30,17 @@ async def create_commit_info(
 async def get_user_commits(
     current_user: CurrentUser,
     db: DatabaseSession,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     repository_name: Optional[str] = None,
     status: Optional[str] = None,
     start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标，提供时忽略 skip")
 ):
-    """获取当前用户的commit列表"""
-    commits = await commit_service.get_user_commits(
+    """获取当前用户的commit列表（下一页游标和总数见响应头）"""
+    result = await commit_service.get_user_commits(
         db=db,
         user_id=current_user.id,
         skip=skip,
@@ -45,23 +48,27 @@ async def get_user_commits(
         repository_name=repository_name,
         status=status,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        cursor=cursor
     )
-    return commits
+    set_page_headers(response, result["next_cursor"], result["total"])
+    return result["commits"]
 
 @router.get("/search", response_model=List[CommitInfoResponse])
 async def search_commits(
     current_user: CurrentUser,
     db: DatabaseSession,
+    response: Response,
     query: Optional[str] = None,
     repository_name: Optional[str] = None,
     commit_style: Optional[str] = None,
     min_rating: Optional[int] = Query(None, ge=1, le=5),
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=1000)
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标，提供时忽略 skip")
 ):
-    """搜索当前用户的commit信息"""
-    commits = await commit_service.search_commits(
+    """搜索当前用户的commit信息（下一页游标和总数见响应头）"""
+    result = await commit_service.search_commits(
         db=db,
         user_id=current_user.id,
         query=query,
@@ -69,9 +76,11 @@ async def search_commits(
         commit_style=commit_style,
         min_rating=min_rating,
         skip=skip,
-        limit=limit
+        limit=limit,
+        cursor=cursor
     )
-    return commits
+    set_page_headers(response, result["next_cursor"], result["total"])
+    return result["commits"]
 
 @router.get("/analytics", response_model=CommitAnalytics)
 async def get_commit_analytics(
@@ -195,33 +204,39 @@ async def add_commit_feedback(
 async def get_all_commits(
     admin_user: CurrentSuperUser,
     db: DatabaseSession,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    repository_name: Optional[str] = None
+    repository_name: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标，提供时忽略 skip")
 ):
-    """获取所有用户的commit列表（管理员）"""
-    commits = await commit_service.get_commits_with_user(
+    """获取所有用户的commit列表（管理员，下一页游标和总数见响应头）"""
+    result = await commit_service.get_commits_with_user(
         db=db,
         skip=skip,
         limit=limit,
-        repository_name=repository_name
+        repository_name=repository_name,
+        cursor=cursor
     )
-    return commits
+    set_page_headers(response, result["next_cursor"], result["total"])
+    return result["commits"]
 
 @router.get("/admin/search", response_model=List[CommitInfoResponse])
 async def admin_search_commits(
     admin_user: CurrentSuperUser,
     db: DatabaseSession,
+    response: Response,
     user_id: Optional[int] = None,
     query: Optional[str] = None,
     repository_name: Optional[str] = None,
     commit_style: Optional[str] = None,
     min_rating: Optional[int] = Query(None, ge=1, le=5),
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=1000)
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标，提供时忽略 skip")
 ):
-    """搜索所有commit信息（管理员）"""
-    commits = await commit_service.search_commits(
+    """搜索所有commit信息（管理员，下一页游标和总数见响应头）"""
+    result = await commit_service.search_commits(
         db=db,
         user_id=user_id,
         query=query,
@@ -229,9 +244,11 @@ async def admin_search_commits(
         commit_style=commit_style,
         min_rating=min_rating,
         skip=skip,
-        limit=limit
+        limit=limit,
+        cursor=cursor
     )
-    return commits
+    set_page_headers(response, result["next_cursor"], result["total"])
+    return result["commits"]
 
 @router.get("/admin/user/{user_id}/analytics", response_model=CommitAnalytics)
 async def get_user_commit_analytics(
@@ -2,7 +2,6 @@ from fastapi import APIRouter, HTTPException, status, Depends, Query
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-import difflib
 
 from app.core.dependencies import CurrentUser, DatabaseSession
 from app.services.document_service import document_service
@@ -10,6 +9,8 @@ from app.services.permission_service import permission_service
 from app.services.auth_service import auth_service
 from app.services.document_storage_service import document_storage_service
 from app.services.sharedb_service import get_sharedb_service
+from app.services.presence_service import presence_service
+from app.services.diff_service import diff_service, render_html, render_unified
 from app.models.document_schemas import (
     DocumentCreate,
     DocumentListItem,
@@ -35,8 +36,14 @@ class VersionSnapshotRequest(BaseModel):
 class VersionDiffResponse(BaseModel):
     from_version: int
     to_version: int
-    diff_html: str
+    diff_html: Optional[str] = None  # 仅 html=true 时渲染当前页的差异块
     diff_text: str
+    added_lines: int = 0
+    removed_lines: int = 0
+    total_hunks: int = 0
+    page: int = 1
+    page_size: int = 0
+    has_more: bool = False
 
 
 class VersionRestoreResponse(BaseModel):
@@ -93,6 +100,7 @@ async def get_user_documents(
     search: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
     organization_id: Optional[int] = Query(None),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，提供时忽略 skip"),
 ):
     """获取用户文档列表"""
     result = await document_service.get_user_documents(
@@ -103,11 +111,20 @@ async def get_user_documents(
         organization_id=organization_id,
         search=search,
         category=category,
+        cursor=cursor,
     )
 
-    # 转换为响应格式
+    # 批量获取实时编辑人数、当前用户权限和协作者摘要
+    document_ids = [doc.id for doc in result["documents"]]
+    editor_counts = await presence_service.get_editor_counts(document_ids)
+    levels = await permission_service.get_document_permission_levels(db, current_user.id, document_ids)
+    summaries = await permission_service.get_collaborator_summaries(db, document_ids)
+
+    # 转换为响应格式（搜索时按相关度排序，并附带高亮摘要）
+    snippets = result.get("snippets", {})
     documents = []
     for doc in result["documents"]:
+        summary = summaries[doc.id]
         doc_response = DocumentListItem(
             id=doc.id,
             title=doc.title,
@@ -121,8 +138,11 @@ async def get_user_documents(
             owner=(
                 UserInfo.model_validate(user_to_dict(doc.owner)) if doc.owner else None
             ),
-            collaborators=[],
-            user_permission=PermissionLevel.READER,  # 你的权限逻辑
+            collaborators=[collaborator_to_response(c) for c in summary["collaborators"]],
+            collaborator_count=summary["count"],
+            user_permission=permission_service.permission_for_level(levels.get(doc.id, 0)),
+            active_editors=editor_counts.get(doc.id, 0),
+            snippet=snippets.get(doc.id),
         )
         documents.append(doc_response)
 
@@ -131,9 +151,29 @@ async def get_user_documents(
         total=result["total"],
         skip=result["skip"],
         limit=result["limit"],
+        next_cursor=result["next_cursor"],
     )
 
 
+@router.get("/presence")
+async def get_documents_presence(
+    current_user: CurrentUser,
+    db: DatabaseSession,
+    ids: str = Query(..., description="逗号分隔的文档ID"),
+):
+    """批量获取文档的实时编辑人数（供文档列表轮询，无需建立WebSocket）"""
+    try:
+        requested_ids = [int(doc_id) for doc_id in ids.split(",") if doc_id.strip()][:100]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid document ids")
+
+    levels = await permission_service.get_document_permission_levels(db, current_user.id, requested_ids)
+    document_ids = [doc_id for doc_id in requested_ids if levels.get(doc_id, 0) > 0]
+
+    counts = await presence_service.get_editor_counts(document_ids)
+    return {"editors": {str(doc_id): count for doc_id, count in counts.items()}}
+
+
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: int, current_user: CurrentUser, db: DatabaseSession
@@ -229,9 +269,10 @@ async def get_document_versions(
     document_id: int, 
     current_user: CurrentUser, 
     db: DatabaseSession,
-    limit: int = Query(10, ge=1, le=50)
+    limit: int = Query(10, ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
 ):
-    """获取文档版本历史"""
+    """获取文档版本历史（从新到旧，按游标翻页）"""
     # 检查权限
     has_permission = await permission_service.check_document_permission(
         db, current_user.id, document_id, PermissionLevel.READER
@@ -241,10 +282,10 @@ async def get_document_versions(
             status_code=status.HTTP_403_FORBIDDEN, detail="无权限访问此文档"
         )
     
-    versions = await document_storage_service.get_document_versions(document_id, limit)
+    result = await document_storage_service.get_document_versions(document_id, limit, cursor)
     
     version_responses = []
-    for version in versions:
+    for version in result["versions"]:
         # 获取用户信息
         user = await auth_service.get_user_by_id(db, version.changed_by)
         if not user:
@@ -272,7 +313,7 @@ async def get_document_versions(
         )
         version_responses.append(version_response)
     
-    return {"versions": version_responses}
+    return {"versions": version_responses, "total": result["total"], "next_cursor": result["next_cursor"]}
 
 
 @router.post("/{document_id}/versions")
@@ -392,9 +433,13 @@ async def get_version_diff(
     from_version: int,
     to_version: int,
     current_user: CurrentUser,
-    db: DatabaseSession
+    db: DatabaseSession,
+    page: int = Query(1, ge=1, description="差异块页码"),
+    page_size: int = Query(50, ge=1, le=500, description="每页差异块数"),
+    context: int = Query(3, ge=0, le=20, description="差异块上下文行数"),
+    html: bool = Query(False, description="是否渲染 HTML 对照表")
 ):
-    """获取两个版本之间的差异"""
+    """获取两个版本之间的差异（按差异块分页）"""
     # 检查权限
     has_permission = await permission_service.check_document_permission(
         db, current_user.id, document_id, PermissionLevel.READER
@@ -404,41 +449,28 @@ async def get_version_diff(
             status_code=status.HTTP_403_FORBIDDEN, detail="无权限查看版本差异"
         )
     
-    # 获取两个版本的内容
-    from_content = await document_storage_service.get_version_content(document_id, from_version)
-    to_content = await document_storage_service.get_version_content(document_id, to_version)
-    
-    if from_content is None or to_content is None:
+    result = await diff_service.diff_versions(document_id, from_version, to_version, context)
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="指定版本不存在"
         )
     
-    # 生成文本差异
-    diff_lines = list(difflib.unified_diff(
-        from_content.splitlines(keepends=True),
-        to_content.splitlines(keepends=True),
-        fromfile=f"版本 {from_version}",
-        tofile=f"版本 {to_version}",
-        n=3
-    ))
-    diff_text = ''.join(diff_lines)
-    
-    # 生成HTML差异
-    html_diff = difflib.HtmlDiff()
-    diff_html = html_diff.make_file(
-        from_content.splitlines(),
-        to_content.splitlines(),
-        fromdesc=f"版本 {from_version}",
-        todesc=f"版本 {to_version}",
-        context=True,
-        numlines=2
-    )
+    # 只渲染请求的那一页差异块
+    start = (page - 1) * page_size
+    hunks = result["hunks"][start:start + page_size]
+    from_label, to_label = f"版本 {from_version}", f"版本 {to_version}"
     
     return VersionDiffResponse(
         from_version=from_version,
         to_version=to_version,
-        diff_html=diff_html,
-        diff_text=diff_text
+        diff_html=render_html(hunks, from_label, to_label) if html else None,
+        diff_text=render_unified(hunks, from_label, to_label),
+        added_lines=result["added_lines"],
+        removed_lines=result["removed_lines"],
+        total_hunks=len(result["hunks"]),
+        page=page,
+        page_size=page_size,
+        has_more=start + page_size < len(result["hunks"])
     )
 
 
@@ -472,7 +504,7 @@ async def cleanup_old_operations(
     """清理旧的操作记录"""
     # 检查权限（只有文档所有者可以清理）
     document = await document_service.get_document(db, document_id, current_user.id)
-    if document.owner_id != current_user.id:
+    if document["owner_id"] != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="只有文档所有者可以清理操作记录"
         )
@@ -481,6 +513,16 @@ async def cleanup_old_operations(
     return {"message": f"已清理旧操作记录，保留 {keep_count} 条最新记录"}
 
 
+def collaborator_to_response(collaborator):
+    """将协作者记录（已加载 user）转换为响应"""
+    return CollaboratorResponse(
+        id=collaborator.id,
+        user=UserInfo.model_validate(user_to_dict(collaborator.user)),
+        permission=collaborator.permission,
+        added_at=collaborator.added_at,
+    )
+
+
 def user_to_dict(user):
     """将用户对象转换为字典"""
     if not user:
@@ -1,21 +1,30 @@
 from fastapi import APIRouter
 from app.models.schemas import IntelligentQARequest, IntelligentQAResponse
 from app.core.llm_client import get_llm_solution
+from app.core.dependencies import DatabaseSession, OptionalUser
+from app.services.retrieval_service import retrieval_service
 import json
 
 router = APIRouter()
 
 @router.post("/intelligent-qa", response_model=IntelligentQAResponse)
-async def intelligent_qa(request: IntelligentQARequest):
+async def intelligent_qa(request: IntelligentQARequest, db: DatabaseSession, current_user: OptionalUser):
     """
     智能问答（专门为ask命令设计）
     """
     try:
+        # 从用户的提交历史和协作文档中检索相关片段
+        user_id = current_user.id if current_user and request.use_history else None
+        retrieved_context, sources = await retrieval_service.build_qa_context(
+            db, user_id, request.question, request.top_k, request.context_token_budget
+        )
+
         # 准备LLM请求数据
         llm_data = {
             "question": request.question,
             "category": request.category,
-            "context": request.context or {}
+            "context": request.context or {},
+            "retrieved_context": retrieved_context
         }
         
         # 调用LLM，传递CLI的API配置
@@ -33,13 +42,15 @@ async def intelligent_qa(request: IntelligentQARequest):
             return IntelligentQAResponse(
                 answer=result.get("answer", response_text),
                 related_topics=result.get("related_topics", []),
-                suggested_actions=result.get("suggested_actions", [])
+                suggested_actions=result.get("suggested_actions", []),
+                sources=sources
             )
         except json.JSONDecodeError:
             return IntelligentQAResponse(
                 answer=response_text,
                 related_topics=[],
-                suggested_actions=[]
+                suggested_actions=[],
+                sources=sources
             )
     except Exception as e:
         return IntelligentQAResponse(
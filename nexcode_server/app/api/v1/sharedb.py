@@ -5,11 +5,14 @@ from pydantic import BaseModel
 from datetime import datetime, timedelta
 import hashlib
 
+from app.core.config import settings
 from app.core.dependencies import get_current_user, get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.services.sharedb_service import get_sharedb_service, ShareDBService
 from app.models.database import User
 from app.services.document_service import DocumentService
+from app.services.permission_service import permission_service
+from app.models.database import PermissionLevel
 
 logger = logging.getLogger(__name__)
 
@@ -17,13 +20,23 @@ router = APIRouter()
 
 class DocumentSyncRequest(BaseModel):
     doc_id: str
-    version: int
-    content: str
+    version: int  # 增量同步时为差异所基于的版本
+    content: Optional[str] = None  # 全量同步时的整篇内容
     create_version: bool = True  # 新增参数
+    # 增量同步：基准内容的 sha256 和 ot.js 格式的差异，如 [12, "abc", -3]
+    base_hash: Optional[str] = None
+    delta: Optional[List[Any]] = None
 
 class OperationRequest(BaseModel):
     doc_id: str
     operation: Dict[str, Any]
+    return_content: bool = True  # 为 False 时响应不带整篇内容，避免每次按键复制文档
+
+class OperationBatchRequest(BaseModel):
+    doc_id: str
+    base_version: int  # operations 中的第一个操作基于的版本，后续操作依次基于前一个
+    operations: List[Dict[str, Any]]
+    return_content: bool = False
 
 class DocumentResponse(BaseModel):
     doc_id: str
@@ -31,13 +44,26 @@ class DocumentResponse(BaseModel):
     version: int
     created_at: str
     updated_at: str
+    content_hash: Optional[str] = None
 
 class SyncResponse(BaseModel):
     success: bool
     version: int
-    content: str
+    content: Optional[str] = None  # 增量同步成功时不返回整篇内容
     operations: List[Dict[str, Any]]
     error: Optional[str] = None
+    mode: str = "full"
+    content_hash: Optional[str] = None
+
+class OperationBatchResponse(BaseModel):
+    success: bool
+    version: Optional[int] = None
+    applied: int = 0
+    operations: List[Dict[str, Any]] = []  # 实际提交的操作（已变换到最新版本之后）
+    remote_operations: List[Dict[str, Any]] = []  # base_version 之后的已提交操作，变换到本批操作之后
+    content: Optional[str] = None
+    error: Optional[str] = None
+    current_version: Optional[int] = None
 
 class OperationResponse(BaseModel):
     success: bool
@@ -73,7 +99,22 @@ async def sync_document(
     current_user: Annotated[User, Depends(get_current_user)],
     db: Annotated[Any, Depends(get_db)]
 ):
-    """同步文档，智能版本控制"""
+    """同步文档，智能版本控制；带 delta 时为增量同步，基准哈希不符时返回整篇内容要求全量同步"""
+    if request.delta is not None:
+        if not request.base_hash:
+            raise HTTPException(status_code=400, detail="Delta sync requires base_hash")
+        result = await get_sharedb_service().sync_delta(
+            doc_id=request.doc_id,
+            base_version=request.version,
+            base_hash=request.base_hash,
+            delta=request.delta,
+            user_id=current_user.id,
+            create_version=request.create_version,
+            db_session=db
+        )
+        return SyncResponse(**result)
+    if request.content is None:
+        raise HTTPException(status_code=400, detail="Full sync requires content")
     try:
         # 调用 ShareDB 服务同步
         result = await get_sharedb_service().sync_document(
@@ -108,7 +149,8 @@ async def apply_operation(
         result = await sharedb.apply_operation(
             doc_id=request.doc_id,
             operation=request.operation,
-            user_id=current_user.id
+            user_id=current_user.id,
+            return_content=request.return_content
         )
         
         # 确保响应格式正确
@@ -130,6 +172,34 @@ async def apply_operation(
             error=f"操作失败: {str(e)}"
         )
 
+@router.post("/documents/operations/batch", response_model=OperationBatchResponse)
+async def apply_operation_batch(
+    request: OperationBatchRequest,
+    current_user: User = Depends(get_current_user),
+    sharedb: ShareDBService = Depends(get_sharedb_service),
+    db: AsyncSession = Depends(get_db)
+):
+    """批量提交操作（离线重连时一次提交排队的编辑）"""
+    if len(request.operations) > settings.SHAREDB_MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"最多一次提交 {settings.SHAREDB_MAX_BATCH_OPERATIONS} 个操作"
+        )
+    # 只有所有者和有编辑权限的协作者可以提交操作
+    has_permission = request.doc_id.isdigit() and await permission_service.check_document_permission(
+        db, current_user.id, int(request.doc_id), PermissionLevel.EDITOR
+    )
+    if not has_permission:
+        raise HTTPException(status_code=403, detail="无权限编辑此文档")
+    result = await sharedb.apply_operations(
+        doc_id=request.doc_id,
+        base_version=request.base_version,
+        operations=request.operations,
+        user_id=current_user.id,
+        return_content=request.return_content
+    )
+    return OperationBatchResponse(**result)
+
 @router.get("/documents/{doc_id}/operations")
 async def get_operations(
     doc_id: str,
@@ -156,18 +226,26 @@ async def create_snapshot(
     current_user: User = Depends(get_current_user),
     sharedb: ShareDBService = Depends(get_sharedb_service)
 ):
-    """创建文档快照（可用于备份或版本控制）"""
+    """创建文档快照（可用于备份或版本控制），并压缩快照之前的操作日志"""
     try:
-        document = await sharedb.get_document(doc_id)
+        snapshot = await sharedb.take_snapshot(doc_id)
+        if not snapshot:
+            raise HTTPException(status_code=404, detail="Document not found")
+        operations_removed = await sharedb.compact_document(doc_id, snapshot)
         
-        # 这里可以添加快照逻辑，比如保存到另一个集合
-        # 目前简单返回当前文档状态
         return {
             "success": True,
-            "snapshot": document,
+            "snapshot": {
+                "doc_id": doc_id,
+                "content": snapshot["content"],
+                "version": snapshot["version"]
+            },
+            "operations_removed": operations_removed,
             "created_by": current_user.id,
-            "created_at": document["updated_at"]
+            "created_at": snapshot["created_at"].isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to create snapshot for {doc_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to create snapshot")
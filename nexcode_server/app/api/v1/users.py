@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, Response, Request
+from fastapi import APIRouter, HTTPException, status, Query, Response, Request
 from typing import List, Optional
 from datetime import timedelta
 
 from app.core.dependencies import CurrentUser, CurrentSuperUser, DatabaseSession
+from app.core.pagination import set_page_headers
+from app.services.auth_cache import auth_cache
 from app.services.auth_service import auth_service
+from app.services.search_service import search_service
 from app.models.user_schemas import (
     UserResponse, UserUpdate, UserProfile, UserCASLogin, Token,
     APIKeyCreate, APIKeyResponse, APIKeyWithToken, UserSessionResponse,
@@ -40,6 +43,7 @@ async def update_current_user(
     
     await db.commit()
     await db.refresh(current_user)
+    await auth_cache.invalidate_user(current_user.id)
     return current_user
 
 @router.get("/me/sessions", response_model=List[UserSessionResponse])
@@ -82,6 +86,7 @@ async def revoke_user_session(
     
     session.is_active = False
     await db.commit()
+    await auth_cache.invalidate_user(current_user.id)
     
     return {"message": "Session revoked successfully"}
 
@@ -147,6 +152,7 @@ async def revoke_user_api_key(
     
     api_key.is_active = False
     await db.commit()
+    await auth_cache.invalidate_user(current_user.id)
     
     return {"message": "API key revoked successfully"}
 
@@ -157,25 +163,8 @@ async def search_users(
     q: str = "",
     limit: int = 10
 ):
-    """搜索用户（用于组织邀请等场景）"""
-    from sqlalchemy import select, or_
-    from app.models.database import User
-    
-    if not q.strip():
-        return []
-    
-    # 搜索用户名、邮箱或全名
-    stmt = select(User).where(
-        or_(
-            User.username.ilike(f"%{q}%"),
-            User.email.ilike(f"%{q}%"),
-            User.full_name.ilike(f"%{q}%") if User.full_name else False
-        ),
-        User.is_active == True
-    ).limit(limit)
-    
-    result = await db.execute(stmt)
-    users = result.scalars().all()
+    """搜索用户（用于组织邀请等场景），前缀匹配优先"""
+    users = await search_service.search_users(db, q, min(limit, 50))
     
     return [
         {
@@ -215,29 +204,16 @@ async def get_available_token_scopes():
 async def list_users(
     admin_user: CurrentSuperUser,
     db: DatabaseSession,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标，提供时忽略 skip")
 ):
-    """获取用户列表（管理员）"""
-    from sqlalchemy import select, or_
-    from app.models.database import User
-    
-    stmt = select(User)
-    
-    if search:
-        search_filter = or_(
-            User.username.contains(search),
-            User.email.contains(search),
-            User.full_name.contains(search)
-        )
-        stmt = stmt.where(search_filter)
-    
-    stmt = stmt.offset(skip).limit(limit).order_by(User.created_at.desc())
-    
-    result = await db.execute(stmt)
-    users = result.scalars().all()
-    return users
+    """获取用户列表（管理员，下一页游标和总数见响应头）"""
+    result = await search_service.list_users(db, search, skip, limit, cursor)
+    set_page_headers(response, result["next_cursor"], result["total"])
+    return result["users"]
 
 @router.get("/{user_id}", response_model=UserProfile)
 async def get_user_by_id(
@@ -285,6 +261,7 @@ async def update_user_by_id(
     
     await db.commit()
     await db.refresh(user)
+    await auth_cache.invalidate_user(user.id)
     return user
 
 @router.delete("/{user_id}")
@@ -303,6 +280,7 @@ async def deactivate_user(
     
     user.is_active = False
     await db.commit()
+    await auth_cache.invalidate_user(user.id)
     
     return {"message": f"User {user.username} deactivated successfully"} 
 
@@ -340,9 +318,11 @@ async def admin_create_user(
 async def admin_list_users_alias(
     admin_user: CurrentSuperUser,
     db: DatabaseSession,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    cursor: Optional[str] = None
 ):
     """获取用户列表（管理员）老接口兼容"""
-    return await list_users(admin_user, db, skip, limit, search) 
\ No newline at end of file
+    return await list_users(admin_user, db, response, skip, limit, search, cursor)
\ No newline at end of file
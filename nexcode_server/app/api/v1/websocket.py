@@ -1,13 +1,13 @@
 import json
 import logging
 from typing import Optional
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query
 from app.services.collaboration_service import collaboration_manager
+from app.services.ws_protocol import DECODE_ERRORS, MSGPACK_SUBPROTOCOL, negotiate
 from app.services.permission_service import permission_service
-from app.core.dependencies import get_current_user_ws, get_db
-from app.models.database import User, PermissionLevel
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from app.core.database import AsyncSessionLocal
+from app.core.dependencies import get_current_user_ws
+from app.models.database import PermissionLevel
 
 router = APIRouter()
 
@@ -18,63 +18,61 @@ logger = logging.getLogger(__name__)
 async def websocket_collaborate(
     websocket: WebSocket, 
     document_id: int,
-    token: Optional[str] = Query(None)
+    token: Optional[str] = Query(None),
+    protocol: Optional[str] = Query(None)
 ):
-    """文档协作WebSocket端点"""
+    """文档协作WebSocket端点
+
+    客户端可通过子协议 nexcode.msgpack.v1（或 protocol=msgpack 查询参数）启用二进制协议，
+    否则使用 JSON 文本协议
+    """
     user_id = None
     user = None
-    db = None
+    session_id = None
     
     try:
-        # 先接受WebSocket连接
-        await websocket.accept()
+        # 协商消息编码后接受WebSocket连接
+        requested_subprotocols = websocket.scope.get("subprotocols", [])
+        codec = negotiate(requested_subprotocols, protocol)
+        await websocket.accept(
+            subprotocol=MSGPACK_SUBPROTOCOL if MSGPACK_SUBPROTOCOL in requested_subprotocols else None
+        )
         
         # 验证用户身份
         if not token:
             await websocket.close(code=1008, reason="Missing token")
             return
             
-        # 获取数据库会话
-        async for session in get_db():
-            db = session
-            break
-            
-        # 验证用户
-        try:
-            user_id = await get_current_user_ws(websocket, token, db)
-            if not user_id:
-                await websocket.close(code=1008, reason="Invalid token")
+        # 认证和权限检查使用短生命周期的会话，缓存命中时不访问数据库
+        async with AsyncSessionLocal() as db:
+            # 验证用户
+            try:
+                user = await get_current_user_ws(websocket, token, db)
+                user_id = user.id
+            except HTTPException:
                 return
-                
-            # 获取用户信息
-            result = await db.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
-            if not user:
-                await websocket.close(code=1008, reason="User not found")
+            except Exception as e:
+                logger.error(f"Authentication error: {e}")
+                await websocket.close(code=1008, reason="Authentication failed")
                 return
                 
-        except Exception as e:
-            logger.error(f"Authentication error: {e}")
-            await websocket.close(code=1008, reason="Authentication failed")
-            return
-            
-        # 检查文档权限
-        try:
-            logger.info(f"检查用户 {user_id} 对文档 {document_id} 的权限...")
-            has_permission = await permission_service.check_document_permission(
-                db, user_id, document_id, PermissionLevel.READER
-            )
-            if not has_permission:
-                logger.warning(f"用户 {user_id} 没有文档 {document_id} 的权限")
-                await websocket.close(code=1008, reason="No permission")
-                return
-            logger.info(f"用户 {user_id} 权限检查通过")
-        except Exception as e:
-            logger.error(f"权限检查错误: {e}")
-            # 暂时跳过权限检查，继续执行
-            logger.warning("暂时跳过权限检查，继续执行...")
-            # await websocket.close(code=1008, reason="Permission denied")
-            # return
+            # 检查文档权限
+            try:
+                logger.info(f"检查用户 {user_id} 对文档 {document_id} 的权限...")
+                has_permission = await permission_service.check_document_permission(
+                    db, user_id, document_id, PermissionLevel.READER
+                )
+                if not has_permission:
+                    logger.warning(f"用户 {user_id} 没有文档 {document_id} 的权限")
+                    await websocket.close(code=1008, reason="No permission")
+                    return
+                logger.info(f"用户 {user_id} 权限检查通过")
+            except Exception as e:
+                logger.error(f"权限检查错误: {e}")
+                # 暂时跳过权限检查，继续执行
+                logger.warning("暂时跳过权限检查，继续执行...")
+                # await websocket.close(code=1008, reason="Permission denied")
+                # return
             
         # 更新用户信息缓存
         logger.info(f"更新用户 {user_id} 的信息缓存...")
@@ -84,23 +82,21 @@ async def websocket_collaborate(
             "email": user.email
         })
         
-        # 连接到协作管理器
+        # 连接到协作管理器：注册会话的同时入队连接成功消息，
+        # 附带当前内容和修订号作为增量操作的基准
         logger.info(f"连接到协作管理器...")
-        session_id = await collaboration_manager.connect(websocket, document_id, user_id)
-        
-        logger.info(f"User {user.username} connected to document {document_id}")
-        
-        # 发送连接成功消息
-        logger.info(f"发送连接成功消息...")
-        await websocket.send_text(json.dumps({
+        session_id = await collaboration_manager.connect(websocket, document_id, user_id, codec, welcome={
             "type": "connected",
             "message": "Connection successful",
             "user": {
                 "id": user.id,
                 "username": user.username,
                 "email": user.email
-            }
-        }))
+            },
+            "protocol": codec.name
+        })
+        
+        logger.info(f"User {user.username} connected to document {document_id}")
         
         # 发送当前在线用户列表
         logger.info(f"发送在线用户列表...")
@@ -111,45 +107,22 @@ async def websocket_collaborate(
         # 消息处理循环
         while True:
             try:
-                data = await websocket.receive_text()
-                logger.info(f"收到消息: {data[:100]}...")
-                message = json.loads(data)
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+                data = frame.get("bytes") if frame.get("bytes") is not None else frame.get("text")
+                # 一帧可能包含多条消息（批量发送）
+                messages = codec.decode(data)
+                logger.info(f"收到 {len(messages)} 条消息")
                 
-                # 处理不同类型的消息
-                if message.get("type") == "operation":
-                    logger.info(f"处理操作消息...")
-                    # 处理文档操作
-                    await collaboration_manager.handle_operation(
-                        document_id, user_id, message.get("operation", {})
-                    )
-                    
-                elif message.get("type") == "content_update":
-                    logger.info(f"处理内容更新消息...")
-                    # 处理完整内容更新
-                    await collaboration_manager.handle_content_update(
-                        document_id, user_id, message.get("content", ""), session_id
-                    )
-                    
-                elif message.get("type") == "cursor":
-                    logger.info(f"处理光标消息...")
-                    # 处理光标位置
-                    await collaboration_manager.broadcast_cursor_position(
-                        document_id, user_id, message.get("position", {})
-                    )
-                    
-                elif message.get("type") == "ping":
-                    logger.info(f"处理心跳消息...")
-                    # 心跳检测
-                    await websocket.send_text(json.dumps({"type": "pong"}))
-                    logger.debug(f"User {user_id} sent ping, responded with pong")
-                    
-                else:
-                    # 未知消息类型
-                    logger.warning(f"Unknown message type: {message.get('type')}")
+                for message in messages:
+                    await handle_message(document_id, user_id, session_id, message)
                     
-            except json.JSONDecodeError:
-                logger.error("Invalid JSON message")
+            except DECODE_ERRORS:
+                logger.error("Invalid message frame")
                 continue
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"Message processing error: {e}")
                 break
@@ -165,6 +138,39 @@ async def websocket_collaborate(
             logger.info(f"User {user_id} disconnected from document {document_id}, session {session_id}")
 
 
+async def handle_message(document_id: int, user_id: int, session_id: str, message: dict):
+    """处理单条客户端消息"""
+    # 处理不同类型的消息
+    if message.get("type") == "operation":
+        logger.info(f"处理操作消息...")
+        # 处理文档操作
+        await collaboration_manager.handle_operation(
+            document_id, user_id, message.get("operation", {}), session_id
+        )
+        
+    elif message.get("type") == "content_update":
+        logger.info(f"处理内容更新消息...")
+        # 处理完整内容更新
+        await collaboration_manager.handle_content_update(
+            document_id, user_id, message.get("content", ""), session_id
+        )
+        
+    elif message.get("type") == "cursor":
+        # 处理光标位置
+        await collaboration_manager.broadcast_cursor_position(
+            document_id, user_id, message.get("position", {}), session_id
+        )
+        
+    elif message.get("type") == "ping":
+        # 心跳检测
+        await collaboration_manager.send_to_session(document_id, session_id, {"type": "pong"})
+        logger.debug(f"User {user_id} sent ping, responded with pong")
+        
+    else:
+        # 未知消息类型
+        logger.warning(f"Unknown message type: {message.get('type')}")
+
+
 # 添加一个简单的HTTP端点来测试路由
 @router.get("/test")
 async def test_route():
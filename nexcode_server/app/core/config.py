@@ -19,9 +19,95 @@ class Settings:
     
     # Redis 配置
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # MongoDB（ShareDB）配置
+    MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+    SHAREDB_DB_NAME: str = os.getenv("SHAREDB_DB_NAME", "nexcode_sharedb")
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))  # 连接池上限
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))  # 连接池保持的最少连接
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "3000"))  # 选择服务器超时（毫秒）
+    MONGODB_OPERATION_TIMEOUT_MS: int = int(os.getenv("MONGODB_OPERATION_TIMEOUT_MS", "5000"))  # 单次操作超时（毫秒）
+    SHAREDB_SNAPSHOT_EVERY_OPS: int = int(os.getenv("SHAREDB_SNAPSHOT_EVERY_OPS", "200"))  # 距上次快照累计多少个操作后生成新快照
+    SHAREDB_SNAPSHOT_INTERVAL: int = int(os.getenv("SHAREDB_SNAPSHOT_INTERVAL", "3600"))  # 有新操作时快照的最长间隔（秒）
+    SHAREDB_OPLOG_RETAIN_OPS: int = int(os.getenv("SHAREDB_OPLOG_RETAIN_OPS", "500"))  # 快照之前最多保留的操作条数
+    SHAREDB_OPLOG_RETAIN_SECONDS: int = int(os.getenv("SHAREDB_OPLOG_RETAIN_SECONDS", "604800"))  # 快照之前操作的最长保留时间（秒）
+    SHAREDB_COMPACTION_INTERVAL: int = int(os.getenv("SHAREDB_COMPACTION_INTERVAL", "300"))  # 后台压缩任务运行间隔（秒）
+    SHAREDB_COMPACTION_BATCH_SIZE: int = int(os.getenv("SHAREDB_COMPACTION_BATCH_SIZE", "100"))  # 压缩任务每批扫描的文档数
+    SHAREDB_HOT_FLUSH_DEBOUNCE: float = float(os.getenv("SHAREDB_HOT_FLUSH_DEBOUNCE", "1.0"))  # 热文档停止修改多久后写回（秒）
+    SHAREDB_HOT_FLUSH_MAX_DELAY: float = float(os.getenv("SHAREDB_HOT_FLUSH_MAX_DELAY", "5.0"))  # 热文档首次修改后最长多久必须写回（秒）
+    SHAREDB_HOT_IDLE_SECONDS: int = int(os.getenv("SHAREDB_HOT_IDLE_SECONDS", "300"))  # 空闲多久后回收热文档缓冲（秒）
+    SHAREDB_HOT_MAX_DOCUMENTS: int = int(os.getenv("SHAREDB_HOT_MAX_DOCUMENTS", "1000"))  # 常驻内存的热文档上限
+    SHAREDB_MAX_BATCH_OPERATIONS: int = int(os.getenv("SHAREDB_MAX_BATCH_OPERATIONS", "1000"))  # 批量提交接口单次最多操作数
+    SHAREDB_DELTA_HASH_HISTORY: int = int(os.getenv("SHAREDB_DELTA_HASH_HISTORY", "64"))  # 每篇热文档记录最近多少个版本的内容哈希（增量同步校验基准）
+    
+    # 分布式文档租约配置
+    LEASE_TTL_MS: int = int(os.getenv("LEASE_TTL_MS", "10000"))  # 租约过期时间（毫秒），持有期间自动续期
+    LEASE_ACQUIRE_TIMEOUT: float = float(os.getenv("LEASE_ACQUIRE_TIMEOUT", "5.0"))  # 等待租约的最长时间（秒）
+    LEASE_LINGER: float = float(os.getenv("LEASE_LINGER", "0.25"))  # 释放后保留租约以便复用的时间（秒），0 表示立即释放
+    LEASE_LOCAL_CACHE_SIZE: int = int(os.getenv("LEASE_LOCAL_CACHE_SIZE", "1000"))  # 本地锁表的容量上限
     
     # 认证配置
     API_TOKEN: Optional[str] = os.getenv("API_TOKEN")
     REQUIRE_AUTH: bool = os.getenv("REQUIRE_AUTH", "False").lower() == "true"
+    
+    # 问答上下文检索配置
+    RETRIEVAL_TOP_K: int = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+    RETRIEVAL_TOKEN_BUDGET: int = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1500"))
+    RETRIEVAL_MAX_COMMITS: int = int(os.getenv("RETRIEVAL_MAX_COMMITS", "2000"))
+    RETRIEVAL_MAX_USERS: int = int(os.getenv("RETRIEVAL_MAX_USERS", "200"))
+    
+    # 列表分页配置
+    COUNT_CACHE_TTL: float = float(os.getenv("COUNT_CACHE_TTL", "60"))  # 列表总数缓存多久后在后台重新计数（秒）
+    COUNT_CACHE_SIZE: int = int(os.getenv("COUNT_CACHE_SIZE", "1000"))  # 缓存的计数查询数量上限
+    
+    # 文档全文搜索配置
+    DOCUMENT_SEARCH_DEBOUNCE: float = float(os.getenv("DOCUMENT_SEARCH_DEBOUNCE", "2.0"))  # 文档停止修改多久后更新搜索索引（秒），查询时会立即索引待更新的文档
+    DOCUMENT_SEARCH_TITLE_WEIGHT: float = float(os.getenv("DOCUMENT_SEARCH_TITLE_WEIGHT", "2.0"))  # 标题命中得分相对正文的权重
+    DOCUMENT_SEARCH_SNIPPET_CHARS: int = int(os.getenv("DOCUMENT_SEARCH_SNIPPET_CHARS", "160"))  # 搜索结果摘要长度（字符）
+    DOCUMENT_SEARCH_MAX_LOADS: int = int(os.getenv("DOCUMENT_SEARCH_MAX_LOADS", "200"))  # 单次查询最多从 ShareDB 补充索引的文档数
+    
+    # 协作编辑配置
+    OT_HISTORY_SIZE: int = int(os.getenv("OT_HISTORY_SIZE", "500"))  # 每个文档保留的操作历史窗口
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))  # 每个连接的发送队列长度
+    WS_SEND_TIMEOUT: float = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # 单条消息发送超时（秒）
+    WS_MAX_QUEUE_OVERFLOWS: int = int(os.getenv("WS_MAX_QUEUE_OVERFLOWS", "3"))  # 超过该溢出次数后断开慢连接
+    WS_BATCH_WINDOW: float = float(os.getenv("WS_BATCH_WINDOW", "0.01"))  # 二进制协议批量发送的等待窗口（秒）
+    WS_BATCH_MAX_MESSAGES: int = int(os.getenv("WS_BATCH_MAX_MESSAGES", "64"))  # 每帧最多合并的消息数
+    WS_PER_MESSAGE_DEFLATE: bool = os.getenv("WS_PER_MESSAGE_DEFLATE", "True").lower() == "true"  # 启用 permessage-deflate 压缩
+    COLLAB_BUS_ENABLED: bool = os.getenv("COLLAB_BUS_ENABLED", "True").lower() == "true"  # 通过Redis在多个worker间同步协作
+    COLLAB_SNAPSHOT_INTERVAL: int = int(os.getenv("COLLAB_SNAPSHOT_INTERVAL", "100"))  # 每多少个修订保存一次共享快照，需小于 OT_HISTORY_SIZE
+    COLLAB_STATE_TTL: int = int(os.getenv("COLLAB_STATE_TTL", "86400"))  # Redis中协作状态的过期时间（秒）
+    PRESENCE_CURSOR_HZ: int = int(os.getenv("PRESENCE_CURSOR_HZ", "20"))  # 光标合并发送频率
+    PRESENCE_HEARTBEAT_INTERVAL: float = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", "10"))  # 在线状态心跳间隔（秒）
+    PRESENCE_TTL: int = int(os.getenv("PRESENCE_TTL", "30"))  # 超过该时间未心跳视为离线（秒）
+    DOCUMENT_SAVE_DEBOUNCE: float = float(os.getenv("DOCUMENT_SAVE_DEBOUNCE", "1.0"))  # 文档停止编辑多久后写入数据库（秒）
+    DOCUMENT_SAVE_MAX_DELAY: float = float(os.getenv("DOCUMENT_SAVE_MAX_DELAY", "5.0"))  # 持续编辑时的最长写入延迟（秒）
+    DOCUMENT_SAVE_MAX_PENDING_OPS: int = int(os.getenv("DOCUMENT_SAVE_MAX_PENDING_OPS", "10000"))  # 缓冲的操作记录上限，超过后新操作等待或被拒绝
+    DOCUMENT_SAVE_BACKPRESSURE_TIMEOUT: float = float(os.getenv("DOCUMENT_SAVE_BACKPRESSURE_TIMEOUT", "2.0"))  # 缓冲已满时的最长等待（秒），超时后拒绝操作
+    DOCUMENT_SAVE_MAX_ATTEMPTS: int = int(os.getenv("DOCUMENT_SAVE_MAX_ATTEMPTS", "5"))  # 单个文档写入失败的最大尝试次数，之后转入死信
+    DOCUMENT_SAVE_DRAIN_TIMEOUT: float = float(os.getenv("DOCUMENT_SAVE_DRAIN_TIMEOUT", "15"))  # 关闭时写完缓冲的最长时间（秒）
+    DOCUMENT_VERSION_INTERVAL: int = int(os.getenv("DOCUMENT_VERSION_INTERVAL", "600"))  # 自动版本快照的时间间隔（秒）
+    DOCUMENT_VERSION_CHANGE_THRESHOLD: int = int(os.getenv("DOCUMENT_VERSION_CHANGE_THRESHOLD", "2000"))  # 累计变更字符数达到该值时创建版本快照
+    DOCUMENT_VERSION_KEYFRAME_INTERVAL: int = int(os.getenv("DOCUMENT_VERSION_KEYFRAME_INTERVAL", "20"))  # 每隔多少个版本保存一份完整内容，其余版本保存反向差异
+    DOCUMENT_VERSION_CACHE_SIZE: int = int(os.getenv("DOCUMENT_VERSION_CACHE_SIZE", "256"))  # 还原出的版本内容 LRU 缓存条数
+    DIFF_WORKERS: int = int(os.getenv("DIFF_WORKERS", "2"))  # 计算版本差异的进程数，0 表示在事件循环中计算
+    DIFF_INLINE_MAX_CHARS: int = int(os.getenv("DIFF_INLINE_MAX_CHARS", "20000"))  # 两个版本总字符数不超过该值时直接计算，不进入进程池
+    DIFF_TIMEOUT: float = float(os.getenv("DIFF_TIMEOUT", "5.0"))  # 单次差异计算的时间上限（秒），超时部分按整体替换显示
+    DIFF_CACHE_SIZE: int = int(os.getenv("DIFF_CACHE_SIZE", "128"))  # 版本差异结果缓存条数
+    AUTH_PRINCIPAL_CACHE_TTL: int = int(os.getenv("AUTH_PRINCIPAL_CACHE_TTL", "30"))  # 令牌解析结果缓存时间（秒）
+    AUTH_PERMISSION_CACHE_TTL: int = int(os.getenv("AUTH_PERMISSION_CACHE_TTL", "60"))  # 文档权限缓存时间（秒）
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))  # 每类缓存的最大条目数
+    AUTH_BCRYPT_ROUNDS: int = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))  # bcrypt 成本因子，修改后用户下次登录时按新成本重新哈希
+    AUTH_HASH_WORKERS: int = int(os.getenv("AUTH_HASH_WORKERS", "4"))  # 计算密码哈希的线程数，0 表示在事件循环中计算
+    DOCUMENT_CACHE_TTL: int = int(os.getenv("DOCUMENT_CACHE_TTL", "60"))  # 文档元数据和内容快照缓存时间（秒）
+    DOCUMENT_CACHE_MAX_ENTRIES: int = int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "2000"))  # 缓存的文档数上限
+    API_KEY_USAGE_FLUSH_INTERVAL: float = float(os.getenv("API_KEY_USAGE_FLUSH_INTERVAL", "10"))  # API 密钥使用统计批量写回数据库的间隔（秒）
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"  # 是否启用请求限流
+    RATE_LIMIT_USER_PER_HOUR: int = int(os.getenv("RATE_LIMIT_USER_PER_HOUR", "5000"))  # 每个用户每小时的令牌数（API Key 另按其 rate_limit 限制）
+    RATE_LIMIT_IP_PER_HOUR: int = int(os.getenv("RATE_LIMIT_IP_PER_HOUR", "1000"))  # 未认证请求每个 IP 每小时的令牌数
+    RATE_LIMIT_LLM_COST: int = int(os.getenv("RATE_LIMIT_LLM_COST", "10"))  # 调用大模型的接口每次消耗的令牌数（其他接口为 1）
+    RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "False").lower() == "true"  # 是否按 X-Forwarded-For 识别客户端 IP（部署在反向代理后时开启）
+    RATE_LIMIT_REDIS_RETRY: float = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))  # Redis 出错后使用本地令牌桶的时长（秒）
+    RATE_LIMIT_LOCAL_MAX_BUCKETS: int = int(os.getenv("RATE_LIMIT_LOCAL_MAX_BUCKETS", "10000"))  # 本地令牌桶数量上限
 
 settings = Settings() 
@@ -2,8 +2,11 @@ from fastapi import Depends, HTTPException, status, Request, Header, WebSocket,
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, Annotated
+from datetime import datetime, timezone
+from jose import jwt
 
-from app.core.database import get_db
+from app.core.database import AsyncSessionLocal, get_db
+from app.services.auth_cache import Principal, auth_cache
 from app.services.auth_service import auth_service
 from app.models.database import User
 
@@ -11,51 +14,146 @@ from app.models.database import User
 security = HTTPBearer(auto_error=False)
 
 
-async def get_current_user(
-    request: Request,
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: AsyncSession = Depends(get_db),
-) -> User:
-    """获取当前用户（JWT或API Key认证）"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# 各入口接受的令牌类型
+BEARER_TOKEN_KINDS = ("jwt", "api_key")
+SESSION_TOKEN_KINDS = ("session",)
+WS_TOKEN_KINDS = ("session", "jwt", "api_key")
 
-    user = None
 
-    if credentials:
-        token = credentials.credentials
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
 
-        # 首先尝试JWT验证
-        token_data = auth_service.verify_token(token)
-        if token_data and token_data.user_id:
-            user = await auth_service.get_user_by_id(db, token_data.user_id)
 
-        # 如果JWT验证失败，尝试API Key验证
-        if not user:
-            user = await auth_service.verify_api_key(db, token)
+async def _load_principal(
+    db: AsyncSession, token: str, kinds: tuple, record_usage: bool = True
+) -> Optional[Principal]:
+    """按顺序尝试各类令牌，解析出身份"""
+    for kind in kinds:
+        if kind == "jwt":
+            token_data = auth_service.verify_token(token)
+            if token_data and token_data.user_id:
+                user = await auth_service.get_user_by_id(db, token_data.user_id)
+                if user:
+                    expires_at = jwt.get_unverified_claims(token).get("exp")
+                    return Principal(user, "jwt", expires_at=expires_at)
+
+        elif kind == "api_key":
+            api_key = await auth_service.get_active_api_key(db, token)
+            if api_key:
+                if record_usage:
+                    auth_service.record_api_key_usage(api_key.id)
+                user = await auth_service.get_user_by_id(db, api_key.user_id)
+                if user:
+                    return Principal(
+                        user, "api_key",
+                        expires_at=_timestamp(api_key.expires_at),
+                        scopes=api_key.scopes,
+                        api_key_id=api_key.id,
+                        rate_limit=api_key.rate_limit,
+                    )
+
+        elif kind == "session":
+            user = await auth_service.verify_session_token(db, token)
+            if user:
+                return Principal(user, "session")
+    return None
+
+
+async def resolve_principal(
+    db: AsyncSession, token: str, kinds: tuple, record_usage: bool = True
+) -> Optional[Principal]:
+    """解析令牌身份，优先使用缓存"""
+    principal = auth_cache.get_principal(token)
+    if principal is not None and principal.kind in kinds:
+        if principal.api_key_id is not None and record_usage:
+            auth_service.record_api_key_usage(principal.api_key_id)
+        return principal
+
+    generation = auth_cache.generation
+    principal = await _load_principal(db, token, kinds, record_usage)
+    if principal is not None:
+        auth_cache.set_principal(token, principal, generation)
+    return principal
+
+
+def _attach_user(db: AsyncSession, principal: Principal) -> User:
+    """把缓存的用户加入当前请求的会话，后续修改可以直接提交"""
+    existing = db.identity_map.get(db.identity_key(User, principal.user_id))
+    if existing is not None:
+        return existing
+    user = principal.build_user()
+    db.add(user)
+    return user
 
-    # 检查Session Token（从Cookie或Header）
-    if not user:
-        session_token = None
 
-        # 从Cookie获取
-        if "session_token" in request.cookies:
-            session_token = request.cookies["session_token"]
+def _session_token(request: Request) -> Optional[str]:
+    """从Cookie或Header获取Session Token"""
+    if "session_token" in request.cookies:
+        return request.cookies["session_token"]
+    return request.headers.get("X-Session-Token")
 
-        # 从Header获取
-        elif "X-Session-Token" in request.headers:
-            session_token = request.headers["X-Session-Token"]
 
+async def _resolve_request(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials],
+    db: AsyncSession,
+) -> Optional[Principal]:
+    principal = None
+    if credentials:
+        # 先尝试JWT，再尝试API Key
+        principal = await resolve_principal(db, credentials.credentials, BEARER_TOKEN_KINDS)
+
+    # 检查Session Token（从Cookie或Header）
+    if principal is None:
+        session_token = _session_token(request)
         if session_token:
-            user = await auth_service.verify_session_token(db, session_token)
+            principal = await resolve_principal(db, session_token, SESSION_TOKEN_KINDS)
+    return principal
+
+
+async def identify_request(request: Request) -> Optional[Principal]:
+    """在路由依赖之前识别请求身份（供限流使用，不记录 API Key 使用）
+
+    缓存未命中时解析结果会写入缓存，随后的路由依赖直接命中。
+    """
+    candidates = []
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        candidates.append((credentials, BEARER_TOKEN_KINDS))
+    session_token = _session_token(request)
+    if session_token:
+        candidates.append((session_token, SESSION_TOKEN_KINDS))
+    if not candidates:
+        return None
 
-    if not user:
-        raise credentials_exception
+    for token, kinds in candidates:
+        principal = auth_cache.get_principal(token)
+        if principal is not None and principal.kind in kinds:
+            return principal
+    async with AsyncSessionLocal() as db:
+        for token, kinds in candidates:
+            principal = await resolve_principal(db, token, kinds, record_usage=False)
+            if principal is not None:
+                return principal
+    return None
 
-    return user
+
+async def get_current_user(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    """获取当前用户（JWT或API Key认证）"""
+    principal = await _resolve_request(request, credentials, db)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return _attach_user(db, principal)
 
 
 def require_scope(required_scope: str):
@@ -65,50 +163,21 @@ def require_scope(required_scope: str):
         credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
         db: AsyncSession = Depends(get_db),
     ) -> User:
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-        
-        permission_exception = HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Insufficient permissions. Required scope: {required_scope}",
-        )
-
-        user = None
-
-        if credentials:
-            token = credentials.credentials
-
-            # 首先尝试JWT验证
-            token_data = auth_service.verify_token(token)
-            if token_data and token_data.user_id:
-                user = await auth_service.get_user_by_id(db, token_data.user_id)
-                # JWT token暂时默认有所有权限
-                return user
-
-            # 尝试API Key验证并检查权限
-            user = await auth_service.verify_api_key_permission(db, token, required_scope)
-            if user:
-                return user
-
-        # 检查Session Token（默认有完整权限）
-        session_token = None
-        if "session_token" in request.cookies:
-            session_token = request.cookies["session_token"]
-        elif "X-Session-Token" in request.headers:
-            session_token = request.headers["X-Session-Token"]
-
-        if session_token:
-            user = await auth_service.verify_session_token(db, session_token)
-            if user:
-                return user
-
-        if not user:
-            raise credentials_exception
-        else:
-            raise permission_exception
+        principal = await _resolve_request(request, credentials, db)
+        if principal is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        # JWT和Session Token默认有完整权限，API Key检查其权限范围
+        if not principal.has_scope(required_scope):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Insufficient permissions. Required scope: {required_scope}",
+            )
+        return _attach_user(db, principal)
 
     return check_scope
 
@@ -117,30 +186,18 @@ async def get_current_user_ws(
     websocket: WebSocket,
     token: Optional[str] = Query(None),
     db: AsyncSession = Depends(get_db),
-) -> int:
-    """WebSocket认证，返回用户ID"""
+) -> User:
+    """WebSocket认证，依次尝试Session Token、JWT和API Key，返回用户"""
     if not token:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         raise HTTPException(status_code=403, detail="Missing token")
 
-    # 尝试验证session token
-    user = await auth_service.verify_session_token(db, token)
-
-    if not user:
-        # 尝试JWT验证
-        token_data = auth_service.verify_token(token)
-        if token_data and token_data.user_id:
-            user = await auth_service.get_user_by_id(db, token_data.user_id)
-
-    if not user:
-        # 尝试API Key验证
-        user = await auth_service.verify_api_key(db, token)
-
-    if not user or not user.is_active:
+    principal = await resolve_principal(db, token, WS_TOKEN_KINDS)
+    if principal is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         raise HTTPException(status_code=403, detail="Invalid credentials")
 
-    return user.id
+    return _attach_user(db, principal)
 
 
 async def get_current_active_user(
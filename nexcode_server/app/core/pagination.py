@@ -0,0 +1,133 @@
+"""
+列表分页
+游标是不透明的 base64 字符串：按固定排序的列表使用 (排序键, id) 键集游标，
+深翻页也只需沿索引定位；按相关度排序的搜索结果使用偏移游标。
+旧接口的 skip 参数仍然有效，仅在没有游标时生效。
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import and_, asc, desc, literal, or_, tuple_
+from sqlalchemy.sql import Select
+
+# 排序项：(列或表达式, 是否降序)
+OrderBy = Sequence[Tuple[Any, bool]]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "d" in value:
+        return datetime.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    """把分页位置编码为游标"""
+    if "k" in state:
+        state = {**state, "k": [_encode_value(value) for value in state["k"]]}
+    raw = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """解析游标，格式错误时返回 400"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(raw)
+        if not isinstance(state, dict):
+            raise ValueError("cursor must be an object")
+        if "k" in state:
+            state["k"] = [_decode_value(value) for value in state["k"]]
+        elif not isinstance(state.get("o", 0), int) or state.get("o", 0) < 0:
+            raise ValueError("invalid offset")
+        return state
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+class Paginator:
+    """一次分页查询
+
+    apply() 给查询加上排序、游标条件和 limit（多取一条用于判断是否还有下一页），
+    page() 截取当前页并生成下一页游标。keyset=False 时（按相关度等表达式排序）使用偏移游标。
+    """
+
+    def __init__(
+        self,
+        order_by: OrderBy,
+        cursor: Optional[str] = None,
+        limit: int = 20,
+        skip: int = 0,
+        keyset: bool = True,
+    ):
+        self.order_by = list(order_by)
+        self.limit = limit
+        self.keyset = keyset
+        state = decode_cursor(cursor)
+        self.after: Optional[List[Any]] = None
+        self.offset = skip
+        if state is not None:
+            self.offset = state.get("o", 0)
+            if keyset and "k" in state:
+                if len(state["k"]) != len(self.order_by):
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+                self.after = state["k"]
+                self.offset = 0
+
+    def _after_condition(self):
+        """排在游标之后的行：同向排序时用行比较（可直接走复合索引），否则逐列展开"""
+        columns = [column for column, _ in self.order_by]
+        values = [literal(value, column.type) for value, column in zip(self.after, columns)]
+        directions = {descending for _, descending in self.order_by}
+        if len(directions) == 1:
+            if directions.pop():
+                return tuple_(*columns) < tuple_(*values)
+            return tuple_(*columns) > tuple_(*values)
+
+        clauses = []
+        for i, (column, descending) in enumerate(self.order_by):
+            equal = [self.order_by[j][0] == values[j] for j in range(i)]
+            beyond = column < values[i] if descending else column > values[i]
+            clauses.append(and_(*equal, beyond))
+        return or_(*clauses)
+
+    def apply(self, stmt: Select) -> Select:
+        stmt = stmt.order_by(*[
+            desc(column) if descending else asc(column) for column, descending in self.order_by
+        ])
+        if self.after is not None:
+            stmt = stmt.where(self._after_condition())
+        elif self.offset:
+            stmt = stmt.offset(self.offset)
+        return stmt.limit(self.limit + 1)
+
+    def page(self, rows: Sequence[Any]) -> Tuple[List[Any], Optional[str]]:
+        """返回 (当前页, 下一页游标)，没有下一页时游标为 None"""
+        rows = list(rows)
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        if self.keyset:
+            last = rows[-1]
+            return rows, encode_cursor({"k": [getattr(last, column.key) for column, _ in self.order_by]})
+        return rows, encode_cursor({"o": self.offset + self.limit})
+
+
+def set_page_headers(response: Response, next_cursor: Optional[str], total: Optional[int] = None):
+    """返回列表数组的接口通过响应头提供下一页游标和（近似）总数"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
@@ -0,0 +1,111 @@
+"""
+请求限流中间件
+按调用方选择令牌桶（API Key 请求同时受该 Key 的 rate_limit 和所属用户的限额约束，
+JWT / 会话请求受用户限额约束，未认证请求按客户端 IP 限制），按路由权重扣除令牌。
+响应附带 RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset / RateLimit-Policy 头，
+超出限额时返回 429 和 Retry-After。
+"""
+
+import logging
+from typing import List
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.dependencies import identify_request
+from app.services.rate_limiter import Bucket, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+
+# 不限流的路径（健康检查和文档）
+EXEMPT_PATHS = {"/", "/health", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json"}
+
+# 调用大模型的接口（路径前缀），每次消耗 RATE_LIMIT_LLM_COST 个令牌
+LLM_ROUTES = (
+    "/v1/commit-message",
+    "/v1/code-review",
+    "/v1/commit-qa",
+    "/v1/git-error-analysis",
+    "/v1/code-quality-check",
+    "/v1/push-strategy",
+    "/v1/intelligent-qa",
+    "/v1/repository-analysis",
+    "/v1/chat/completions",
+    "/v1/completions",
+    "/v1/ai/assist",
+)
+
+
+def route_cost(method: str, path: str) -> int:
+    """请求消耗的令牌数"""
+    if method == "POST" and path.startswith(LLM_ROUTES):
+        return settings.RATE_LIMIT_LLM_COST
+    return 1
+
+
+def client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def request_buckets(request: Request) -> List[Bucket]:
+    """请求需要扣除令牌的桶"""
+    try:
+        principal = await identify_request(request)
+    except Exception as e:
+        # 身份无法解析时按匿名请求限流，由路由依赖返回具体的认证错误
+        logger.error(f"Failed to identify request for rate limiting: {e}")
+        principal = None
+
+    if principal is None:
+        return [Bucket(f"ratelimit:ip:{client_ip(request)}", settings.RATE_LIMIT_IP_PER_HOUR, HOUR)]
+
+    buckets = []
+    if principal.api_key_id is not None and principal.rate_limit:
+        buckets.append(Bucket(f"ratelimit:key:{principal.api_key_id}", principal.rate_limit, HOUR))
+    buckets.append(Bucket(f"ratelimit:user:{principal.user_id}", settings.RATE_LIMIT_USER_PER_HOUR, HOUR))
+    return buckets
+
+
+class RateLimitMiddleware:
+    """令牌桶限流（纯 ASGI 中间件，不缓冲流式响应，WebSocket 不经过限流）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or not settings.RATE_LIMIT_ENABLED
+            or scope["method"] == "OPTIONS"
+            or scope["path"] in EXEMPT_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        decision = await rate_limiter.hit(
+            await request_buckets(request), route_cost(scope["method"], scope["path"])
+        )
+        headers = decision.headers()
+        if not decision.allowed:
+            response = JSONResponse(
+                {"detail": "Rate limit exceeded"}, status_code=429, headers=headers
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -1,3 +1,7 @@
+import json
+import time
+from typing import Dict, Iterable, List
+
 import redis.asyncio as redis
 from app.core.config import settings
 
@@ -18,21 +22,70 @@ class RedisClient:
         key = f"doc_lock:{document_id}"
         return await self.redis.get(key)
 
-    async def add_online_user(self, document_id: int, user_id: int):
+    @staticmethod
+    def _online_key(document_id: int) -> str:
+        # 有序集合：成员为用户ID，分数为最近一次心跳时间
+        return f"online_users:{document_id}"
+
+    @staticmethod
+    def _online_info_key(document_id: int) -> str:
+        return f"online_users:{document_id}:info"
+
+    async def add_online_user(self, document_id: int, user_id: int, user_info: dict = None, ttl: int = 30):
         """添加在线用户"""
-        key = f"online_users:{document_id}"
-        await self.redis.sadd(key, user_id)
-        await self.redis.expire(key, 3600)  # 1小时过期
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(self._online_key(document_id), {user_id: time.time()})
+            pipe.expire(self._online_key(document_id), ttl * 2)
+            if user_info is not None:
+                pipe.hset(self._online_info_key(document_id), user_id, json.dumps(user_info))
+                pipe.expire(self._online_info_key(document_id), ttl * 2)
+            await pipe.execute()
 
     async def remove_online_user(self, document_id: int, user_id: int):
         """移除在线用户"""
-        key = f"online_users:{document_id}"
-        await self.redis.srem(key, user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(self._online_key(document_id), user_id)
+            pipe.hdel(self._online_info_key(document_id), user_id)
+            await pipe.execute()
+
+    async def refresh_online_users(self, presence: Dict[int, Iterable[int]], ttl: int = 30):
+        """批量心跳：一次往返刷新所有文档的在线用户，并清理超时未心跳的用户"""
+        if not presence:
+            return
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for document_id, user_ids in presence.items():
+                key = self._online_key(document_id)
+                members = {user_id: now for user_id in user_ids}
+                if members:
+                    pipe.zadd(key, members)
+                pipe.zremrangebyscore(key, "-inf", now - ttl)
+                pipe.expire(key, ttl * 2)
+                pipe.expire(self._online_info_key(document_id), ttl * 2)
+            await pipe.execute()
+
+    async def get_online_users(self, document_id: int, ttl: int = 30) -> List[dict]:
+        """获取在线用户列表（仅包含 ttl 秒内有心跳的用户）"""
+        user_ids = await self.redis.zrangebyscore(self._online_key(document_id), time.time() - ttl, "+inf")
+        if not user_ids:
+            return []
+        infos = await self.redis.hmget(self._online_info_key(document_id), user_ids)
+        return [
+            json.loads(info) if info else {"id": int(user_id), "username": f"User{user_id}"}
+            for user_id, info in zip(user_ids, infos)
+        ]
 
-    async def get_online_users(self, document_id: int):
-        """获取在线用户列表"""
-        key = f"online_users:{document_id}"
-        return await self.redis.smembers(key)
+    async def count_online_users(self, document_ids: Iterable[int], ttl: int = 30) -> Dict[int, int]:
+        """批量统计多个文档的在线用户数"""
+        document_ids = list(document_ids)
+        if not document_ids:
+            return {}
+        since = time.time() - ttl
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for document_id in document_ids:
+                pipe.zcount(self._online_key(document_id), since, "+inf")
+            counts = await pipe.execute()
+        return dict(zip(document_ids, counts))
 
 
 redis_client = RedisClient()
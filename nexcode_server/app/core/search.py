@@ -0,0 +1,58 @@
+"""
+文本搜索条件构建
+PostgreSQL 下依赖 pg_trgm GIN 索引（见 alembic 迁移 add_trigram_search_indexes），
+其他数据库（本地 SQLite）退化为 LIKE 匹配，保证测试可以在本地运行
+"""
+from typing import Sequence
+
+from sqlalchemy import case, func, literal, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+# pg_trgm 按三字符切分，短于该长度的查询无法使用相似度运算
+MIN_TRIGRAM_QUERY_LENGTH = 3
+
+
+def is_postgres(db: AsyncSession) -> bool:
+    """判断当前会话是否连接PostgreSQL"""
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def text_match(db: AsyncSession, columns: Sequence[ColumnElement], query: str) -> ColumnElement:
+    """构建子串/模糊匹配条件
+
+    ILIKE '%q%' 在 PostgreSQL 上可以直接走 gin_trgm_ops 索引；
+    查询足够长时额外用 word_similarity 运算符（<%）匹配拼写相近的结果。
+    """
+    conditions = [column.icontains(query, autoescape=True) for column in columns]
+    if is_postgres(db) and len(query) >= MIN_TRIGRAM_QUERY_LENGTH:
+        conditions.extend(literal(query).op("<%")(column) for column in columns)
+    return or_(*conditions)
+
+
+def prefix_match(columns: Sequence[ColumnElement], query: str) -> ColumnElement:
+    """构建前缀匹配条件（对应 lower(column) text_pattern_ops 索引）"""
+    prefix = query.lower()
+    return or_(*[func.lower(column).startswith(prefix, autoescape=True) for column in columns])
+
+
+def match_rank(db: AsyncSession, columns: Sequence[ColumnElement], query: str) -> ColumnElement:
+    """构建相关度排序表达式，值越大越相关"""
+    if is_postgres(db):
+        scores = [func.coalesce(func.word_similarity(query, column), 0) for column in columns]
+        return scores[0] if len(scores) == 1 else func.greatest(*scores)
+
+    # SQLite：前缀命中 > 子串命中
+    lowered = query.lower()
+    scores = [
+        case(
+            (func.lower(column).startswith(lowered, autoescape=True), 2),
+            (func.lower(column).contains(lowered, autoescape=True), 1),
+            else_=0,
+        )
+        for column in columns
+    ]
+    rank = scores[0]
+    for score in scores[1:]:
+        rank = rank + score
+    return rank
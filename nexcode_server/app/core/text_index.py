@@ -0,0 +1,186 @@
+"""
+文本检索索引
+提供分词和基于BM25评分的内存倒排索引，支持增量更新
+"""
+import math
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# 英文/数字/下划线单词，或单个中文字符
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[\u4e00-\u9fff]")
+
+# 英文/数字/下划线单词，或连续的中日韩文字
+_CJK_RUN_RE = re.compile(r"[a-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+# 常见英文停用词，检索时没有区分度
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or "
+    "that the this to was were will with".split()
+)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """将文本切分为检索词
+
+    英文按单词切分（小写），中文按单字切分，并过滤停用词和单字母词
+    """
+    if not text:
+        return []
+
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOP_WORDS:
+            continue
+        if len(token) == 1 and token.isascii():
+            continue
+        tokens.append(token)
+    return tokens
+
+
+def _cjk_tokens(text: Optional[str], unigrams: bool) -> List[str]:
+    """英文单词（过滤停用词和单字母词）+ 中日韩文字的二字切分，unigrams 为 True 时同时保留单字"""
+    tokens: List[str] = []
+    if not text:
+        return tokens
+    for run in _CJK_RUN_RE.findall(text.lower()):
+        if run.isascii():
+            if run in _STOP_WORDS or len(run) == 1:
+                continue
+            tokens.append(run)
+            continue
+        if len(run) == 1 or unigrams:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize_cjk(text: Optional[str]) -> List[str]:
+    """索引用分词：英文按单词切分，连续中日韩文字同时切分为单字和相邻二字
+
+    二字词保证多字查询的精度，单字让单字查询也能命中
+    """
+    return _cjk_tokens(text, unigrams=True)
+
+
+def tokenize_cjk_query(text: Optional[str]) -> List[str]:
+    """查询用分词：连续文字只取相邻二字（单独的一个字取单字），与 tokenize_cjk 配合使用"""
+    return _cjk_tokens(text, unigrams=False)
+
+
+class BM25Index:
+    """BM25倒排索引
+
+    每个条目以可哈希的key标识，可附带任意payload。
+    add() 对同一key重复调用时会先移除旧条目，因此可直接用于增量更新。
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        tokenizer: Callable[[Optional[str]], List[str]] = tokenize,
+        query_tokenizer: Optional[Callable[[Optional[str]], List[str]]] = None,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        # 查询可使用与索引不同的分词方式，默认相同
+        self.query_tokenizer = query_tokenizer or tokenizer
+        # 倒排表 {term: {key: tf}}
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        # 每个条目的词频 {key: Counter}，用于删除时回收倒排表
+        self._doc_terms: Dict[Hashable, Counter] = {}
+        self._doc_len: Dict[Hashable, int] = {}
+        self._payloads: Dict[Hashable, Any] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._doc_len
+
+    def add(self, key: Hashable, text: str, payload: Any = None):
+        """添加或替换条目"""
+        if key in self._doc_len:
+            self.remove(key)
+
+        terms = Counter(self.tokenizer(text))
+        length = sum(terms.values())
+
+        self._doc_terms[key] = terms
+        self._doc_len[key] = length
+        self._payloads[key] = payload
+        self._total_len += length
+
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[key] = tf
+
+    def remove(self, key: Hashable) -> bool:
+        """移除条目，返回是否存在"""
+        terms = self._doc_terms.pop(key, None)
+        if terms is None:
+            return False
+
+        self._total_len -= self._doc_len.pop(key)
+        self._payloads.pop(key, None)
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+        return True
+
+    def get_payload(self, key: Hashable) -> Any:
+        """获取条目附带的payload"""
+        return self._payloads.get(key)
+
+    def _idf(self, term: str) -> float:
+        """BM25 IDF（带+1平滑，保证非负）"""
+        n = len(self._doc_len)
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        key_filter: Optional[Callable[[Hashable], bool]] = None,
+    ) -> List[Tuple[Hashable, float]]:
+        """检索与query最相关的条目
+
+        Args:
+            query: 查询文本
+            top_k: 返回条目数量
+            key_filter: 可选的key过滤函数，返回False的条目会被跳过
+
+        Returns:
+            List[Tuple[key, score]]: 按得分降序排列
+        """
+        if not self._doc_len:
+            return []
+
+        query_terms = set(self.query_tokenizer(query))
+        if not query_terms:
+            return []
+
+        avg_len = self._total_len / len(self._doc_len) or 1.0
+        scores: Dict[Hashable, float] = {}
+
+        for term in query_terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for key, tf in postings.items():
+                if key_filter is not None and not key_filter(key):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[key] / avg_len)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
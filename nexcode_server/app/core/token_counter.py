@@ -69,10 +69,7 @@ class TokenCounter:
             return len(encoder.tokenize(text))
         except Exception as e:
             logger.error(f"Error counting Qwen tokens: {e}")
-            # 中文文本大约每个字符0.7个token，英文文本每个字符0.25个token
-            chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
-            other_chars = len(text) - chinese_chars
-            return int(chinese_chars * 0.7 + other_chars * 0.25)
+            return approximate_tokens(text)
     
     def count_messages_tokens(self, messages: list, model_name: str = "gpt-3.5-turbo") -> int:
         """
@@ -127,6 +124,18 @@ class TokenCounter:
             return min(1000, max(50, prompt_tokens // 3))
 
 
+def approximate_tokens(text: str) -> int:
+    """
+    按字符快速估算token数量（不加载分词器）
+    中文文本大约每个字符0.7个token，英文文本每个字符0.25个token
+    """
+    if not text:
+        return 0
+    chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
+    other_chars = len(text) - chinese_chars
+    return int(chinese_chars * 0.7 + other_chars * 0.25)
+
+
 # 全局token计数器实例
 token_counter = TokenCounter()
 
@@ -16,6 +16,20 @@ from app.api.v1.documents import router as documents_router
 from app.api.v1.websocket import router as websocket_router
 from app.core.config import settings
 from app.core.database import init_db
+from app.core.rate_limit import RateLimitMiddleware
+from app.services.api_key_usage import api_key_usage
+from app.services.auth_cache import auth_cache
+from app.services.auth_service import auth_service
+from app.services.collaboration_bus import collaboration_bus
+from app.services.collaboration_service import collaboration_manager
+from app.services.diff_service import diff_service
+from app.services.document_cache import document_cache
+from app.services.document_search_service import document_search_service
+from app.services.document_storage_service import document_storage_service
+from app.services.lease_manager import lease_manager
+from app.services.presence_service import presence_service
+from app.services.rate_limiter import rate_limiter
+from app.services.sharedb_service import get_sharedb_service
 from app.models.schemas import HealthCheckResponse
 from datetime import datetime
 
@@ -25,8 +39,44 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时初始化数据库
     await init_db()
+    # 启动文档写后合并保存任务
+    document_storage_service.start()
+    # 连接分布式文档租约
+    await lease_manager.start()
+    # 在后台创建 ShareDB 索引
+    get_sharedb_service().start()
+    # 启动文档全文索引的防抖更新任务
+    document_search_service.start()
+    # 订阅认证缓存的跨 worker 失效通知
+    await auth_cache.start()
+    # 订阅文档快照缓存的跨 worker 失效通知
+    await document_cache.start()
+    # API 密钥使用统计定期批量写回
+    await api_key_usage.start()
+    # 检查限流使用的 Redis（不可用时只在本 worker 内限流）
+    await rate_limiter.start()
+    # 启动跨 worker 协作总线（Redis 不可用时退化为单 worker）
+    await collaboration_bus.start(collaboration_manager.on_bus_message)
+    # 启动光标合并与在线状态心跳
+    await presence_service.start(
+        collaboration_manager.send_cursor_frame, collaboration_manager.get_local_presence
+    )
     yield
-    # 关闭时的清理工作（如果需要）
+    # 关闭时的清理工作
+    await auth_cache.stop()
+    await document_cache.stop()
+    await document_search_service.stop()
+    await presence_service.stop()
+    await collaboration_bus.stop()
+    # 写完所有待保存的文档内容和操作记录
+    await document_storage_service.stop()
+    await api_key_usage.stop()
+    await get_sharedb_service().close()
+    await lease_manager.stop()
+    # 结束版本差异计算进程
+    diff_service.shutdown()
+    # 结束密码哈希线程
+    auth_service.shutdown()
 
 
 app = FastAPI(
@@ -38,6 +88,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# 请求限流（在 CORS 之内，429 响应同样带有 CORS 头）
+app.add_middleware(RateLimitMiddleware)
+
 # 配置 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +98,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 列表接口的分页游标和总数、限流状态通过响应头返回
+    expose_headers=[
+        "X-Next-Cursor", "X-Total-Count",
+        "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After",
+    ],
 )
 
 # 注册 API 路由
@@ -109,5 +167,10 @@ if __name__ == "__main__":
     import uvicorn
 
     uvicorn.run(
-        "main:app", host=settings.HOST, port=settings.PORT, reload=settings.DEBUG
+        "main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        reload=settings.DEBUG,
+        ws="websockets",
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE,
     )
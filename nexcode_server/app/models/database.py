@@ -298,8 +298,11 @@ class DocumentVersion(Base):
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
     version_number = Column(Integer, nullable=False)
     title = Column(String(200), nullable=False)
-    content = Column(Text, nullable=True)
+    content = Column(Text, nullable=True)  # 关键帧保存完整内容，差异版本为空
     content_hash = Column(String(32), nullable=False)  # 新增：内容哈希值
+    # 反向差异（ot.js 格式）：应用到 base_version_id 版本的内容即得到本版本内容，关键帧为空
+    delta = Column(JSON, nullable=True)
+    base_version_id = Column(Integer, nullable=True)  # 差异所基于的较新版本行 id
     change_description = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     changed_by = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -95,7 +95,11 @@ class DocumentListItem(BaseModel):
     updated_at: datetime
     organization_id: Optional[int] = None
     owner: UserInfo
+    collaborators: List[CollaboratorResponse] = []  # 最近添加的几位协作者
+    collaborator_count: int = 0
     user_permission: Optional[PermissionLevel] = None
+    active_editors: int = 0  # 实时编辑人数
+    snippet: Optional[str] = None  # 搜索时的高亮摘要（HTML，命中部分以 <mark> 标出）
 
 
 class DocumentListResponse(BaseModel):
@@ -114,6 +118,7 @@ class DocumentListResult(BaseModel):
     total: int
     skip: int
     limit: int
+    next_cursor: Optional[str] = None  # 下一页游标，没有更多时为空
 
 
 class DocumentVersionResponse(BaseModel):
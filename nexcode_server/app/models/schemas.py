@@ -46,14 +46,22 @@ class CommitMessageResponse(BaseModel):
     message: str
 
 
+# 问答检索参数 - 从用户的提交历史和协作文档中检索相关片段
+class RetrievalMixin(BaseModel):
+    use_history: bool = True  # 是否检索历史上下文（需登录）
+    top_k: Optional[int] = None  # 检索片段数量，默认使用服务端配置
+    context_token_budget: Optional[int] = None  # 检索上下文的token预算
+
+
 # 提交相关问答
-class CommitQARequest(APIConfigMixin):
+class CommitQARequest(APIConfigMixin, RetrievalMixin):
     question: str
     context: Optional[Dict[str, Any]] = {}  # Git仓库上下文
 
 
 class CommitQAResponse(BaseModel):
     answer: str
+    sources: List[Dict[str, Any]] = []  # 回答引用的历史片段
 
 
 # 代码质量检查（专门为check命令）
@@ -98,7 +106,7 @@ class RepositoryAnalysisResponse(BaseModel):
 
 
 # 智能问答（增强版）
-class IntelligentQARequest(APIConfigMixin):
+class IntelligentQARequest(APIConfigMixin, RetrievalMixin):
     question: str
     category: Optional[str] = "general"  # git, code, workflow, best_practices
     context: Optional[Dict[str, Any]] = {}
@@ -108,6 +116,7 @@ class IntelligentQAResponse(BaseModel):
     answer: str
     related_topics: List[str] = []
     suggested_actions: List[str] = []
+    sources: List[Dict[str, Any]] = []  # 回答引用的历史片段
 
 
 # 健康检查
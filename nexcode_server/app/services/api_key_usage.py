@@ -0,0 +1,162 @@
+"""
+API 密钥使用统计缓冲
+每次请求只在内存中累加调用次数和最后使用时间，由后台任务每 API_KEY_USAGE_FLUSH_INTERVAL 秒
+用一个事务批量写回 api_keys，热点密钥不再每个请求都提交一次写事务。
+当天的调用总数同时累加到 Redis 计数器（各 worker 共享），管理统计直接读取实时值。
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis_client import redis_client
+from app.models.database import APIKey
+
+logger = logging.getLogger(__name__)
+
+# 每天的调用总数计数器，保留两天
+DAILY_CALLS_KEY = "api_keys:calls:{date}"
+DAILY_CALLS_TTL = 2 * 24 * 3600
+
+
+class ApiKeyUsageTracker:
+    """API 密钥调用次数的内存缓冲与批量写回"""
+
+    def __init__(self):
+        # 尚未写回数据库的 {api_key_id: 调用次数} 和 {api_key_id: 最后使用时间}
+        self._pending: Counter = Counter()
+        self._last_used: Dict[int, datetime] = {}
+        # 尚未累加到 Redis 的当天调用数
+        self._unpublished: Counter = Counter()
+        # Redis 不可用时本 worker 的当天调用数
+        self._local_daily: Counter = Counter()
+        self.enabled = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.metrics = {"recorded": 0, "flushes": 0, "rows_written": 0, "flush_failures": 0}
+
+    async def start(self):
+        """启动定期写回任务；Redis 不可用时当天调用数只统计本 worker"""
+        try:
+            await redis_client.redis.ping()
+            self.enabled = True
+        except Exception as e:
+            logger.warning(f"Redis unavailable, API call counters limited to this worker: {e}")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止定期任务并写回剩余的统计"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
+        self.enabled = False
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.utcnow().strftime("%Y-%m-%d")
+
+    def record(self, api_key_id: int):
+        """记录一次 API 密钥调用（只修改内存，不访问数据库）"""
+        today = self._today()
+        if today not in self._local_daily:
+            self._local_daily.clear()
+        self._pending[api_key_id] += 1
+        self._last_used[api_key_id] = datetime.utcnow()
+        self._unpublished[today] += 1
+        self._local_daily[today] += 1
+        self.metrics["recorded"] += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(settings.API_KEY_USAGE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"API key usage flush error: {e}")
+
+    async def flush(self):
+        """把缓冲的统计写回数据库和 Redis；失败时合并回缓冲，下次重试"""
+        async with self._flush_lock:
+            await self._publish_daily()
+            if not self._pending:
+                return
+
+            pending, last_used = self._pending, self._last_used
+            self._pending, self._last_used = Counter(), {}
+            rows = [
+                {"key_id": api_key_id, "calls": calls, "seen": last_used[api_key_id]}
+                for api_key_id, calls in pending.items()
+            ]
+            # 表级 UPDATE + 参数列表：一条语句 executemany，不经过 ORM 批量更新
+            table = APIKey.__table__
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam("key_id"))
+                .values(
+                    usage_count=table.c.usage_count + bindparam("calls"),
+                    last_used=bindparam("seen"),
+                )
+            )
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(stmt, rows)
+                    await db.commit()
+            except Exception as e:
+                self.metrics["flush_failures"] += 1
+                logger.error(f"Failed to write API key usage: {e}")
+                self._pending.update(pending)
+                for api_key_id, seen in last_used.items():
+                    self._last_used.setdefault(api_key_id, seen)
+                return
+            self.metrics["flushes"] += 1
+            self.metrics["rows_written"] += len(rows)
+
+    async def _publish_daily(self):
+        if not self.enabled or not self._unpublished:
+            return
+        unpublished, self._unpublished = self._unpublished, Counter()
+        try:
+            async with redis_client.redis.pipeline(transaction=False) as pipe:
+                for date, calls in unpublished.items():
+                    key = DAILY_CALLS_KEY.format(date=date)
+                    pipe.incrby(key, calls)
+                    pipe.expire(key, DAILY_CALLS_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to publish API call counters: {e}")
+            self._unpublished.update(unpublished)
+
+    async def get_calls_today(self) -> int:
+        """当天的 API 调用总数（Redis 计数 + 本 worker 尚未累加的部分）"""
+        today = self._today()
+        if self.enabled:
+            try:
+                value = await redis_client.redis.get(DAILY_CALLS_KEY.format(date=today))
+                return int(value or 0) + self._unpublished[today]
+            except Exception as e:
+                logger.error(f"Failed to read API call counters: {e}")
+        return self._local_daily[today]
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "pending_keys": len(self._pending),
+            "pending_calls": sum(self._pending.values()),
+            "shared_counters": self.enabled,
+        }
+
+
+# 全局实例
+api_key_usage = ApiKeyUsageTracker()
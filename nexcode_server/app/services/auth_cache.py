@@ -0,0 +1,256 @@
+"""
+认证与权限缓存
+- 身份缓存：令牌（JWT / API Key / 会话）解析出的用户，短 TTL，不超过令牌本身的有效期
+- 权限缓存：(用户, 文档) 的有效权限级别
+每个 worker 在本地缓存；协作者、所有权、组织成员或用户状态变化时显式失效，
+并通过 Redis 频道通知其他 worker 一起失效。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.models.database import User
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "auth:invalidate"
+
+
+class TTLCache:
+    """带过期时间和容量上限的 LRU 缓存"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """删除满足条件的条目，返回删除数量"""
+        keys = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class Principal:
+    """令牌解析出的身份"""
+
+    __slots__ = ("user_id", "kind", "scopes", "api_key_id", "rate_limit", "expires_at", "_user_data")
+
+    def __init__(
+        self,
+        user: User,
+        kind: str,
+        expires_at: Optional[float] = None,
+        scopes: Optional[List[str]] = None,
+        api_key_id: Optional[int] = None,
+        rate_limit: Optional[int] = None,
+    ):
+        self.user_id = user.id
+        # jwt / api_key / session
+        self.kind = kind
+        self.scopes = list(scopes) if scopes else None
+        self.api_key_id = api_key_id
+        # API Key 每小时的请求限额
+        self.rate_limit = rate_limit
+        # 令牌本身的过期时间（时间戳），缓存不会超过它
+        self.expires_at = expires_at
+        self._user_data = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+    def has_scope(self, required_scope: str) -> bool:
+        """JWT 和会话默认拥有全部权限；API Key 按其 scopes 检查"""
+        if self.kind != "api_key" or not self.scopes:
+            return True
+        from app.models.user_schemas import TokenScope
+        return required_scope in self.scopes or TokenScope.ADMIN in self.scopes
+
+    def build_user(self) -> User:
+        """根据缓存的字段构造一个游离态 User，可直接加入当前请求的会话而无需查询"""
+        user = User(**self._user_data)
+        make_transient_to_detached(user)
+        return user
+
+
+class AuthCache:
+    """认证与权限缓存"""
+
+    def __init__(self):
+        self.principals = TTLCache(settings.AUTH_CACHE_MAX_ENTRIES)
+        # {(user_id, document_id): 权限级别（0 表示无权限）}
+        self.permissions = TTLCache(settings.AUTH_CACHE_MAX_ENTRIES)
+        # 每次失效递增；查询期间发生失效时不写入缓存，避免回填旧结果
+        self.generation = 0
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.enabled = False
+        self.pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    async def start(self):
+        """订阅失效通知；Redis 不可用时只在本 worker 内失效（依靠短 TTL 收敛）"""
+        try:
+            await redis_client.redis.ping()
+            self.pubsub = redis_client.redis.pubsub(ignore_subscribe_messages=True)
+            await self.pubsub.subscribe(INVALIDATION_CHANNEL)
+            self.enabled = True
+            self._listener_task = asyncio.create_task(self._listen())
+        except Exception as e:
+            logger.warning(f"Redis unavailable, auth cache invalidation limited to this worker: {e}")
+
+    async def stop(self):
+        self.enabled = False
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("origin") != self.worker_id:
+                    self._apply(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Auth cache invalidation listener error: {e}")
+                await asyncio.sleep(1)
+
+    # ---- 身份缓存 ----
+
+    def get_principal(self, token: str) -> Optional[Principal]:
+        principal = self.principals.get(self._token_key(token))
+        if principal and principal.expires_at is not None and principal.expires_at <= time.time():
+            self.principals.pop(self._token_key(token))
+            return None
+        return principal
+
+    def set_principal(self, token: str, principal: Principal, generation: int):
+        if generation != self.generation:
+            return
+        ttl = settings.AUTH_PRINCIPAL_CACHE_TTL
+        if principal.expires_at is not None:
+            ttl = min(ttl, principal.expires_at - time.time())
+        self.principals.set(self._token_key(token), principal, ttl)
+
+    # ---- 权限缓存 ----
+
+    def get_permission(self, user_id: int, document_id: int) -> Optional[int]:
+        return self.permissions.get((user_id, document_id))
+
+    def set_permission(self, user_id: int, document_id: int, level: int, generation: int):
+        if generation != self.generation:
+            return
+        self.permissions.set((user_id, document_id), level, settings.AUTH_PERMISSION_CACHE_TTL)
+
+    # ---- 失效 ----
+
+    async def invalidate_user(self, user_id: int):
+        """用户资料、状态、会话或 API Key 变化：清除其身份和全部权限缓存"""
+        await self._invalidate({"kind": "user", "user_id": user_id})
+
+    async def invalidate_user_permissions(self, user_id: int):
+        """组织成员关系变化：清除该用户的权限缓存"""
+        await self._invalidate({"kind": "user_permissions", "user_id": user_id})
+
+    async def invalidate_permission(self, user_id: int, document_id: int):
+        """协作者增删改：清除单个 (用户, 文档) 权限"""
+        await self._invalidate({"kind": "permission", "user_id": user_id, "document_id": document_id})
+
+    async def invalidate_document(self, document_id: int):
+        """文档所有权变化或删除：清除该文档所有用户的权限"""
+        await self._invalidate({"kind": "document", "document_id": document_id})
+
+    async def _invalidate(self, payload: Dict[str, Any]):
+        self._apply(payload)
+        if not self.enabled:
+            return
+        try:
+            await redis_client.redis.publish(
+                INVALIDATION_CHANNEL, json.dumps({**payload, "origin": self.worker_id})
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish auth cache invalidation: {e}")
+
+    def _apply(self, payload: Dict[str, Any]):
+        self.generation += 1
+        kind = payload["kind"]
+        user_id = payload.get("user_id")
+        document_id = payload.get("document_id")
+
+        if kind == "user":
+            self.principals.discard_where(lambda key, principal: principal.user_id == user_id)
+        if kind in ("user", "user_permissions"):
+            self.permissions.discard_where(lambda key, _: key[0] == user_id)
+        elif kind == "permission":
+            self.permissions.pop((user_id, document_id))
+        elif kind == "document":
+            self.permissions.discard_where(lambda key, _: key[1] == document_id)
+
+    def clear(self):
+        self.generation += 1
+        self.principals.clear()
+        self.permissions.clear()
+
+    def get_metrics(self) -> dict:
+        return {
+            "principals": self.principals.stats(),
+            "permissions": self.permissions.stats(),
+            "cross_worker_invalidation": self.enabled,
+        }
+
+
+# 全局认证缓存实例
+auth_cache = AuthCache()
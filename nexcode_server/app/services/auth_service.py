@@ -1,5 +1,7 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import hashlib
 import secrets
 import os
@@ -7,12 +9,14 @@ import xml.etree.ElementTree as ET
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from cas import CASClient
 import httpx
 
+from app.core.config import settings
 from app.models.database import User, UserSession, APIKey
 from app.models.user_schemas import UserCreate, Token, TokenData
+from app.services.api_key_usage import api_key_usage
 
 # JWT配置
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -23,8 +27,14 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 CAS_SERVER_URL = os.getenv("CAS_SERVER_URL", "https://cas.example.com")
 CAS_SERVICE_URL = os.getenv("CAS_SERVICE_URL", "http://localhost:8000/auth/cas/callback")
 
-# 密码加密
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码加密：成本因子固定为 AUTH_BCRYPT_ROUNDS，成本不同的旧哈希在登录时重新计算
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.AUTH_BCRYPT_ROUNDS,
+)
 
 class AuthService:
     def __init__(self):
@@ -33,6 +43,8 @@ class AuthService:
             service_url=CAS_SERVICE_URL,
             server_url=CAS_SERVER_URL
         )
+        # bcrypt 计算时释放 GIL，线程池即可避免阻塞事件循环
+        self._hash_executor: Optional[ThreadPoolExecutor] = None
     
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None):
         """创建JWT token"""
@@ -245,13 +257,33 @@ class AuthService:
         return result.scalar_one_or_none()
     
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """验证密码"""
+        """验证密码（同步，供脚本使用；请求处理中使用 verify_and_update_password）"""
         return pwd_context.verify(plain_password, hashed_password)
     
     def get_password_hash(self, password: str) -> str:
-        """生成密码哈希"""
+        """生成密码哈希（同步，供脚本使用；请求处理中使用 hash_password）"""
         return pwd_context.hash(password)
     
+    async def _run_hash(self, func, *args):
+        """在密码哈希线程池中执行，AUTH_HASH_WORKERS 为 0 时直接执行"""
+        if settings.AUTH_HASH_WORKERS <= 0:
+            return func(*args)
+        if self._hash_executor is None:
+            self._hash_executor = ThreadPoolExecutor(
+                max_workers=settings.AUTH_HASH_WORKERS, thread_name_prefix="password-hash"
+            )
+        return await asyncio.get_running_loop().run_in_executor(self._hash_executor, func, *args)
+    
+    async def hash_password(self, password: str) -> str:
+        """生成密码哈希（不阻塞事件循环）"""
+        return await self._run_hash(pwd_context.hash, password)
+    
+    async def verify_and_update_password(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """验证密码（不阻塞事件循环），哈希不符合当前策略时同时返回新哈希"""
+        return await self._run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+    
     async def authenticate_user(self, db: AsyncSession, username: str, password: str) -> Optional[User]:
         """验证用户名和密码"""
         user = await self.get_user_by_username(db, username)
@@ -259,13 +291,19 @@ class AuthService:
             return None
         if not user.password_hash:
             return None
-        if not self.verify_password(password, user.password_hash):
+        verified, new_hash = await self.verify_and_update_password(password, user.password_hash)
+        if not verified:
             return None
+        if new_hash:
+            # 成本因子变化后按新策略重新哈希
+            user.password_hash = new_hash
+            await db.commit()
+            await db.refresh(user)
         return user
     
     async def create_user(self, db: AsyncSession, user_create: UserCreate) -> User:
         """创建新用户"""
-        password_hash = self.get_password_hash(user_create.password)
+        password_hash = await self.hash_password(user_create.password)
         
         user = User(
             username=user_create.username,
@@ -288,6 +326,7 @@ class AuthService:
             stmt = select(User).join(UserSession).where(
                 UserSession.session_token == session_token,
                 UserSession.expires_at > datetime.utcnow(),
+                UserSession.is_active == True,
                 User.is_active == True
             )
             
@@ -296,7 +335,6 @@ class AuthService:
             
             if user:
                 # 更新最后访问时间
-                from sqlalchemy import update
                 await db.execute(
                     update(UserSession)
                     .where(UserSession.session_token == session_token)
@@ -357,8 +395,8 @@ class AuthService:
         
         return api_key, key
     
-    async def verify_api_key(self, db: AsyncSession, api_key: str) -> Optional[User]:
-        """验证API密钥"""
+    async def get_active_api_key(self, db: AsyncSession, api_key: str) -> Optional[APIKey]:
+        """查找有效（启用且未过期）的API密钥"""
         if not api_key.startswith("nxc_"):
             return None
             
@@ -371,54 +409,50 @@ class AuthService:
         result = await db.execute(stmt)
         api_key_obj = result.scalar_one_or_none()
         
-        if api_key_obj:
-            # 检查是否过期
-            if api_key_obj.expires_at and api_key_obj.expires_at < datetime.utcnow():
-                return None
-            
-            # 更新使用统计
-            api_key_obj.usage_count += 1
-            api_key_obj.last_used = datetime.utcnow()
-            await db.commit()
-            
-            # 获取用户
-            return await self.get_user_by_id(db, api_key_obj.user_id)
-        return None
+        # 检查是否过期
+        if api_key_obj and api_key_obj.expires_at and api_key_obj.expires_at < datetime.utcnow():
+            return None
+        return api_key_obj
+
+    def record_api_key_usage(self, api_key_id: int):
+        """记录API密钥使用（内存缓冲，定期批量写回数据库）"""
+        api_key_usage.record(api_key_id)
+
+    async def verify_api_key(self, db: AsyncSession, api_key: str) -> Optional[User]:
+        """验证API密钥"""
+        api_key_obj = await self.get_active_api_key(db, api_key)
+        if not api_key_obj:
+            return None
+        
+        # 更新使用统计
+        self.record_api_key_usage(api_key_obj.id)
+        
+        # 获取用户
+        return await self.get_user_by_id(db, api_key_obj.user_id)
 
     async def verify_api_key_permission(self, db: AsyncSession, api_key: str, required_scope: str) -> Optional[User]:
         """验证API密钥权限"""
-        if not api_key.startswith("nxc_"):
+        api_key_obj = await self.get_active_api_key(db, api_key)
+        if not api_key_obj:
             return None
             
-        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        # 检查权限范围
+        if api_key_obj.scopes and required_scope not in api_key_obj.scopes:
+            # 检查是否有admin权限
+            from app.models.user_schemas import TokenScope
+            if TokenScope.ADMIN not in api_key_obj.scopes:
+                return None
         
-        stmt = select(APIKey).where(
-            APIKey.key_hash == key_hash,
-            APIKey.is_active == True
-        )
-        result = await db.execute(stmt)
-        api_key_obj = result.scalar_one_or_none()
+        # 更新使用统计
+        self.record_api_key_usage(api_key_obj.id)
         
-        if api_key_obj:
-            # 检查是否过期
-            if api_key_obj.expires_at and api_key_obj.expires_at < datetime.utcnow():
-                return None
-                
-            # 检查权限范围
-            if api_key_obj.scopes and required_scope not in api_key_obj.scopes:
-                # 检查是否有admin权限
-                from app.models.user_schemas import TokenScope
-                if TokenScope.ADMIN not in api_key_obj.scopes:
-                    return None
-            
-            # 更新使用统计
-            api_key_obj.usage_count += 1
-            api_key_obj.last_used = datetime.utcnow()
-            await db.commit()
-            
-            # 获取用户
-            return await self.get_user_by_id(db, api_key_obj.user_id)
-        return None
+        # 获取用户
+        return await self.get_user_by_id(db, api_key_obj.user_id)
+
+    def shutdown(self):
+        if self._hash_executor is not None:
+            self._hash_executor.shutdown(wait=False, cancel_futures=True)
+            self._hash_executor = None
 
 # 创建全局实例
 auth_service = AuthService() 
\ No newline at end of file
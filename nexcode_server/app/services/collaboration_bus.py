@@ -0,0 +1,241 @@
+"""
+协作消息总线
+基于 Redis pub/sub 在多个 worker / 节点之间转发文档操作、光标和在线状态。
+
+每个文档使用以下 Redis 键：
+  collab:doc:{id}:rev       全局修订号
+  collab:doc:{id}:ops       最近的已提交操作（JSON 列表，长度受 OT_HISTORY_SIZE 限制）
+  collab:doc:{id}:snapshot  定期保存的 {revision, content} 快照，供新加载文档的 worker 使用
+  collab:doc:{id}           pub/sub 频道
+
+操作提交通过 Lua 脚本完成“比较修订号 -> 递增 -> 追加操作日志 -> 发布”，
+保证所有 worker 看到同一个全局操作顺序。三个键同时续期；快照缺失或内容被协作之外的
+写入（ShareDB 同步、恢复版本）替换时，修订号递增、操作日志清空并写入新快照，
+旧修订号上的提交都会失败，各 worker 重新加载。
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# KEYS: rev, ops, snapshot  ARGV: 期望修订号, 操作记录, 频道, 发布消息, 历史长度, 过期秒数
+_COMMIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current ~= tonumber(ARGV[1]) then
+    return {0, current}
+end
+local ttl = tonumber(ARGV[6])
+redis.call('SET', KEYS[1], current + 1, 'EX', ttl)
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[5]), -1)
+redis.call('EXPIRE', KEYS[2], ttl)
+redis.call('EXPIRE', KEYS[3], ttl)
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return {1, current + 1}
+"""
+
+# KEYS: rev, ops, snapshot  ARGV: 内容（JSON 字符串）, 仅在快照不存在时执行, 过期秒数
+# 返回快照 JSON；修订号递增并清空操作日志，快照与操作日志始终对应同一个修订号
+_RESET_SCRIPT = """
+if ARGV[2] == '1' then
+    local existing = redis.call('GET', KEYS[3])
+    if existing then
+        return existing
+    end
+end
+local ttl = tonumber(ARGV[3])
+local revision = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('DEL', KEYS[2])
+local snapshot = '{"revision": ' .. revision .. ', "content": ' .. ARGV[1] .. '}'
+redis.call('SET', KEYS[3], snapshot, 'EX', ttl)
+return snapshot
+"""
+
+BusHandler = Callable[[int, dict], Awaitable[None]]
+
+
+class CollaborationBus:
+    """跨 worker 的协作消息总线"""
+
+    def __init__(self):
+        # 当前 worker 的唯一标识，用于过滤自己发布的消息
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.enabled = False
+        self.redis = redis_client.redis
+        self.pubsub = None
+        self.handler: Optional[BusHandler] = None
+        self.subscribed_documents: set = set()
+        self._commit_script = self.redis.register_script(_COMMIT_SCRIPT)
+        self._reset_script = self.redis.register_script(_RESET_SCRIPT)
+        self._listener_task: Optional[asyncio.Task] = None
+        self._has_subscriptions = asyncio.Event()
+
+    @staticmethod
+    def channel(document_id: int) -> str:
+        return f"collab:doc:{document_id}"
+
+    @staticmethod
+    def _key(document_id: int, name: str) -> str:
+        return f"collab:doc:{document_id}:{name}"
+
+    def _state_keys(self, document_id: int) -> List[str]:
+        return [self._key(document_id, name) for name in ("rev", "ops", "snapshot")]
+
+    def new_session_id(self) -> str:
+        """生成全局唯一的会话ID"""
+        return f"session_{self.worker_id}_{uuid.uuid4().hex[:12]}"
+
+    async def start(self, handler: BusHandler):
+        """连接 Redis 并启动订阅协程；Redis 不可用时退化为单 worker 模式"""
+        self.handler = handler
+        if not settings.COLLAB_BUS_ENABLED:
+            logger.info("Collaboration bus disabled, running in single-worker mode")
+            return
+        try:
+            await self.redis.ping()
+        except Exception as e:
+            logger.warning(f"Redis unavailable, collaboration bus disabled: {e}")
+            return
+
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.enabled = True
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info(f"Collaboration bus started (worker {self.worker_id})")
+
+    async def stop(self):
+        """停止订阅"""
+        self.enabled = False
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+        self.subscribed_documents.clear()
+
+    async def subscribe(self, document_id: int):
+        """本 worker 出现该文档的第一个连接时订阅频道"""
+        if not self.enabled or document_id in self.subscribed_documents:
+            return
+        self.subscribed_documents.add(document_id)
+        await self.pubsub.subscribe(self.channel(document_id))
+        self._has_subscriptions.set()
+
+    async def unsubscribe(self, document_id: int):
+        """本 worker 该文档的最后一个连接断开时取消订阅"""
+        if not self.enabled or document_id not in self.subscribed_documents:
+            return
+        self.subscribed_documents.discard(document_id)
+        await self.pubsub.unsubscribe(self.channel(document_id))
+        if not self.subscribed_documents:
+            self._has_subscriptions.clear()
+
+    async def _listen(self):
+        """接收其他 worker 发布的消息并交给处理函数"""
+        while True:
+            try:
+                await self._has_subscriptions.wait()
+                message = await self.pubsub.get_message(timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+
+                payload = json.loads(message["data"])
+                if payload.get("origin") == self.worker_id:
+                    continue
+                document_id = int(message["channel"].rsplit(":", 1)[-1])
+                await self.handler(document_id, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Collaboration bus listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, document_id: int, payload: dict):
+        """发布非操作类事件（光标、加入、离开等）"""
+        if not self.enabled:
+            return
+        payload["origin"] = self.worker_id
+        try:
+            await self.redis.publish(self.channel(document_id), json.dumps(payload))
+        except Exception as e:
+            logger.error(f"Failed to publish collaboration event: {e}")
+
+    async def commit_operation(
+        self, document_id: int, expected_revision: int, record: dict
+    ) -> Tuple[bool, int]:
+        """原子提交操作：仅当全局修订号等于 expected_revision 时成功
+
+        返回 (是否成功, 最新全局修订号)
+        """
+        record = {**record, "revision": expected_revision + 1}
+        payload = {"kind": "operation", "origin": self.worker_id, "record": record}
+        committed, revision = await self._commit_script(
+            keys=self._state_keys(document_id),
+            args=[
+                expected_revision,
+                json.dumps(record),
+                self.channel(document_id),
+                json.dumps(payload),
+                settings.OT_HISTORY_SIZE,
+                settings.COLLAB_STATE_TTL,
+            ],
+        )
+        return bool(committed), int(revision)
+
+    async def get_operations_since(self, document_id: int, revision: int) -> List[dict]:
+        """从操作日志中读取指定修订号之后的操作记录"""
+        raw_records = await self.redis.lrange(self._key(document_id, "ops"), 0, -1)
+        records = [json.loads(raw) for raw in raw_records]
+        return [record for record in records if record["revision"] > revision]
+
+    async def save_snapshot(self, document_id: int, revision: int, content: str):
+        """保存文档快照"""
+        await self.redis.set(
+            self._key(document_id, "snapshot"),
+            json.dumps({"revision": revision, "content": content}),
+            ex=settings.COLLAB_STATE_TTL,
+        )
+
+    async def load_snapshot(self, document_id: int, initial_content: Callable[[], Awaitable[str]]) -> dict:
+        """读取文档快照；不存在时用数据库内容初始化，同时递增修订号并清空操作日志，
+        不会把数据库内容和旧修订号配对（多个 worker 并发时只有一个生效）"""
+        raw = await self.redis.get(self._key(document_id, "snapshot"))
+        if raw is None:
+            content = await initial_content()
+            raw = await self._reset_script(
+                keys=self._state_keys(document_id),
+                args=[json.dumps(content), 1, settings.COLLAB_STATE_TTL],
+            )
+        return json.loads(raw)
+
+    async def reset_document(self, document_id: int, content: str):
+        """文档内容被协作之外的写入替换：重置共享状态并通知所有 worker（包括本 worker）重新加载"""
+        if self.enabled:
+            try:
+                await self._reset_script(
+                    keys=self._state_keys(document_id),
+                    args=[json.dumps(content), 0, settings.COLLAB_STATE_TTL],
+                )
+                await self.redis.publish(
+                    self.channel(document_id), json.dumps({"kind": "reset", "origin": self.worker_id})
+                )
+            except Exception as e:
+                logger.error(f"Failed to reset collaboration state of document {document_id}: {e}")
+        if self.handler is not None:
+            await self.handler(document_id, {"kind": "reset", "content": content})
+
+
+# 全局协作总线实例
+collaboration_bus = CollaborationBus()
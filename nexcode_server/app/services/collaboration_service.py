@@ -1,52 +1,115 @@
 import asyncio
 import json
+from collections import deque
 from typing import Dict, List, Optional
 from fastapi import WebSocket
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models.database import Document, DocumentVersion, DocumentOperation, OperationType
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, get_db
+from app.services import ot
+from app.services.collaboration_bus import collaboration_bus
 from app.services.document_storage_service import document_storage_service
+from app.services.lease_manager import lease_manager
+from app.services.permission_service import PermissionService
+from app.services.presence_service import presence_service
+from app.services.ws_connection import CollaborationMetrics, OutboundConnection
+from app.services.ws_protocol import Codec, JSON_CODEC
+
+
+class DocumentState:
+    """协作文档的服务端状态：当前内容、修订号和最近的操作历史"""
+
+    def __init__(self, content: str, revision: int = 0, history_size: int = 500):
+        self.content = content
+        self.revision = revision
+        # 最近 history_size 个已提交操作，history[-1] 对应 revision
+        self.history: deque = deque(maxlen=history_size)
+
+    @property
+    def oldest_revision(self) -> int:
+        """历史窗口内可以转换的最早基准修订号"""
+        return self.revision - len(self.history)
+
+    def operations_since(self, revision: int) -> List[ot.TextOperation]:
+        """获取基准修订号之后的所有操作"""
+        return list(self.history)[revision - self.oldest_revision:]
+
+    def commit(self, operation: ot.TextOperation, content: Optional[str] = None) -> int:
+        """应用操作并推进修订号，content 为已算好的结果内容"""
+        self.content = ot.apply(self.content, operation) if content is None else content
+        self.history.append(operation)
+        self.revision += 1
+        return self.revision
 
 
 class CollaborationManager:
     """协作管理器"""
 
     def __init__(self):
-        # 存储活跃连接 {document_id: {session_id: {"user_id": user_id, "websocket": websocket}}}
+        # 存储活跃连接 {document_id: {session_id: {"user_id": user_id, "websocket": websocket, "connection": OutboundConnection}}}
         self.active_connections: Dict[int, Dict[str, dict]] = {}
         # 操作队列 {document_id: [operations]}
         self.operation_queues: Dict[int, List] = {}
-        # 文档锁
-        self.document_locks: Dict[int, asyncio.Lock] = {}
+        # 文档OT状态 {document_id: DocumentState}
+        self.document_states: Dict[int, DocumentState] = {}
         # 用户信息缓存 {user_id: user_info}
         self.user_cache: Dict[int, dict] = {}
-        # 会话ID计数器
+        # 会话ID计数器（仅统计本 worker 的连接数，会话ID由协作总线生成以保证全局唯一）
         self.session_counter = 0
+        # 发送队列指标
+        self.metrics = CollaborationMetrics()
+
+    async def connect(self, websocket: WebSocket, document_id: int, user_id: int, codec: Codec = JSON_CODEC,
+                      welcome: Optional[dict] = None):
+        """用户连接到文档
 
-    async def connect(self, websocket: WebSocket, document_id: int, user_id: int):
-        """用户连接到文档"""
+        welcome 为连接成功消息，注册会话时在同一文档锁内附上当前内容和修订号后首先入队，
+        之后广播给该会话的操作都基于这个修订号。
+        """
         # 注意：websocket.accept() 已经在WebSocket端点中调用
 
-        # 生成唯一的会话ID
+        # 生成全局唯一的会话ID
         self.session_counter += 1
-        session_id = f"session_{self.session_counter}"
+        session_id = collaboration_bus.new_session_id()
         
         print(f"🔗 用户 {user_id} 连接到文档 {document_id}，会话ID: {session_id}")
 
         if document_id not in self.active_connections:
             self.active_connections[document_id] = {}
             self.operation_queues[document_id] = []
-            self.document_locks[document_id] = asyncio.Lock()
             print(f"📝 创建文档 {document_id} 的连接管理器")
-
-        # 添加到连接列表，使用会话ID作为键
-        self.active_connections[document_id][session_id] = {
-            "user_id": user_id,
-            "websocket": websocket,
-            "session_id": session_id
-        }
+            await collaboration_bus.subscribe(document_id)
+
+        connection = OutboundConnection(
+            websocket,
+            session_id,
+            self.metrics,
+            resync_provider=lambda: self._resync_message(document_id),
+            on_closed=lambda conn: self._on_connection_closed(document_id, user_id, conn),
+            codec=codec,
+        )
+        connection.start()
+
+        # 添加到连接列表，使用会话ID作为键；操作只在持有文档锁时广播，
+        # 注册和发送基准修订号在同一临界区内，新会话不会先收到基准之后的操作
+        async with self.document_lock(document_id):
+            state = await self.get_document_state(document_id)
+            self.active_connections[document_id][session_id] = {
+                "user_id": user_id,
+                "websocket": websocket,
+                "session_id": session_id,
+                "connection": connection
+            }
+            if welcome is not None:
+                connection.send(codec.encode({
+                    **welcome,
+                    "revision": state.revision,
+                    "content": state.content
+                }))
         print(f"✅ 用户 {user_id} 已添加到连接列表，会话ID: {session_id}")
+        await presence_service.join(document_id, user_id, self._user_info(user_id))
 
         # 通知其他用户有新用户加入
         print(f"📤 准备广播用户加入消息...")
@@ -66,116 +129,407 @@ class CollaborationManager:
             if session_id:
                 # 断开特定会话
                 if session_id in self.active_connections[document_id]:
-                    del self.active_connections[document_id][session_id]
+                    self.active_connections[document_id].pop(session_id)["connection"].stop()
                     print(f"✅ 会话 {session_id} 已从连接列表移除")
             else:
                 # 断开用户的所有会话
                 sessions_to_remove = [sid for sid, conn_info in self.active_connections[document_id].items() if conn_info["user_id"] == user_id]
                 for sid in sessions_to_remove:
-                    del self.active_connections[document_id][sid]
+                    self.active_connections[document_id].pop(sid)["connection"].stop()
                     print(f"✅ 用户 {user_id} 的会话 {sid} 已移除")
 
             # 检查是否还有其他用户在线
             remaining_users = set(conn_info["user_id"] for conn_info in self.active_connections[document_id].values())
+            if user_id not in remaining_users:
+                await presence_service.leave(document_id, user_id)
             
             # 如果没有用户了，清理资源
             if not remaining_users:
                 del self.active_connections[document_id]
                 del self.operation_queues[document_id]
-                del self.document_locks[document_id]
+                self.document_states.pop(document_id, None)
+                await collaboration_bus.unsubscribe(document_id)
                 print(f"🧹 清理文档 {document_id} 的资源")
+
+            # 通知其他用户（包括其他 worker 上的用户）有用户离开
+            print(f"📤 准备广播用户离开消息...")
+            await self.broadcast_user_left(document_id, user_id)
+
+    @staticmethod
+    def document_lock(document_id: int):
+        """文档修改锁：只取租约管理器的本地锁，跨 worker 的顺序由协作总线的原子提交保证"""
+        return lease_manager.lease(f"collab:{document_id}", distributed=False)
+
+    async def get_document_state(self, document_id: int) -> DocumentState:
+        """获取文档OT状态，首次访问时从数据库加载内容"""
+        state = self.document_states.get(document_id)
+        if state is not None:
+            return state
+
+        if collaboration_bus.enabled:
+            # 多 worker：从共享快照加载，再重放快照之后的操作日志
+            snapshot = await collaboration_bus.load_snapshot(
+                document_id, lambda: self._load_content(document_id)
+            )
+            loaded = DocumentState(snapshot["content"], snapshot["revision"], settings.OT_HISTORY_SIZE)
+            records = await collaboration_bus.get_operations_since(document_id, loaded.revision)
+            for record in records:
+                if record["revision"] != loaded.revision + 1:
+                    print(f"⚠️ 文档 {document_id} 操作日志不连续，停在修订号 {loaded.revision}")
+                    break
+                loaded.commit(record["ops"])
+        else:
+            loaded = DocumentState(await self._load_content(document_id), history_size=settings.OT_HISTORY_SIZE)
+
+        # 加载期间可能已被其他协程创建
+        state = self.document_states.get(document_id)
+        if state is None:
+            state = loaded
+            self.document_states[document_id] = state
+        return state
+
+    async def _load_content(self, document_id: int) -> str:
+        """从数据库读取文档内容"""
+        async for db in get_db():
+            result = await db.execute(select(Document.content).where(Document.id == document_id))
+            return result.scalar() or ""
+        return ""
+
+    async def _commit(
+        self, document_id: int, state: DocumentState, operation: ot.TextOperation,
+        user_id: int, session_id: str = None, content_update: bool = False
+    ) -> ot.TextOperation:
+        """提交基于 state.revision 的操作，返回最终提交的操作
+
+        多 worker 时通过协作总线原子地获取全局修订号；若其他 worker 抢先提交，
+        先追上缺失的操作，再把本操作转换过这些操作后重试。
+        """
+        while True:
+            # 先在本地应用，格式错误的操作不会进入全局日志
+            content = ot.apply(state.content, operation)
+            if not collaboration_bus.enabled:
+                break
+
+            record = {
+                "ops": operation,
+                "user_id": user_id,
+                "session_id": session_id,
+                "content_update": content_update
+            }
+            committed, latest = await collaboration_bus.commit_operation(document_id, state.revision, record)
+            if committed:
+                break
+
+            missed = await self._catch_up(document_id, state)
+            # 操作日志被重置（协作之外的写入）时追不上最新修订号
+            if missed is None or state.revision < latest:
+                await self._resync_local_sessions(document_id)
+                raise ot.OTError("document state was out of sync and has been reloaded")
+            operation = ot.transform_against(operation, missed)
+
+        new_revision = state.commit(operation, content)
+        if collaboration_bus.enabled and new_revision % settings.COLLAB_SNAPSHOT_INTERVAL == 0:
+            await collaboration_bus.save_snapshot(document_id, new_revision, state.content)
+        return operation
+
+    async def _catch_up(self, document_id: int, state: DocumentState, records: List[dict] = None) -> Optional[List[ot.TextOperation]]:
+        """应用其他 worker 提交的操作并转发给本地会话
+
+        返回按顺序应用的操作；操作日志不连续时返回 None。
+        """
+        if records is None or (records and records[0]["revision"] > state.revision + 1):
+            records = await collaboration_bus.get_operations_since(document_id, state.revision)
+
+        applied = []
+        for record in records:
+            if record["revision"] <= state.revision:
+                continue
+            if record["revision"] != state.revision + 1:
+                return None
+
+            state.commit(record["ops"])
+            applied.append(record["ops"])
+            if record.get("content_update"):
+                self._broadcast(document_id, {
+                    "type": "content_update",
+                    "content": state.content,
+                    "sender_id": record["user_id"],
+                    "revision": record["revision"]
+                })
+            else:
+                self._broadcast(document_id, {
+                    "type": "operation",
+                    "operation": {"ops": record["ops"], "revision": record["revision"]},
+                    "sender_id": record["user_id"]
+                })
+        return applied
+
+    async def _resync_local_sessions(self, document_id: int):
+        """本地状态无法追上全局日志时重新加载，并让本地会话整体同步"""
+        print(f"⚠️ 文档 {document_id} 状态落后于操作日志，重新加载")
+        self.document_states.pop(document_id, None)
+        state = await self.get_document_state(document_id)
+        self._broadcast(document_id, {"type": "resync", "revision": state.revision, "content": state.content})
+
+    async def _reset_document_state(self, document_id: int, content: Optional[str]):
+        """文档内容被协作之外的写入替换：丢弃内存状态，本地会话整体同步到新内容"""
+        async with self.document_lock(document_id):
+            previous = self.document_states.pop(document_id, None)
+            if collaboration_bus.enabled:
+                # 共享快照已是新内容
+                state = await self.get_document_state(document_id)
+            elif content is not None:
+                # 修订号前进，旧修订号上的操作都会被要求重新同步
+                revision = previous.revision + 1 if previous is not None else 0
+                state = DocumentState(content, revision, settings.OT_HISTORY_SIZE)
+                self.document_states[document_id] = state
             else:
-                # 通知其他用户有用户离开
-                print(f"📤 准备广播用户离开消息...")
-                await self.broadcast_user_left(document_id, user_id)
+                return
+            self._broadcast(document_id, {"type": "resync", "revision": state.revision, "content": state.content})
+
+    async def on_bus_message(self, document_id: int, payload: dict):
+        """处理其他 worker 通过协作总线发布的消息"""
+        if payload.get("kind") == "reset":
+            # 尚未写入的协作内容基于旧内容，不能再覆盖新内容
+            document_storage_service.discard_pending_content(document_id)
+            if document_id in self.active_connections:
+                await self._reset_document_state(document_id, payload.get("content"))
+            return
+        if document_id not in self.active_connections:
+            return
 
-    async def handle_operation(self, document_id: int, user_id: int, operation: dict):
-        """处理文档操作"""
+        if payload.get("kind") == "operation":
+            async with self.document_lock(document_id):
+                state = self.document_states.get(document_id)
+                if state is None:
+                    return
+                if await self._catch_up(document_id, state, [payload["record"]]) is None:
+                    await self._resync_local_sessions(document_id)
+        elif payload.get("kind") == "event":
+            self._broadcast(
+                document_id,
+                payload["message"],
+                exclude_session_id=payload.get("exclude_session_id"),
+                exclude_user_id=payload.get("exclude_user_id"),
+                droppable=payload.get("droppable", False),
+            )
+
+    async def _fanout(
+        self, document_id: int, message: dict, exclude_session_id: str = None,
+        exclude_user_id: int = None, droppable: bool = False
+    ) -> int:
+        """投递给本地会话，并通过协作总线转发给其他 worker"""
+        delivered = self._broadcast(
+            document_id, message,
+            exclude_session_id=exclude_session_id,
+            exclude_user_id=exclude_user_id,
+            droppable=droppable
+        )
+        await collaboration_bus.publish(document_id, {
+            "kind": "event",
+            "message": message,
+            "exclude_session_id": exclude_session_id,
+            "exclude_user_id": exclude_user_id,
+            "droppable": droppable
+        })
+        return delivered
+
+    async def handle_operation(self, document_id: int, user_id: int, operation: dict, session_id: str = None):
+        """处理文档操作
+
+        客户端发送 {"revision": 基准修订号, "ops": [...]}，服务端将其转换过基准之后的
+        并发操作后应用，向发送者回复 ack，向其他会话广播转换后的增量操作。
+        """
         print(f"📝 处理用户 {user_id} 的操作: {operation}")
-        
-        async with self.document_locks[document_id]:
-            # 转换操作
-            transformed_operation = await self.transform_operation(document_id, operation)
-            await self.broadcast_operation(document_id, user_id, transformed_operation)
-            # 使用文档存储服务保存操作
-            await document_storage_service.save_content(document_id, user_id, "", operation)
+
+        # 保存缓冲已满时在加锁前等待（不持锁阻塞同一文档的其他会话），超时则拒绝本次操作
+        if not await document_storage_service.reserve_operation():
+            await self._reject_busy(document_id, session_id)
+            return
+        try:
+            async with self.document_lock(document_id):
+                state = await self.get_document_state(document_id)
+                revision = operation.get("revision", operation.get("version", state.revision))
+
+                if not isinstance(revision, int) or revision > state.revision or revision < state.oldest_revision:
+                    # 基准修订号超出历史窗口，无法转换，要求客户端整体重新同步
+                    await self.send_to_session(document_id, session_id, {
+                        "type": "resync",
+                        "revision": state.revision,
+                        "content": state.content
+                    })
+                    return
+
+                try:
+                    client_operation = ot.parse(operation)
+                    transformed_operation = await self.transform_operation(document_id, client_operation, revision)
+                    transformed_operation = await self._commit(
+                        document_id, state, transformed_operation, user_id, session_id
+                    )
+                    new_revision = state.revision
+                except ot.OTError as e:
+                    print(f"❌ 无效操作: {e}")
+                    await self.send_to_session(document_id, session_id, {
+                        "type": "error",
+                        "message": f"Invalid operation: {e}",
+                        "revision": state.revision
+                    })
+                    return
+
+                await self.send_to_session(document_id, session_id, {"type": "ack", "revision": new_revision})
+                await self.broadcast_operation(
+                    document_id, user_id,
+                    {"ops": transformed_operation, "revision": new_revision},
+                    session_id
+                )
+                if ot.is_noop(transformed_operation):
+                    return
+
+                record = ot.summarize(transformed_operation)
+                record["id"] = operation.get("id", f"{session_id}_{new_revision}")
+                record["sequence"] = new_revision
+                # 使用文档存储服务保存操作后的完整内容
+                await document_storage_service.save_content(document_id, user_id, state.content, record)
+        finally:
+            await document_storage_service.release_operation()
 
     async def handle_content_update(self, document_id: int, user_id: int, content: str, session_id: str = None):
         """处理完整内容更新"""
         print(f"📝 处理用户 {user_id} 的内容更新，长度: {len(content)}，会话ID: {session_id}")
         
-        async with self.document_locks[document_id]:
+        if not await document_storage_service.wait_for_capacity():
+            await self._reject_busy(document_id, session_id)
+            return
+        async with self.document_lock(document_id):
+            state = await self.get_document_state(document_id)
+            # 整文档更新也折算成增量操作记入历史，保证并发的增量操作能正确转换
+            operation = ot.diff(state.content, content)
+            if not operation:
+                return
+            await self._commit(document_id, state, operation, user_id, session_id, content_update=True)
+            # 与其他 worker 的并发操作合并后，最终内容可能与客户端提交的不同
+            content = state.content
+
             await self.broadcast_content_update(document_id, user_id, content, session_id)
             # 使用文档存储服务保存内容
             await document_storage_service.save_content(document_id, user_id, content)
 
-    async def transform_operation(self, document_id: int, operation: dict) -> dict:
-        """OT算法转换操作"""
-        # 简单的操作转换逻辑
-        return operation
-
-    def operational_transform(self, op1: dict, op2: dict) -> dict:
-        """操作转换核心算法"""
-        # 操作转换算法
-        return op1
+    async def _reject_busy(self, document_id: int, session_id: str):
+        """保存缓冲已满：拒绝修改，客户端需稍后重试"""
+        state = self.document_states.get(document_id)
+        await self.send_to_session(document_id, session_id, {
+            "type": "error",
+            "code": "save_backlog_full",
+            "message": "Document saves are backed up, change rejected; please retry",
+            "revision": state.revision if state is not None else None
+        })
+
+    async def transform_operation(self, document_id: int, operation: ot.TextOperation, revision: int) -> ot.TextOperation:
+        """OT算法转换操作：依次转换过基准修订号之后已提交的操作"""
+        state = self.document_states[document_id]
+        return ot.transform_against(operation, state.operations_since(revision))
+
+    def operational_transform(self, op1: ot.TextOperation, op2: ot.TextOperation) -> ot.TextOperation:
+        """操作转换核心算法：返回 op1 在 op2 之后应用的等价操作"""
+        return ot.transform(op1, op2)[0]
+
+    def _on_connection_closed(self, document_id: int, user_id: int, connection: OutboundConnection):
+        """写协程因发送失败或慢连接被驱逐而退出时清理会话"""
+        conn_info = self.active_connections.get(document_id, {}).get(connection.session_id)
+        if conn_info and conn_info["connection"] is connection:
+            asyncio.create_task(self.disconnect(document_id, user_id, connection.session_id))
+
+    def _resync_message(self, document_id: int) -> Optional[dict]:
+        """为降级的慢连接生成整体重新同步消息"""
+        state = self.document_states.get(document_id)
+        if state is None:
+            return None
+        return {"type": "resync", "revision": state.revision, "content": state.content}
+
+    def _broadcast(
+        self,
+        document_id: int,
+        message: dict,
+        exclude_session_id: str = None,
+        exclude_user_id: int = None,
+        only_user_id: int = None,
+        droppable: bool = False,
+    ) -> int:
+        """每种协议只编码一次后投递到各会话的发送队列，返回投递的会话数"""
+        connections = self.active_connections.get(document_id)
+        if not connections:
+            return 0
+
+        frames = {}
+        delivered = 0
+        for session_id, conn_info in list(connections.items()):
+            if exclude_session_id and session_id == exclude_session_id:
+                continue
+            if exclude_user_id is not None and conn_info["user_id"] == exclude_user_id:
+                continue
+            if only_user_id is not None and conn_info["user_id"] != only_user_id:
+                continue
+            connection = conn_info["connection"]
+            frame = frames.get(connection.codec.name)
+            if frame is None:
+                frame = frames[connection.codec.name] = connection.codec.encode(message)
+            if connection.send(frame, droppable=droppable):
+                delivered += 1
+        return delivered
+
+    async def send_to_session(self, document_id: int, session_id: str, message: dict):
+        """发送消息给指定会话"""
+        conn_info = self.active_connections.get(document_id, {}).get(session_id)
+        if conn_info:
+            connection = conn_info["connection"]
+            connection.send(connection.codec.encode(message))
 
     async def broadcast_operation(
         self, document_id: int, sender_id: int, operation: dict, sender_session_id: str = None
     ):
         """广播操作给其他用户"""
-        if document_id not in self.active_connections:
-            return
-
         message = {"type": "operation", "operation": operation, "sender_id": sender_id}
-
-        for session_id, conn_info in self.active_connections[document_id].items():
-            # 排除发送者的所有会话（如果指定了特定会话ID，则只排除该会话）
-            if (sender_session_id and session_id != sender_session_id) or \
-               (not sender_session_id and conn_info["user_id"] != sender_id):
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                    print(f"📤 广播操作给用户 {conn_info['user_id']} (会话 {session_id})")
-                except Exception as e:
-                    print(f"❌ 广播操作失败: {e}")
-                    await self.disconnect(document_id, conn_info["user_id"], session_id)
+        # 排除发送者的所有会话（如果指定了特定会话ID，则只排除该会话）
+        delivered = self._broadcast(
+            document_id, message,
+            exclude_session_id=sender_session_id,
+            exclude_user_id=None if sender_session_id else sender_id
+        )
+        print(f"📤 广播操作给 {delivered} 个会话")
 
     async def broadcast_content_update(
         self, document_id: int, sender_id: int, content: str, sender_session_id: str = None
     ):
         """广播完整内容更新给其他用户"""
-        if document_id not in self.active_connections:
-            return
-
         message = {"type": "content_update", "content": content, "sender_id": sender_id}
+        state = self.document_states.get(document_id)
+        if state is not None:
+            message["revision"] = state.revision
 
-        for session_id, conn_info in self.active_connections[document_id].items():
-            # 排除发送者的所有会话（如果指定了特定会话ID，则只排除该会话）
-            if (sender_session_id and session_id != sender_session_id) or \
-               (not sender_session_id and conn_info["user_id"] != sender_id):
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                    print(f"📤 广播完整内容给用户 {conn_info['user_id']} (会话 {session_id})，长度: {len(content)}")
-                except Exception as e:
-                    print(f"❌ 广播内容更新失败: {e}")
-                    await self.disconnect(document_id, conn_info["user_id"], session_id)
+        delivered = self._broadcast(
+            document_id, message,
+            exclude_session_id=sender_session_id,
+            exclude_user_id=None if sender_session_id else sender_id
+        )
+        print(f"📤 广播完整内容给 {delivered} 个会话，长度: {len(content)}")
 
     async def broadcast_cursor_position(
         self, document_id: int, user_id: int, position: dict, sender_session_id: str = None
     ):
-        """广播光标位置给其他用户"""
-        if document_id not in self.active_connections:
-            return
+        """广播光标位置给其他用户
 
-        message = {"type": "cursor", "user_id": user_id, "position": position}
+        光标更新先交给在线状态服务合并，按 PRESENCE_CURSOR_HZ 的频率只发送每个用户的最新位置
+        """
+        presence_service.queue_cursor(document_id, user_id, position, sender_session_id)
 
-        for session_id, conn_info in self.active_connections[document_id].items():
-            # 排除发送者的所有会话（如果指定了特定会话ID，则只排除该会话）
-            if (sender_session_id and session_id != sender_session_id) or \
-               (not sender_session_id and conn_info["user_id"] != user_id):
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                except:
-                    await self.disconnect(document_id, conn_info["user_id"], session_id)
+    async def send_cursor_frame(self, document_id: int, message: dict, sender_session_id: str = None):
+        """发送合并后的光标消息（队列满时可丢弃）"""
+        await self._fanout(
+            document_id, message,
+            exclude_session_id=sender_session_id,
+            exclude_user_id=None if sender_session_id else message["user_id"],
+            droppable=True
+        )
 
     async def broadcast_user_joined(self, document_id: int, user_id: int):
         """广播用户加入消息"""
@@ -183,8 +537,7 @@ class CollaborationManager:
             return
 
         # 获取用户信息
-        user_info = self.user_cache.get(user_id, {"id": user_id, "username": f"User{user_id}"})
-        
+        user_info = self._user_info(user_id)
         message = {
             "type": "user_joined",
             "user": user_info
@@ -192,52 +545,45 @@ class CollaborationManager:
 
         print(f"🔍 广播用户加入: {user_info['username']} (ID: {user_id})")
         print(f"🔍 当前连接数: {len(self.active_connections[document_id])}")
-
-        for session_id, conn_info in self.active_connections[document_id].items():
-            if conn_info["user_id"] != user_id:
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                    print(f"📤 广播用户加入: {user_info['username']} 给用户 {conn_info['user_id']} (会话 {session_id})")
-                except Exception as e:
-                    print(f"❌ 广播用户加入失败: {e}")
-                    await self.disconnect(document_id, conn_info["user_id"], session_id)
+        await self._fanout(document_id, message, exclude_user_id=user_id)
 
     async def broadcast_user_left(self, document_id: int, user_id: int):
         """广播用户离开消息"""
-        if document_id not in self.active_connections:
-            return
-
         message = {
             "type": "user_left",
             "user_id": user_id
         }
 
         print(f"🔍 广播用户离开: {user_id}")
-        print(f"🔍 剩余连接数: {len(self.active_connections[document_id])}")
-
-        for session_id, conn_info in self.active_connections[document_id].items():
-            if conn_info["user_id"] != user_id:
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                    print(f"📤 广播用户离开: {user_id} 给用户 {conn_info['user_id']} (会话 {session_id})")
-                except Exception as e:
-                    print(f"❌ 广播用户离开失败: {e}")
-                    await self.disconnect(document_id, conn_info["user_id"], session_id)
+        print(f"🔍 剩余连接数: {len(self.active_connections.get(document_id, {}))}")
+        await self._fanout(document_id, message, exclude_user_id=user_id)
 
     async def send_online_users(self, document_id: int, user_id: int):
         """发送在线用户列表给指定用户"""
         if document_id not in self.active_connections:
             return
 
-        # 获取在线用户列表（去重）
+        # 获取在线用户列表（去重），Redis 可用时包含其他 worker 上的用户
+        user_infos = await presence_service.get_online_users(document_id)
+
         online_users = []
         seen_users = set()
-        for conn_info in self.active_connections[document_id].values():
-            uid = conn_info["user_id"]
-            if uid not in seen_users:
-                user_info = self.user_cache.get(uid, {"id": uid, "username": f"User{uid}"})
-                online_users.append(user_info)
-                seen_users.add(uid)
+        for user_info in user_infos:
+            if user_info["id"] not in seen_users:
+                online_users.append(dict(user_info))
+                seen_users.add(user_info["id"])
+
+        # 一次查询附带每位在线用户对文档的权限
+        try:
+            async with AsyncSessionLocal() as db:
+                levels = await PermissionService.get_user_permission_levels(
+                    db, document_id, seen_users
+                )
+            for user_info in online_users:
+                permission = PermissionService.permission_for_level(levels.get(user_info["id"], 0))
+                user_info["permission"] = permission.value if permission else None
+        except Exception as e:
+            print(f"❌ 获取在线用户权限失败: {e}")
 
         message = {
             "type": "online_users",
@@ -245,16 +591,32 @@ class CollaborationManager:
         }
 
         # 发送给指定用户的所有会话
-        for session_id, conn_info in self.active_connections[document_id].items():
-            if conn_info["user_id"] == user_id:
-                try:
-                    await conn_info["websocket"].send_text(json.dumps(message))
-                    print(f"📤 发送在线用户列表给用户 {user_id} (会话 {session_id}): {len(online_users)} 人")
-                    for user in online_users:
-                        print(f"   - {user['username']} (ID: {user['id']})")
-                except Exception as e:
-                    print(f"❌ 发送在线用户列表失败: {e}")
-                    await self.disconnect(document_id, user_id, session_id)
+        self._broadcast(document_id, message, only_user_id=user_id)
+        print(f"📤 发送在线用户列表给用户 {user_id}: {len(online_users)} 人")
+
+    def get_metrics(self) -> dict:
+        """获取连接与发送队列指标"""
+        connections = [
+            conn_info["connection"]
+            for sessions in self.active_connections.values()
+            for conn_info in sessions.values()
+        ]
+        metrics = self.metrics.snapshot(connections)
+        metrics["documents"] = len(self.active_connections)
+        return metrics
+
+    def get_local_presence(self) -> Dict[int, Dict[int, dict]]:
+        """本 worker 上的在线用户 {document_id: {user_id: user_info}}"""
+        return {
+            document_id: {
+                conn_info["user_id"]: self._user_info(conn_info["user_id"])
+                for conn_info in sessions.values()
+            }
+            for document_id, sessions in self.active_connections.items()
+        }
+
+    def _user_info(self, user_id: int) -> dict:
+        return self.user_cache.get(user_id, {"id": user_id, "username": f"User{user_id}"})
 
     def update_user_cache(self, user_id: int, user_info: dict):
         """更新用户信息缓存"""
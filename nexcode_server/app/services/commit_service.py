@@ -4,11 +4,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, desc, and_
 from sqlalchemy.orm import selectinload
 
+from app.core.pagination import Paginator
+from app.core.search import text_match, match_rank
 from app.models.database import CommitInfo, User
 from app.models.user_schemas import (
     CommitInfoCreate, CommitInfoUpdate, CommitInfoResponse,
     UserCommitStats, CommitTrends, CommitAnalytics
 )
+from app.services.count_cache import count_cache
+from app.services.retrieval_service import retrieval_service
 
 class CommitService:
     
@@ -30,6 +34,7 @@ class CommitService:
         db.add(commit_info)
         await db.commit()
         await db.refresh(commit_info)
+        retrieval_service.index_commit(commit_info)
         return commit_info
     
     def _parse_diff_content(self, diff_content: Optional[str]) -> Dict[str, Any]:
@@ -93,6 +98,7 @@ class CommitService:
         
         await db.commit()
         await db.refresh(commit_info)
+        retrieval_service.index_commit(commit_info)
         return commit_info
     
     async def delete_commit_info(self, db: AsyncSession, commit_id: int, 
@@ -104,6 +110,7 @@ class CommitService:
         
         await db.delete(commit_info)
         await db.commit()
+        retrieval_service.remove_commit(user_id, commit_id)
         return True
     
     async def get_user_commits(self, db: AsyncSession, user_id: int,
@@ -111,38 +118,48 @@ class CommitService:
                              repository_name: Optional[str] = None,
                              status: Optional[str] = None,
                              start_date: Optional[datetime] = None,
-                             end_date: Optional[datetime] = None) -> List[CommitInfo]:
-        """获取用户的commit列表"""
-        stmt = select(CommitInfo).where(CommitInfo.user_id == user_id)
+                             end_date: Optional[datetime] = None,
+                             cursor: Optional[str] = None) -> Dict[str, Any]:
+        """获取用户的commit列表
+
+        Returns:
+            Dict: {"commits": 当前页, "total": 总数（近似）, "next_cursor": 下一页游标}
+        """
+        conditions = [CommitInfo.user_id == user_id]
         
         # 添加筛选条件
         if repository_name:
-            stmt = stmt.where(CommitInfo.repository_name == repository_name)
+            conditions.append(CommitInfo.repository_name == repository_name)
         if status:
-            stmt = stmt.where(CommitInfo.status == status)
+            conditions.append(CommitInfo.status == status)
         if start_date:
-            stmt = stmt.where(CommitInfo.created_at >= start_date)
+            conditions.append(CommitInfo.created_at >= start_date)
         if end_date:
-            stmt = stmt.where(CommitInfo.created_at <= end_date)
-        
-        # 排序和分页
-        stmt = stmt.order_by(desc(CommitInfo.created_at)).offset(skip).limit(limit)
+            conditions.append(CommitInfo.created_at <= end_date)
         
-        result = await db.execute(stmt)
-        return result.scalars().all()
+        return await self._page(db, select(CommitInfo), conditions, skip, limit, cursor)
     
     async def get_commits_with_user(self, db: AsyncSession, skip: int = 0, limit: int = 100,
-                                  repository_name: Optional[str] = None) -> List[CommitInfo]:
+                                  repository_name: Optional[str] = None,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
         """获取包含用户信息的commit列表（管理员功能）"""
-        stmt = select(CommitInfo).options(selectinload(CommitInfo.user))
-        
+        conditions = []
         if repository_name:
-            stmt = stmt.where(CommitInfo.repository_name == repository_name)
-        
-        stmt = stmt.order_by(desc(CommitInfo.created_at)).offset(skip).limit(limit)
+            conditions.append(CommitInfo.repository_name == repository_name)
         
-        result = await db.execute(stmt)
-        return result.scalars().all()
+        stmt = select(CommitInfo).options(selectinload(CommitInfo.user))
+        return await self._page(db, stmt, conditions, skip, limit, cursor)
+    
+    async def _page(self, db: AsyncSession, stmt, conditions: List[Any],
+                    skip: int, limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+        """按 (created_at, id) 从新到旧键集分页，总数取自计数缓存"""
+        paginator = Paginator(
+            [(CommitInfo.created_at, True), (CommitInfo.id, True)], cursor, limit, skip
+        )
+        result = await db.execute(paginator.apply(stmt.where(*conditions)))
+        commits, next_cursor = paginator.page(result.scalars().all())
+        total = await count_cache.count(db, select(func.count(CommitInfo.id)).where(*conditions))
+        return {"commits": commits, "total": total, "next_cursor": next_cursor}
     
     async def get_commit_stats(self, db: AsyncSession, user_id: int) -> UserCommitStats:
         """获取用户commit统计信息"""
@@ -283,31 +300,46 @@ class CommitService:
                            repository_name: Optional[str] = None,
                            commit_style: Optional[str] = None,
                            min_rating: Optional[int] = None,
-                           skip: int = 0, limit: int = 100) -> List[CommitInfo]:
-        """搜索commit信息"""
-        stmt = select(CommitInfo)
+                           skip: int = 0, limit: int = 100,
+                           cursor: Optional[str] = None) -> Dict[str, Any]:
+        """搜索commit信息
+
+        有查询词时按相关度排序（偏移游标），否则按时间键集分页
+        """
+        conditions = []
         
         if user_id:
-            stmt = stmt.where(CommitInfo.user_id == user_id)
+            conditions.append(CommitInfo.user_id == user_id)
         
         if query:
-            # 在commit消息中搜索
-            search_filter = func.lower(CommitInfo.final_commit_message).contains(query.lower())
-            stmt = stmt.where(search_filter)
+            # 在commit消息中搜索（PostgreSQL下使用pg_trgm索引）
+            conditions.append(text_match(db, [CommitInfo.final_commit_message], query))
         
         if repository_name:
-            stmt = stmt.where(CommitInfo.repository_name == repository_name)
+            conditions.append(CommitInfo.repository_name == repository_name)
         
         if commit_style:
-            stmt = stmt.where(CommitInfo.commit_style == commit_style)
+            conditions.append(CommitInfo.commit_style == commit_style)
         
         if min_rating:
-            stmt = stmt.where(CommitInfo.user_rating >= min_rating)
-        
-        stmt = stmt.order_by(desc(CommitInfo.created_at)).offset(skip).limit(limit)
-        
-        result = await db.execute(stmt)
-        return result.scalars().all()
+            conditions.append(CommitInfo.user_rating >= min_rating)
+        
+        if not query:
+            return await self._page(db, select(CommitInfo), conditions, skip, limit, cursor)
+        
+        # 有查询词时按相关度排序，相关度相同再按时间排序
+        paginator = Paginator(
+            [
+                (match_rank(db, [CommitInfo.final_commit_message], query), True),
+                (CommitInfo.created_at, True),
+                (CommitInfo.id, True),
+            ],
+            cursor, limit, skip, keyset=False
+        )
+        result = await db.execute(paginator.apply(select(CommitInfo).where(*conditions)))
+        commits, next_cursor = paginator.page(result.scalars().all())
+        total = await count_cache.count(db, select(func.count(CommitInfo.id)).where(*conditions))
+        return {"commits": commits, "total": total, "next_cursor": next_cursor}
     
     async def mark_commit_as_committed(self, db: AsyncSession, commit_id: int, 
                                      user_id: int, commit_hash: str) -> Optional[CommitInfo]:
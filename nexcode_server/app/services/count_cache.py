@@ -0,0 +1,82 @@
+"""
+列表总数缓存
+列表接口的总数只需近似值：同一计数查询的结果缓存 COUNT_CACHE_TTL 秒，
+过期后先返回旧值，同时在后台用独立会话重新计数，翻页时不再重复执行 count()。
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class CountCache:
+    """按计数语句（SQL + 参数）缓存的近似总数"""
+
+    def __init__(self):
+        # {key: (总数, 计算时间)}
+        self._counts: "OrderedDict[Hashable, Tuple[int, float]]" = OrderedDict()
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        self.metrics = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0}
+
+    @staticmethod
+    def _key(db: AsyncSession, stmt: Select) -> Hashable:
+        compiled = stmt.compile(dialect=db.get_bind().dialect)
+        return str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items()))
+
+    def _store(self, key: Hashable, value: int):
+        self._counts[key] = (value, time.monotonic())
+        self._counts.move_to_end(key)
+        while len(self._counts) > settings.COUNT_CACHE_SIZE:
+            self._counts.popitem(last=False)
+
+    async def count(self, db: AsyncSession, stmt: Select) -> int:
+        """执行 select(func.count())... 语句，返回缓存的（可能略旧的）结果"""
+        key = self._key(db, stmt)
+        entry = self._counts.get(key)
+        if entry is not None:
+            self._counts.move_to_end(key)
+            value, computed_at = entry
+            if time.monotonic() - computed_at < settings.COUNT_CACHE_TTL:
+                self.metrics["hits"] += 1
+            else:
+                self.metrics["stale_hits"] += 1
+                self._schedule_refresh(key, stmt)
+            return value
+
+        self.metrics["misses"] += 1
+        value = (await db.execute(stmt)).scalar() or 0
+        self._store(key, value)
+        return value
+
+    def _schedule_refresh(self, key: Hashable, stmt: Select):
+        if key not in self._refreshing:
+            self._refreshing[key] = asyncio.create_task(self._refresh(key, stmt))
+
+    async def _refresh(self, key: Hashable, stmt: Select):
+        try:
+            async with AsyncSessionLocal() as db:
+                value = (await db.execute(stmt)).scalar() or 0
+            self._store(key, value)
+            self.metrics["refreshes"] += 1
+        except Exception as e:
+            self.metrics["refresh_failures"] += 1
+            logger.warning(f"Failed to refresh cached count: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {**self.metrics, "cached": len(self._counts), "refreshing": len(self._refreshing)}
+
+
+# 全局实例
+count_cache = CountCache()
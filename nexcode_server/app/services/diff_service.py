@@ -0,0 +1,348 @@
+"""
+版本差异服务
+按行比较两个版本：每行先映射为整数 id，再用线性空间的 Myers 算法（中间蛇分治）求最短编辑脚本，
+结果整理为带上下文的差异块（hunk）。大文档在进程池中计算，结果按 (文档, 起始版本, 目标版本, 上下文行数)
+缓存；统一格式文本和 HTML 只渲染请求的那一页差异块。
+"""
+
+import asyncio
+import html
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def _bisect(a: Sequence[int], b: Sequence[int], a_lo: int, a_hi: int, b_lo: int, b_hi: int,
+            deadline: float) -> Optional[Tuple[int, int]]:
+    """同时从两端搜索 D 条路径，返回中间蛇的分割点（相对 a_lo / b_lo），超时或没有公共行时返回 None"""
+    n, m = a_hi - a_lo, b_hi - b_lo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    # 路径总长为奇数时由正向搜索检测重叠，否则由反向搜索检测
+    front = delta % 2 != 0
+    k1_start = k1_end = k2_start = k2_end = 0
+    for d in range(max_d):
+        if time.monotonic() > deadline:
+            return None
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
+            else:
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            forward[k1_offset] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < size and backward[k2_offset] != -1:
+                    if x1 >= n - backward[k2_offset]:
+                        return x1, y1
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[k2_offset] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < size and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, x1 - (k1_offset - offset)
+    return None
+
+
+def myers_opcodes(a: Sequence[int], b: Sequence[int], timeout: float = 5.0) -> List[Opcode]:
+    """最短编辑脚本，格式同 difflib.SequenceMatcher.get_opcodes；超时后剩余部分按整体替换处理"""
+    if a and b and set(a).isdisjoint(b):
+        # 没有任何公共行，不必搜索
+        return [("replace", 0, len(a), 0, len(b))]
+    deadline = time.monotonic() + timeout
+    edits: List[Opcode] = []
+    # 显式栈代替递归：("diff", 区间) 继续分治，("emit", 操作) 按顺序输出
+    stack: List[Tuple[Any, ...]] = [("diff", 0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == "emit":
+            edits.append(item[1])
+            continue
+        _, a_lo, a_hi, b_lo, b_hi = item
+        prefix = 0
+        while a_lo + prefix < a_hi and b_lo + prefix < b_hi and a[a_lo + prefix] == b[b_lo + prefix]:
+            prefix += 1
+        suffix = 0
+        while (a_hi - suffix > a_lo + prefix and b_hi - suffix > b_lo + prefix
+               and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]):
+            suffix += 1
+        mid_a_lo, mid_a_hi = a_lo + prefix, a_hi - suffix
+        mid_b_lo, mid_b_hi = b_lo + prefix, b_hi - suffix
+
+        # 按输出顺序的逆序入栈
+        if suffix:
+            stack.append(("emit", ("equal", mid_a_hi, a_hi, mid_b_hi, b_hi)))
+        split = None
+        if mid_a_lo < mid_a_hi and mid_b_lo < mid_b_hi:
+            split = _bisect(a, b, mid_a_lo, mid_a_hi, mid_b_lo, mid_b_hi, deadline)
+        if split is not None:
+            x, y = split
+            stack.append(("diff", mid_a_lo + x, mid_a_hi, mid_b_lo + y, mid_b_hi))
+            stack.append(("diff", mid_a_lo, mid_a_lo + x, mid_b_lo, mid_b_lo + y))
+        else:
+            if mid_b_lo < mid_b_hi:
+                stack.append(("emit", ("insert", mid_a_hi, mid_a_hi, mid_b_lo, mid_b_hi)))
+            if mid_a_lo < mid_a_hi:
+                stack.append(("emit", ("delete", mid_a_lo, mid_a_hi, mid_b_lo, mid_b_lo)))
+        if prefix:
+            stack.append(("emit", ("equal", a_lo, mid_a_lo, b_lo, mid_b_lo)))
+    return _coalesce(edits)
+
+
+def _coalesce(edits: List[Opcode]) -> List[Opcode]:
+    """合并相邻的同类操作，相邻的删除和插入合并为 replace"""
+    opcodes: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in edits:
+        if opcodes:
+            last_tag, li1, li2, lj1, lj2 = opcodes[-1]
+            if last_tag == tag or (last_tag != "equal" and tag != "equal"):
+                merged = last_tag if last_tag == tag else "replace"
+                opcodes[-1] = (merged, li1, i2, lj1, j2)
+                continue
+        opcodes.append((tag, i1, i2, j1, j2))
+    return opcodes
+
+
+def _group_opcodes(opcodes: List[Opcode], context: int) -> Iterator[List[Opcode]]:
+    """按上下文行数把操作分成差异块（同 difflib.SequenceMatcher.get_grouped_opcodes）"""
+    codes = list(opcodes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def compute_diff(old: str, new: str, context: int = 3, timeout: float = 5.0) -> Dict[str, Any]:
+    """计算差异块（可在子进程中执行）"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    line_ids: Dict[str, int] = {}
+    a = [line_ids.setdefault(line, len(line_ids)) for line in old_lines]
+    b = [line_ids.setdefault(line, len(line_ids)) for line in new_lines]
+    opcodes = myers_opcodes(a, b, timeout)
+
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            removed += i2 - i1
+            added += j2 - j1
+
+    hunks = []
+    for group in _group_opcodes(opcodes, context):
+        hunks.append({
+            "from_start": group[0][1],
+            "from_end": group[-1][2],
+            "to_start": group[0][3],
+            "to_end": group[-1][4],
+            "blocks": [[tag, old_lines[i1:i2], new_lines[j1:j2]] for tag, i1, i2, j1, j2 in group],
+        })
+    return {"hunks": hunks, "added_lines": added, "removed_lines": removed}
+
+
+def _format_range(start: int, stop: int) -> str:
+    """统一格式的行号范围（同 difflib）"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def _line(text: str) -> str:
+    return text if text.endswith("\n") else text + "\n"
+
+
+def render_unified(hunks: List[Dict[str, Any]], from_label: str, to_label: str) -> str:
+    """渲染统一格式差异文本"""
+    if not hunks:
+        return ""
+    parts = [f"--- {from_label}\n", f"+++ {to_label}\n"]
+    for hunk in hunks:
+        parts.append(
+            f"@@ -{_format_range(hunk['from_start'], hunk['from_end'])} "
+            f"+{_format_range(hunk['to_start'], hunk['to_end'])} @@\n"
+        )
+        for tag, old_lines, new_lines in hunk["blocks"]:
+            if tag == "equal":
+                parts.extend(" " + _line(line) for line in old_lines)
+                continue
+            parts.extend("-" + _line(line) for line in old_lines)
+            parts.extend("+" + _line(line) for line in new_lines)
+    return "".join(parts)
+
+
+def render_html(hunks: List[Dict[str, Any]], from_label: str, to_label: str) -> str:
+    """渲染左右对照的 HTML 表格（样式类名同 difflib.HtmlDiff）"""
+    def cell(number: Optional[int], text: Optional[str], css: str) -> str:
+        if text is None:
+            return '<td class="diff_next"></td><td></td>'
+        content = html.escape(text.rstrip("\r\n"))
+        if css:
+            content = f'<span class="{css}">{content}</span>'
+        return f'<td class="diff_header">{number}</td><td nowrap="nowrap">{content}</td>'
+
+    rows = [
+        '<table class="diff" cellspacing="0" cellpadding="0" rules="groups">',
+        f'<thead><tr><th colspan="2" class="diff_header">{html.escape(from_label)}</th>'
+        f'<th colspan="2" class="diff_header">{html.escape(to_label)}</th></tr></thead>',
+    ]
+    for hunk in hunks:
+        rows.append("<tbody>")
+        old_no, new_no = hunk["from_start"] + 1, hunk["to_start"] + 1
+        for tag, old_lines, new_lines in hunk["blocks"]:
+            css = {"equal": "", "delete": "diff_sub", "insert": "diff_add", "replace": "diff_chg"}[tag]
+            for index in range(max(len(old_lines), len(new_lines))):
+                old = old_lines[index] if index < len(old_lines) else None
+                new = new_lines[index] if index < len(new_lines) else None
+                rows.append(
+                    "<tr>" + cell(old_no, old, css) + cell(new_no, new, css) + "</tr>"
+                )
+                old_no += old is not None
+                new_no += new is not None
+        rows.append("</tbody>")
+    rows.append("</table>")
+    return "\n".join(rows)
+
+
+class DiffService:
+    """版本差异计算：进程池 + 结果缓存"""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # {(文档, 起始版本, 目标版本, 上下文行数): 差异结果}
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # 正在计算的相同请求共享一个结果
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.metrics = {"cache_hits": 0, "computed": 0, "computed_in_pool": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn：避免 fork 带有事件循环和连接池的进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.DIFF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _compute(self, old: str, new: str, context: int) -> Dict[str, Any]:
+        self.metrics["computed"] += 1
+        if len(old) + len(new) <= settings.DIFF_INLINE_MAX_CHARS or settings.DIFF_WORKERS <= 0:
+            return compute_diff(old, new, context, settings.DIFF_TIMEOUT)
+        self.metrics["computed_in_pool"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(), compute_diff, old, new, context, settings.DIFF_TIMEOUT
+            )
+        except BrokenProcessPool:
+            # 子进程异常退出后重建进程池再试一次
+            self._executor = None
+            return await loop.run_in_executor(
+                self._get_executor(), compute_diff, old, new, context, settings.DIFF_TIMEOUT
+            )
+
+    async def diff_versions(self, document_id: int, from_version: int, to_version: int,
+                            context: int = 3) -> Optional[Dict[str, Any]]:
+        """两个版本之间的差异（缓存未命中时才读取版本内容），版本不存在时返回 None"""
+        key = (document_id, from_version, to_version, context)
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            self.metrics["cache_hits"] += 1
+            return result
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._load_and_compute(document_id, from_version, to_version, context)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待方时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        if result is not None:
+            self._cache[key] = result
+            while len(self._cache) > settings.DIFF_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    async def _load_and_compute(self, document_id: int, from_version: int, to_version: int,
+                                context: int) -> Optional[Dict[str, Any]]:
+        # 延迟导入：进程池子进程只需要差异算法，不加载存储和检索服务
+        from app.services.document_storage_service import document_storage_service
+
+        old = await document_storage_service.get_version_content(document_id, from_version)
+        new = await document_storage_service.get_version_content(document_id, to_version)
+        if old is None or new is None:
+            return None
+        return await self._compute(old, new, context)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {**self.metrics, "cached": len(self._cache)}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 全局实例
+diff_service = DiffService()
@@ -0,0 +1,181 @@
+"""
+文档快照缓存
+打开文档时的元数据（PostgreSQL）和内容 + 版本（ShareDB）分别缓存，命中时无需查询数据库。
+- 元数据在标题、分类、状态等变化时失效
+- 内容在 ShareDB 写入时失效：本 worker 的每次操作立即作废缓存的内容；写回存储、同步和
+  恢复版本时再通知其他 worker。其他 worker 在通知前读到的是较旧但一致的 (内容, 版本)，
+  客户端会按版本号补齐之后的操作。
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.models.database import Document, User
+from app.services.auth_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "documents:invalidate"
+
+# 缓存的文档元数据字段
+METADATA_FIELDS = (
+    "id", "title", "category", "tags", "status", "owner_id", "organization_id",
+    "created_at", "updated_at",
+)
+# 缓存的所有者字段（响应中 user_to_dict 用到的字段，不含密码哈希等凭据）
+OWNER_FIELDS = (
+    "id", "username", "email", "full_name", "is_active", "created_at", "updated_at",
+)
+
+
+class DocumentCache:
+    """文档元数据和内容快照缓存"""
+
+    def __init__(self):
+        # {document_id: 元数据字典（owner 为用户字段字典）}
+        self.metadata = TTLCache(settings.DOCUMENT_CACHE_MAX_ENTRIES)
+        # {document_id: (内容, 版本, 作废标记)}；内容为 None 表示已作废，
+        # 作废标记防止作废前开始的读取把旧内容写回缓存
+        self.contents = TTLCache(settings.DOCUMENT_CACHE_MAX_ENTRIES)
+        self._stamp = 0
+        # 元数据每次失效递增；查询期间发生失效时不写入缓存
+        self.generation = 0
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.enabled = False
+        self.pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """订阅失效通知；Redis 不可用时只在本 worker 内失效（依靠 TTL 收敛）"""
+        try:
+            await redis_client.redis.ping()
+            self.pubsub = redis_client.redis.pubsub(ignore_subscribe_messages=True)
+            await self.pubsub.subscribe(INVALIDATION_CHANNEL)
+            self.enabled = True
+            self._listener_task = asyncio.create_task(self._listen())
+        except Exception as e:
+            logger.warning(f"Redis unavailable, document cache invalidation limited to this worker: {e}")
+
+    async def stop(self):
+        self.enabled = False
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("origin") != self.worker_id:
+                    self._apply(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Document cache invalidation listener error: {e}")
+                await asyncio.sleep(1)
+
+    # ---- 元数据 ----
+
+    @staticmethod
+    def build_metadata(document: Document) -> Dict[str, Any]:
+        """从已加载 owner 的 Document 提取可缓存的元数据"""
+        data = {field: getattr(document, field) for field in METADATA_FIELDS}
+        owner = document.owner
+        data["owner"] = {field: getattr(owner, field) for field in OWNER_FIELDS} if owner else None
+        return data
+
+    @staticmethod
+    def build_owner(metadata: Dict[str, Any]) -> Optional[User]:
+        """根据缓存的字段构造游离态的所有者 User（只包含 OWNER_FIELDS）"""
+        if metadata["owner"] is None:
+            return None
+        owner = User(**metadata["owner"])
+        make_transient_to_detached(owner)
+        return owner
+
+    def get_metadata(self, document_id: int) -> Optional[Dict[str, Any]]:
+        return self.metadata.get(document_id)
+
+    def set_metadata(self, document_id: int, data: Dict[str, Any], generation: int):
+        if generation != self.generation:
+            return
+        self.metadata.set(document_id, data, settings.DOCUMENT_CACHE_TTL)
+
+    async def invalidate_metadata(self, document_id: int):
+        """文档元数据变化（标题、分类、状态、恢复版本等）"""
+        await self._invalidate({"kind": "metadata", "document_id": document_id})
+
+    # ---- 内容 ----
+
+    def lookup_content(self, document_id: int) -> Tuple[Optional[Tuple[str, int]], int]:
+        """返回 ((内容, 版本) 或 None, 读取标记)；未命中时读取后用该标记调用 set_content"""
+        entry = self.contents.get(document_id)
+        if entry is None:
+            return None, 0
+        content, version, stamp = entry
+        return ((content, version) if content is not None else None), stamp
+
+    def set_content(self, document_id: int, content: str, version: int, stamp: int):
+        """缓存读取到的内容；读取期间内容被作废过（标记变化）时放弃"""
+        entry = self.contents.get(document_id)
+        if (entry[2] if entry is not None else 0) != stamp:
+            return
+        self.contents.set(document_id, (content, version, stamp), settings.DOCUMENT_CACHE_TTL)
+
+    def content_changed(self, document_id: int):
+        """本 worker 修改了内容：作废缓存的内容（不通知其他 worker）"""
+        self._stamp += 1
+        self.contents.set(document_id, (None, 0, self._stamp), settings.DOCUMENT_CACHE_TTL)
+
+    async def invalidate_content(self, document_id: int):
+        """内容写回存储、同步或恢复版本：作废所有 worker 中缓存的内容"""
+        await self._invalidate({"kind": "content", "document_id": document_id})
+
+    # ---- 失效 ----
+
+    async def _invalidate(self, payload: Dict[str, Any]):
+        self._apply(payload)
+        if not self.enabled:
+            return
+        try:
+            await redis_client.redis.publish(
+                INVALIDATION_CHANNEL, json.dumps({**payload, "origin": self.worker_id})
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish document cache invalidation: {e}")
+
+    def _apply(self, payload: Dict[str, Any]):
+        document_id = payload["document_id"]
+        if payload["kind"] == "metadata":
+            self.generation += 1
+            self.metadata.pop(document_id)
+        elif payload["kind"] == "content":
+            self.content_changed(document_id)
+
+    def get_metrics(self) -> dict:
+        return {
+            "metadata": self.metadata.stats(),
+            "contents": self.contents.stats(),
+            "cross_worker_invalidation": self.enabled,
+        }
+
+
+# 全局实例
+document_cache = DocumentCache()
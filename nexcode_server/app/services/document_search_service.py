@@ -0,0 +1,300 @@
+"""
+文档全文搜索
+文档内容以 ShareDB 为准，写回时推送到本服务；内容按防抖合并后写入内存倒排索引。
+中文按相邻二字切分（兼顾单字查询），查询只在调用方给出的权限条件内排序，并返回高亮摘要。
+"""
+
+import asyncio
+import html
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.text_index import BM25Index, tokenize_cjk, tokenize_cjk_query
+from app.models.database import Document
+
+logger = logging.getLogger(__name__)
+
+# 选取摘要窗口时最多考察的命中位置数
+MAX_SNIPPET_MATCHES = 200
+
+
+def _match_spans(text: str, query: str) -> List[Tuple[int, int, str]]:
+    """查询词在文本中的所有命中位置 [(start, end, term)]，按起始位置排序，允许相互重叠"""
+    terms = sorted(set(tokenize_cjk_query(query)), key=len, reverse=True)
+    if not text or not terms:
+        return []
+    parts = []
+    for term in terms:
+        if term.isascii():
+            # 英文按整词匹配，与分词一致
+            parts.append(rf"(?<![a-z0-9_]){re.escape(term)}(?![a-z0-9_])")
+        else:
+            parts.append(re.escape(term))
+    # 零宽前瞻匹配，使重叠的二字词（"协同"/"同编"）都能找到
+    pattern = re.compile(f"(?=({'|'.join(parts)}))", re.IGNORECASE)
+    return [
+        (m.start(), m.start() + len(m.group(1)), m.group(1).lower())
+        for m in pattern.finditer(text)
+    ]
+
+
+def _render(text: str, start: int, end: int, spans: List[Tuple[int, int, str]]) -> str:
+    """转义 text[start:end]，并用 <mark> 包裹命中部分（相邻或重叠的命中合并）"""
+    merged: List[List[int]] = []
+    for span_start, span_end, _ in spans:
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        if span_start >= span_end:
+            continue
+        if merged and span_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span_end)
+        else:
+            merged.append([span_start, span_end])
+
+    parts = []
+    cursor = start
+    for span_start, span_end in merged:
+        parts.append(html.escape(text[cursor:span_start]))
+        parts.append(f"<mark>{html.escape(text[span_start:span_end])}</mark>")
+        cursor = span_end
+    parts.append(html.escape(text[cursor:end]))
+    return " ".join("".join(parts).split())
+
+
+def highlight(text: Optional[str], query: str) -> str:
+    """转义整段文本并高亮查询词（用于标题）"""
+    text = text or ""
+    return _render(text, 0, len(text), _match_spans(text, query))
+
+
+def build_snippet(text: Optional[str], query: str, max_chars: Optional[int] = None) -> str:
+    """截取命中查询词最多的一段文本作为摘要，HTML 转义后用 <mark> 标出命中部分"""
+    text = text or ""
+    max_chars = max_chars or settings.DOCUMENT_SEARCH_SNIPPET_CHARS
+    spans = _match_spans(text, query)
+
+    anchor = 0
+    if spans:
+        # 以每个命中为窗口起点，选覆盖不同查询词最多（其次命中次数最多）的窗口
+        best = (-1, -1)
+        candidates = spans[:MAX_SNIPPET_MATCHES]
+        for i, (span_start, _, _) in enumerate(candidates):
+            terms = set()
+            hits = 0
+            for other_start, other_end, term in candidates[i:]:
+                if other_end > span_start + max_chars:
+                    break
+                terms.add(term)
+                hits += 1
+            if (len(terms), hits) > best:
+                best = (len(terms), hits)
+                anchor = span_start
+
+    # 命中前保留少量上下文
+    start = max(0, anchor - max_chars // 4) if spans else 0
+    end = min(len(text), start + max_chars)
+    start = max(0, end - max_chars)
+
+    snippet = _render(text, start, end, spans)
+    if start > 0:
+        snippet = f"…{snippet}"
+    if end < len(text):
+        snippet = f"{snippet}…"
+    return snippet
+
+
+class DocumentSearchService:
+    """文档全文搜索服务（每个 worker 各自维护索引，缺失的文档在查询时补充）"""
+
+    def __init__(self):
+        self._content_index = BM25Index(tokenizer=tokenize_cjk, query_tokenizer=tokenize_cjk_query)
+        self._title_index = BM25Index(tokenizer=tokenize_cjk, query_tokenizer=tokenize_cjk_query)
+        # 已索引的内容和标题，用于生成摘要和发现标题变化
+        self._contents: Dict[int, str] = {}
+        self._titles: Dict[int, str] = {}
+        # 待索引的内容 {document_id: (content, 最近一次更新时间)}，同一文档的连续更新只索引最后一次
+        self._pending: Dict[int, Tuple[str, float]] = {}
+        self._index_task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "updates": 0,
+            "updates_coalesced": 0,
+            "documents_indexed": 0,
+            "documents_loaded": 0,
+            "queries": 0,
+        }
+
+    def start(self):
+        """启动防抖索引任务（应用启动时调用）"""
+        if self._index_task is None or self._index_task.done():
+            self._index_task = asyncio.create_task(self._index_worker())
+
+    async def stop(self):
+        if self._index_task and not self._index_task.done():
+            self._index_task.cancel()
+            try:
+                await self._index_task
+            except asyncio.CancelledError:
+                pass
+        self._index_task = None
+
+    async def _index_worker(self):
+        interval = max(0.1, settings.DOCUMENT_SEARCH_DEBOUNCE / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._flush_pending()
+            except Exception as e:
+                logger.error(f"Document search index worker error: {e}")
+
+    # ---- 索引更新 ----
+
+    def index_document(self, document_id: int, content: Optional[str], title: Optional[str] = None):
+        """登记文档的新内容，停止修改超过防抖时间后（或下一次查询前）写入索引"""
+        document_id = int(document_id)
+        if document_id in self._pending:
+            self.metrics["updates_coalesced"] += 1
+        self._pending[document_id] = (content or "", time.monotonic())
+        self.metrics["updates"] += 1
+        if title is not None:
+            self._set_title(document_id, title)
+
+    def remove_document(self, document_id: int):
+        """从索引中移除文档"""
+        document_id = int(document_id)
+        self._pending.pop(document_id, None)
+        self._contents.pop(document_id, None)
+        self._titles.pop(document_id, None)
+        self._content_index.remove(document_id)
+        self._title_index.remove(document_id)
+
+    def _set_title(self, document_id: int, title: str):
+        if self._titles.get(document_id) != title:
+            self._titles[document_id] = title
+            self._title_index.add(document_id, title)
+
+    def _flush_pending(self, force: bool = False):
+        """把到期（force 时为全部）的待索引内容写入倒排索引"""
+        if not self._pending:
+            return
+        now = time.monotonic()
+        due = [
+            document_id for document_id, (_, updated) in self._pending.items()
+            if force or now - updated >= settings.DOCUMENT_SEARCH_DEBOUNCE
+        ]
+        for document_id in due:
+            content, _ = self._pending.pop(document_id)
+            self._content_index.add(document_id, content)
+            self._contents[document_id] = content
+        self.metrics["documents_indexed"] += len(due)
+
+    async def _load_missing(self, db: AsyncSession, document_ids: List[int]):
+        """补充尚未索引的文档：优先读取 ShareDB，ShareDB 中没有的文档使用数据库中的内容"""
+        missing = [
+            document_id for document_id in document_ids
+            if document_id not in self._contents and document_id not in self._pending
+        ][:settings.DOCUMENT_SEARCH_MAX_LOADS]
+        if not missing:
+            return
+
+        from app.services.sharedb_service import get_sharedb_service
+
+        try:
+            contents = await get_sharedb_service().get_contents([str(i) for i in missing])
+        except Exception as e:
+            logger.warning(f"Failed to load documents from ShareDB for search: {e}")
+            contents = {}
+
+        absent = [document_id for document_id in missing if str(document_id) not in contents]
+        if absent:
+            rows = await db.execute(
+                select(Document.id, Document.content).where(Document.id.in_(absent))
+            )
+            for row in rows:
+                contents[str(row.id)] = row.content or ""
+
+        for doc_id, content in contents.items():
+            self._content_index.add(int(doc_id), content)
+            self._contents[int(doc_id)] = content
+        self.metrics["documents_loaded"] += len(contents)
+
+    # ---- 查询 ----
+
+    async def rank(
+        self, db: AsyncSession, query: str, candidates: Dict[int, str]
+    ) -> List[Tuple[int, float]]:
+        """在候选文档 {document_id: title} 中按相关度排序，只返回命中的文档"""
+        if not candidates:
+            return []
+        for document_id, title in candidates.items():
+            self._set_title(document_id, title or "")
+        await self._load_missing(db, list(candidates))
+        self._flush_pending(force=True)
+
+        scores: Dict[int, float] = {}
+        in_candidates = candidates.__contains__
+        for document_id, score in self._content_index.search(query, len(candidates), in_candidates):
+            scores[document_id] = score
+        weight = settings.DOCUMENT_SEARCH_TITLE_WEIGHT
+        for document_id, score in self._title_index.search(query, len(candidates), in_candidates):
+            scores[document_id] = scores.get(document_id, 0.0) + weight * score
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query: str,
+        conditions: List[Any],
+        skip: int = 0,
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """在满足 conditions（调用方的权限、分类等过滤条件）的文档中全文搜索
+
+        Returns:
+            Dict: {"documents": 按相关度排序的当前页文档, "total": 命中总数,
+                   "snippets": {document_id: 高亮摘要}}
+        """
+        self.metrics["queries"] += 1
+        rows = await db.execute(
+            select(Document.id, Document.title)
+            .where(*conditions)
+            .order_by(desc(Document.updated_at))
+        )
+        candidates = {row.id: row.title or "" for row in rows}
+
+        ranked_ids = [document_id for document_id, _ in await self.rank(db, query, candidates)]
+        # 索引按整词匹配，标题中的部分词（如英文前缀）仍按子串补充在后面
+        matched = set(ranked_ids)
+        lowered = query.strip().lower()
+        ranked_ids.extend(
+            document_id for document_id, title in candidates.items()
+            if document_id not in matched and lowered and lowered in title.lower()
+        )
+
+        page_ids = ranked_ids[skip:skip + limit]
+        documents: List[Document] = []
+        if page_ids:
+            result = await db.execute(select(Document).where(Document.id.in_(page_ids)))
+            by_id = {document.id: document for document in result.scalars().all()}
+            documents = [by_id[document_id] for document_id in page_ids if document_id in by_id]
+
+        snippets = {
+            document_id: build_snippet(self._contents.get(document_id), query)
+            for document_id in page_ids
+        }
+        return {"documents": documents, "total": len(ranked_ids), "snippets": snippets}
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            **self.metrics,
+            "indexed": len(self._contents),
+            "pending": len(self._pending),
+        }
+
+
+# 全局实例
+document_search_service = DocumentSearchService()
@@ -1,9 +1,10 @@
 from typing import Dict, Optional, List, Any
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func, select, and_, or_, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload, selectinload
 from fastapi import HTTPException, status
 from datetime import datetime, timedelta
+import asyncio
 import hashlib
 import logging
 
@@ -15,6 +16,13 @@ from app.models.database import (
     DocumentStatus,
     User
 )
+from app.core.pagination import Paginator, encode_cursor
+from app.services.auth_cache import auth_cache
+from app.services.count_cache import count_cache
+from app.services.document_cache import document_cache
+from app.services.document_search_service import document_search_service
+from app.services.permission_service import PermissionService
+from app.services.version_store import version_store
 
 logger = logging.getLogger(__name__)
 
@@ -66,72 +74,114 @@ class DocumentService:
     async def get_document(
         self, db: AsyncSession, document_id: int, user_id: int, sharedb_service=None
     ) -> Dict[str, Any]:
-        """获取文档详情（元数据来自PostgreSQL，内容来自ShareDB）"""
+        """获取文档详情（元数据来自PostgreSQL，内容来自ShareDB）
 
-        stmt = (
-            select(Document)
-            .options(
-                selectinload(Document.owner),
-                selectinload(Document.collaborators).selectinload(
-                    DocumentCollaborator.user
-                ),
-            )
-            .where(Document.id == document_id)
-        )
-
-        result = await db.execute(stmt)
-        document = result.scalar_one_or_none()
+        元数据（含权限检查）和 ShareDB 内容并发读取，两者都先查文档快照缓存。
+        """
+        generation = document_cache.generation
+        metadata = document_cache.get_metadata(document_id)
+        snapshot, stamp = document_cache.lookup_content(document_id)
 
-        if not document:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="文档不存在"
+        async def load_metadata():
+            level = await PermissionService.get_document_permission_level(
+                db, user_id, document_id
             )
+            if level <= 0:
+                # 权限级别可能来自缓存，拒绝前确认文档存在：不存在的文档返回 404
+                if metadata is None and (
+                    await db.execute(select(Document.id).where(Document.id == document_id))
+                ).first() is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND, detail="文档不存在"
+                    )
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN, detail="无权限访问此文档"
+                )
+            if metadata is not None:
+                return metadata
 
-        # 检查权限
-        if not await self._check_read_permission(db, document_id, user_id):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN, detail="无权限访问此文档"
+            stmt = (
+                select(Document)
+                .options(joinedload(Document.owner))
+                .where(Document.id == document_id)
             )
+            document = (await db.execute(stmt)).scalar_one_or_none()
+            if not document:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="文档不存在"
+                )
+            data = document_cache.build_metadata(document)
+            document_cache.set_metadata(document_id, data, generation)
+            return data
+
+        async def load_content():
+            # 不创建文档：权限检查通过前不能为不存在的 id 写入 ShareDB
+            if not sharedb_service or snapshot is not None:
+                return None
+            try:
+                return await sharedb_service.get_document(str(document_id), create=False)
+            except Exception as e:
+                logger.warning(f"Failed to get content from ShareDB: {e}")
+                return e
+
+        results = await asyncio.gather(load_metadata(), load_content(), return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        metadata, sharedb_doc = results
 
-        # 从 ShareDB 获取最新内容
         content = ""
         version = 0
-        if sharedb_service:
+        if snapshot is not None:
+            content, version = snapshot
+        elif sharedb_service:
             try:
-                sharedb_doc = await sharedb_service.get_document(str(document_id))
-                content = sharedb_doc.get("content", "")
-                version = sharedb_doc.get("version", 0)
-                
-                # 如果 ShareDB 中的内容为空且 PostgreSQL 中有内容，则同步
-                if not content and document.content:
-                    logger.info(f"ShareDB content is empty, syncing from PostgreSQL for document {document_id}")
-                    await sharedb_service.sync_document(
-                        doc_id=str(document_id),
-                        version=document.version,
-                        content=document.content,
-                        user_id=user_id,
-                        create_version=False
-                    )
-                    content = document.content
-                    version = document.version
-                    
+                if isinstance(sharedb_doc, Exception):
+                    raise sharedb_doc
+                content = sharedb_doc.get("content", "") if sharedb_doc else ""
+                version = sharedb_doc.get("version", 0) if sharedb_doc else 0
+
+                if not content:
+                    stmt = select(Document.content, Document.version).where(Document.id == document_id)
+                    pg_content, pg_version = (await db.execute(stmt)).one()
+                    # 如果 ShareDB 中的内容为空且 PostgreSQL 中有内容，则同步
+                    if pg_content:
+                        logger.info(f"ShareDB content is empty, syncing from PostgreSQL for document {document_id}")
+                        result = await sharedb_service.sync_document(
+                            doc_id=str(document_id),
+                            version=pg_version,
+                            content=pg_content,
+                            user_id=user_id,
+                            create_version=False
+                        )
+                        if not result.get("success"):
+                            raise RuntimeError(result.get("error"))
+                        content = pg_content
+                        version = result["version"]
+                    elif sharedb_doc is None:
+                        sharedb_doc = await sharedb_service.get_document(str(document_id))
+                        version = sharedb_doc.get("version", 0)
+
+                document_cache.set_content(document_id, content, version, stamp)
+
             except Exception as e:
                 logger.warning(f"Failed to get content from ShareDB: {e}")
                 # 降级到 PostgreSQL 内容（如果有）
-                content = document.content
-                version = document.version
+                stmt = select(Document.content, Document.version).where(Document.id == document_id)
+                content, version = (await db.execute(stmt)).one()
 
         return {
-            "id": document.id,
-            "title": document.title,
+            "id": metadata["id"],
+            "title": metadata["title"],
             "content": content,  # 来自 ShareDB
             "version": version,  # 来自 ShareDB
-            "category": document.category,
-            "tags": document.tags,
-            "owner": document.owner,
-            "created_at": document.created_at,
-            "updated_at": document.updated_at,
-            "status": document.status,
+            "category": metadata["category"],
+            "tags": metadata["tags"],
+            "owner": document_cache.build_owner(metadata),
+            "owner_id": metadata["owner_id"],
+            "organization_id": metadata["organization_id"],
+            "created_at": metadata["created_at"],
+            "updated_at": metadata["updated_at"],
+            "status": metadata["status"],
         }
 
     async def update_document(
@@ -178,6 +228,7 @@ class DocumentService:
 
         await db.commit()
         await db.refresh(document)
+        await document_cache.invalidate_metadata(document_id)
 
         return document
 
@@ -203,6 +254,12 @@ class DocumentService:
         # 软删除
         document.status = DocumentStatus.DELETED
         await db.commit()
+        await auth_cache.invalidate_document(document_id)
+        await document_cache.invalidate_metadata(document_id)
+
+        from app.services.retrieval_service import retrieval_service
+        retrieval_service.remove_document(document_id)
+        document_search_service.remove_document(document_id)
 
     async def list_documents(
         self,
@@ -318,9 +375,15 @@ class DocumentService:
                 status_code=status.HTTP_404_NOT_FOUND, detail="文档不存在"
             )
 
+        target_content = await version_store.get_content(db, target_version)
+        if target_content is None:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="版本内容无法还原"
+            )
+
         # 回滚内容
         document.title = target_version.title
-        document.content = target_version.content
+        document.content = target_content
         document.last_editor_id = user_id
         document.version += 1
 
@@ -336,9 +399,10 @@ class DocumentService:
             change_description=f"回滚到版本 {version_number}",
         )
 
-        db.add(new_version)
+        await version_store.add(db, new_version)
         await db.commit()
         await db.refresh(document)
+        await document_cache.invalidate_metadata(document_id)
 
         return document
 
@@ -408,8 +472,12 @@ class DocumentService:
         search: Optional[str] = None,
         category: Optional[str] = None,
         organization_id: Optional[int] = None,
+        cursor: Optional[str] = None,
     ) -> Dict:
-        """获取用户的文档列表，带分页信息"""
+        """获取用户的文档列表，带分页信息
+
+        按 (updated_at, id) 键集分页，总数取自计数缓存；搜索结果按相关度排序，使用偏移游标
+        """
         # 基础查询条件
         base_condition = or_(
             Document.owner_id == user_id,
@@ -440,30 +508,36 @@ class DocumentService:
             else:
                 # 如果没有组织权限，只返回用户自己的文档
                 base_condition = Document.owner_id == user_id
-        query = select(Document).where(base_condition)
-        count_query = select(func.count()).select_from(Document).where(base_condition)
-
-        # 搜索
-        if search:
-            query = query.where(Document.title.ilike(f"%{search}%"))
-            count_query = count_query.where(Document.title.ilike(f"%{search}%"))
+        conditions = [base_condition]
         # 分类
         if category:
-            query = query.where(Document.category == category)
-            count_query = count_query.where(Document.category == category)
+            conditions.append(Document.category == category)
 
-        # 排序、分页
-        query = query.order_by(Document.updated_at.desc()).offset(skip).limit(limit)
+        # 搜索：在有权限的文档中按标题和 ShareDB 正文全文检索，按相关度排序
+        if search and search.strip():
+            paginator = Paginator([], cursor, limit, skip, keyset=False)
+            result = await document_search_service.search(db, search, conditions, paginator.offset, limit)
+            next_cursor = None
+            if paginator.offset + limit < result["total"]:
+                next_cursor = encode_cursor({"o": paginator.offset + limit})
+            return {**result, "skip": paginator.offset, "limit": limit, "next_cursor": next_cursor}
 
-        # 查询总数
-        total_result = await db.execute(count_query)
-        total = total_result.scalar() or 0
+        # 排序、分页
+        paginator = Paginator([(Document.updated_at, True), (Document.id, True)], cursor, limit, skip)
+        result = await db.execute(paginator.apply(select(Document).where(*conditions)))
+        documents, next_cursor = paginator.page(result.scalars().all())
 
-        # 查询文档
-        result = await db.execute(query)
-        documents = result.scalars().all()
+        # 总数（近似，缓存后在后台刷新）
+        count_query = select(func.count()).select_from(Document).where(*conditions)
+        total = await count_cache.count(db, count_query)
 
-        return {"documents": documents, "total": total, "skip": skip, "limit": limit}
+        return {
+            "documents": documents,
+            "total": total,
+            "skip": paginator.offset,
+            "limit": limit,
+            "next_cursor": next_cursor,
+        }
 
     def should_create_version(self, document_id: int, new_content: str, user_id: int) -> bool:
         """判断是否应该创建新版本"""
@@ -5,12 +5,16 @@
 
 import asyncio
 import hashlib
+import time
+from collections import deque
 from typing import Optional, Dict, List
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, desc
-from datetime import datetime
+from sqlalchemy import select, func, desc, insert
+from datetime import datetime, timezone
 
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.pagination import Paginator
 from app.models.database import (
     Document, 
     DocumentVersion, 
@@ -18,15 +22,63 @@ from app.models.database import (
     OperationType,
     DocumentStatus
 )
+from app.services import ot
+from app.services.collaboration_bus import collaboration_bus
+from app.services.count_cache import count_cache
+from app.services.document_cache import document_cache
+from app.services.retrieval_service import retrieval_service
+from app.services.document_search_service import document_search_service
+from app.services.version_store import version_store
+
+
+class _PendingSave:
+    """某个文档在当前防抖窗口内待写入的内容和操作记录"""
+
+    __slots__ = ("user_id", "content", "operations", "content_only", "first_queued", "last_queued", "attempts")
+
+    def __init__(self, now: float):
+        self.user_id: Optional[int] = None
+        self.content: Optional[str] = None
+        self.operations: List[tuple] = []
+        # 是否包含没有操作记录的整文档更新（变更量需在写入时计算）
+        self.content_only = False
+        self.first_queued = now
+        self.last_queued = now
+        # 已失败的写入次数
+        self.attempts = 0
 
 
 class DocumentStorageService:
-    """文档存储服务"""
+    """文档存储服务
+
+    保存采用写后合并：同一文档在防抖窗口内的多次保存只写入最后一次内容，
+    操作记录批量插入；版本快照按时间或累计变更量创建，而不是每次保存都创建。
+    """
     
     def __init__(self):
-        self.save_queue = asyncio.Queue()
+        # 待写入的文档 {document_id: _PendingSave}
+        self.pending: Dict[int, _PendingSave] = {}
+        self.pending_operations = 0
+        # 已预留但尚未加入缓冲的操作记录数
+        self.reserved_operations = 0
         self.save_task = None
         self._initialized = False
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Condition()
+        # 多次写入失败后放弃的保存（保留最近的若干条供排查）
+        self.dead_letters: deque = deque(maxlen=100)
+        # 自动版本快照状态 {document_id: (上次快照时间, 之后累计变更字符数)}
+        self._version_state: Dict[int, tuple] = {}
+        self.metrics = {
+            "saves_requested": 0,
+            "documents_written": 0,
+            "operations_written": 0,
+            "operations_rejected": 0,
+            "dead_lettered": 0,
+            "versions_created": 0,
+            "write_failures": 0,
+        }
     
     def _ensure_initialized(self):
         """确保服务已初始化"""
@@ -42,128 +94,334 @@ class DocumentStorageService:
         """启动后台保存任务"""
         if self.save_task is None or self.save_task.done():
             self.save_task = asyncio.create_task(self._background_save_worker())
+
+    def start(self):
+        """启动后台保存任务（应用启动时调用）"""
+        self._stopping = False
+        self._ensure_initialized()
+
+    async def stop(self):
+        """停止接收延迟保存，立即写入所有待保存内容后退出"""
+        self._stopping = True
+        self._wakeup.set()
+        if self.save_task is None or self.save_task.done():
+            # 后台任务未运行时直接写入
+            await self._flush_due(force=True)
+            return
+        try:
+            await asyncio.wait_for(self.save_task, timeout=settings.DOCUMENT_SAVE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ 文档保存队列未能在 {settings.DOCUMENT_SAVE_DRAIN_TIMEOUT}s 内写完，剩余 {len(self.pending)} 个文档")
+            self.save_task.cancel()
+        self._initialized = False
     
     async def _background_save_worker(self):
-        """后台保存工作器"""
+        """后台保存工作器：按防抖窗口合并写入"""
         while True:
             try:
-                # 等待保存请求
-                save_request = await self.save_queue.get()
-                
-                if save_request is None:  # 停止信号
+                timeout = self._next_due_in()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+                # 缓冲已满时不等防抖窗口，立即写入以释放等待中的保存方
+                full = not self._has_capacity()
+                await self._flush_due(force=self._stopping or full)
+
+                if self._stopping and not self.pending:
                     break
-                
-                document_id, user_id, content, operation = save_request
-                
-                # 执行保存
-                await self._save_document_content(document_id, user_id, content)
-                
-                # 如果有操作记录，也保存
-                if operation:
-                    await self._save_operation(document_id, user_id, operation)
-                
-                # 标记任务完成
-                self.save_queue.task_done()
-                
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 print(f"❌ 后台保存失败: {e}")
                 import traceback
                 traceback.print_exc()
+                await asyncio.sleep(settings.DOCUMENT_SAVE_DEBOUNCE)
+
+    def _next_due_in(self) -> Optional[float]:
+        """距最近一个文档到期写入的秒数，没有待写入文档时返回 None"""
+        if not self.pending:
+            return None
+        now = time.monotonic()
+        due = min(
+            min(p.last_queued + settings.DOCUMENT_SAVE_DEBOUNCE, p.first_queued + settings.DOCUMENT_SAVE_MAX_DELAY)
+            for p in self.pending.values()
+        )
+        return max(due - now, 0)
+
+    async def _flush_due(self, force: bool = False):
+        """写入已到期的文档：空闲超过防抖窗口，或持续编辑超过最长延迟"""
+        now = time.monotonic()
+        due = [
+            document_id for document_id, p in self.pending.items()
+            if force
+            or now - p.last_queued >= settings.DOCUMENT_SAVE_DEBOUNCE
+            or now - p.first_queued >= settings.DOCUMENT_SAVE_MAX_DELAY
+        ]
+        for document_id in due:
+            pending = self.pending.pop(document_id)
+            try:
+                await self._write_pending(document_id, pending)
+            except Exception as e:
+                self.metrics["write_failures"] += 1
+                pending.attempts += 1
+                print(f"❌ 保存文档 {document_id} 失败（第 {pending.attempts} 次）: {e}")
+                if not self._stopping and pending.attempts < settings.DOCUMENT_SAVE_MAX_ATTEMPTS:
+                    # 放回队列稍后重试，期间的新保存合并在其后
+                    self._requeue(document_id, pending)
+                    continue
+                self._dead_letter(document_id, pending, e)
+            self.pending_operations -= len(pending.operations)
+            async with self._drained:
+                self._drained.notify_all()
     
+    def _dead_letter(self, document_id: int, pending: _PendingSave, error: Exception):
+        """放弃多次写入失败的保存，记录完整内容以便人工恢复"""
+        self.metrics["dead_lettered"] += 1
+        self.dead_letters.append({
+            "document_id": document_id,
+            "user_id": pending.user_id,
+            "content": pending.content,
+            "operations": [
+                {"user_id": user_id, "operation": operation, "created_at": created_at.isoformat()}
+                for user_id, operation, created_at in pending.operations
+            ],
+            "error": str(error),
+            "failed_at": datetime.utcnow().isoformat(),
+        })
+        print(
+            f"❌ 文档 {document_id} 的保存失败 {pending.attempts} 次，已转入死信: "
+            f"content_length={len(pending.content or '')}, operations={len(pending.operations)}"
+        )
+
+    def _requeue(self, document_id: int, pending: _PendingSave):
+        newer = self.pending.get(document_id)
+        if newer is not None:
+            pending.operations.extend(newer.operations)
+            pending.content_only = pending.content_only or newer.content_only
+            if newer.content is not None:
+                pending.content = newer.content
+                pending.user_id = newer.user_id
+        pending.first_queued = pending.last_queued = time.monotonic()
+        self.pending[document_id] = pending
+
     async def save_content(self, document_id: int, user_id: int, content: str, operation: Optional[Dict] = None):
-        """保存文档内容（异步）"""
+        """保存文档内容（异步合并写入，不等待）
+
+        操作记录不会被丢弃；缓冲的上限由调用方在提交操作前通过 reserve_operation() 保证。
+        """
         self._ensure_initialized()
-        await self.save_queue.put((document_id, user_id, content, operation))
-    
-    async def _save_document_content(self, document_id: int, user_id: int, content: str):
-        """保存文档内容到数据库"""
+        self.metrics["saves_requested"] += 1
+
+        now = time.monotonic()
+        pending = self.pending.get(document_id)
+        if pending is None:
+            pending = self.pending[document_id] = _PendingSave(now)
+            self._wakeup.set()
+        pending.user_id = user_id
+        pending.content = content
+        pending.last_queued = now
+        if operation:
+            pending.operations.append((user_id, operation, datetime.utcnow()))
+            self.pending_operations += 1
+        else:
+            pending.content_only = True
+
+    def discard_pending_content(self, document_id: int):
+        """文档内容被其他途径替换时，丢弃尚未写入的内容（操作记录照常写入）"""
+        pending = self.pending.get(document_id)
+        if pending is not None:
+            pending.content = None
+            pending.content_only = False
+
+    def _has_capacity(self) -> bool:
+        return self.pending_operations + self.reserved_operations < settings.DOCUMENT_SAVE_MAX_PENDING_OPS
+
+    async def wait_for_capacity(self) -> bool:
+        """缓冲的操作记录达到上限时等待后台写入，最多 DOCUMENT_SAVE_BACKPRESSURE_TIMEOUT 秒；
+        超时返回 False，调用方应拒绝本次修改（不要在持有文档锁时调用）"""
+        self._ensure_initialized()
+        if self._has_capacity():
+            return True
+        self._wakeup.set()
         try:
-            async for db in get_db():
-                # 获取当前文档
-                stmt = select(Document).where(Document.id == document_id)
-                result = await db.execute(stmt)
-                document = result.scalar_one_or_none()
-                
-                if not document:
-                    print(f"❌ 文档 {document_id} 不存在")
-                    return
-                
-                # 检查内容是否有变化
-                if document.content == content:
-                    print(f"📝 文档 {document_id} 内容无变化，跳过保存")
-                    return
-                
-                # 保存旧版本
-                content_hash = hashlib.md5(document.content.encode()).hexdigest()
-                old_version = DocumentVersion(
-                    document_id=document_id,
-                    version_number=document.version,
-                    title=document.title,
-                    content=document.content,
-                    content_hash=content_hash,  # 添加内容哈希
-                    changed_by=document.last_editor_id or document.owner_id,
-                    change_description=f"自动保存 - 版本 {document.version}"
+            async with self._drained:
+                await asyncio.wait_for(
+                    self._drained.wait_for(self._has_capacity),
+                    timeout=settings.DOCUMENT_SAVE_BACKPRESSURE_TIMEOUT,
                 )
-                db.add(old_version)
-                
-                # 更新文档内容
+            return True
+        except asyncio.TimeoutError:
+            self.metrics["operations_rejected"] += 1
+            print(f"⚠️ 文档保存缓冲已满（{self.pending_operations} 条操作），拒绝修改")
+            return False
+
+    async def reserve_operation(self) -> bool:
+        """为一条操作记录预留缓冲位置（必要时等待），成功后必须调用 release_operation()"""
+        if not await self.wait_for_capacity():
+            return False
+        # 检查和预留之间没有挂起点，并发的预留不会超过上限
+        if not self._has_capacity():
+            self.metrics["operations_rejected"] += 1
+            return False
+        self.reserved_operations += 1
+        return True
+
+    async def release_operation(self):
+        """释放预留位置（操作记录已加入缓冲或操作被放弃）"""
+        self.reserved_operations -= 1
+        async with self._drained:
+            self._drained.notify_all()
+
+    async def _write_pending(self, document_id: int, pending: _PendingSave):
+        """在一个事务中写入文档最新内容、批量插入操作记录，并按策略创建版本快照"""
+        async for db in get_db():
+            stmt = select(Document).where(Document.id == document_id)
+            result = await db.execute(stmt)
+            document = result.scalar_one_or_none()
+
+            if not document:
+                print(f"❌ 文档 {document_id} 不存在")
+                return
+
+            if pending.operations:
+                await db.execute(insert(DocumentOperation), [
+                    self._operation_row(document_id, user_id, operation, created_at)
+                    for user_id, operation, created_at in pending.operations
+                ])
+
+            content = pending.content
+            changed = content is not None and document.content != content
+            version_created = False
+            if changed:
+                old_content = document.content or ""
+                delta = sum(
+                    len(operation.get("content", "")) + operation.get("length", 0)
+                    for _, operation, _ in pending.operations
+                )
+                if pending.content_only:
+                    summary = ot.summarize(ot.diff(old_content, content))
+                    delta += len(summary["content"]) + summary["length"]
+
+                if await self._should_snapshot(db, document_id, delta):
+                    # 保存被覆盖前的内容作为一个版本
+                    await version_store.add(db, DocumentVersion(
+                        document_id=document_id,
+                        version_number=document.version,
+                        title=document.title,
+                        content=old_content,
+                        content_hash=hashlib.md5(old_content.encode()).hexdigest(),
+                        changed_by=document.last_editor_id or document.owner_id,
+                        change_description=f"自动保存 - 版本 {document.version}"
+                    ))
+                    document.version += 1
+                    version_created = True
+
                 document.content = content
-                document.version += 1
-                document.last_editor_id = user_id
+                document.last_editor_id = pending.user_id
                 document.updated_at = datetime.utcnow()
-                
-                await db.commit()
-                await db.refresh(document)  # 刷新对象以获取最新数据
-                print(f"✅ 文档内容已保存: document_id={document_id}, version={document.version}, content_length={len(content)}")
-                break
-                
-        except Exception as e:
-            print(f"❌ 保存文档内容失败: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    async def _save_operation(self, document_id: int, user_id: int, operation: Dict):
-        """保存操作记录到数据库"""
-        try:
-            async for db in get_db():
-                # 创建操作记录
-                operation_record = DocumentOperation(
-                    document_id=document_id,
-                    user_id=user_id,
-                    operation_id=operation.get("id", f"op_{document_id}_{user_id}_{asyncio.get_event_loop().time()}"),
-                    sequence_number=operation.get("sequence", 0),
-                    operation_type=OperationType.INSERT if operation.get("type") == "insert" else OperationType.DELETE,
-                    start_position=operation.get("position", 0),
-                    end_position=operation.get("position", 0) + len(operation.get("content", "")),
-                    content=operation.get("content", "")
+
+            await db.commit()
+
+            self.metrics["operations_written"] += len(pending.operations)
+            if version_created:
+                self.metrics["versions_created"] += 1
+                self._version_state[document_id] = (time.monotonic(), 0)
+            if changed:
+                self.metrics["documents_written"] += 1
+                await document_cache.invalidate_metadata(document_id)
+                if content:
+                    retrieval_service.index_document(document_id, content, document.title)
+                    document_search_service.index_document(document_id, content, document.title)
+                print(
+                    f"✅ 文档内容已保存: document_id={document_id}, version={document.version}, "
+                    f"content_length={len(content)}, operations={len(pending.operations)}"
                 )
-                
-                db.add(operation_record)
-                await db.commit()
-                print(f"✅ 操作已保存: document_id={document_id}, user_id={user_id}, operation_id={operation_record.operation_id}")
-                break
-                
-        except Exception as e:
-            print(f"❌ 保存操作记录失败: {e}")
-            import traceback
-            traceback.print_exc()
+            break
+
+    async def _should_snapshot(self, db: AsyncSession, document_id: int, delta: int) -> bool:
+        """累计变更达到阈值，或距上次快照超过时间间隔时创建版本快照"""
+        state = self._version_state.get(document_id)
+        if state is None:
+            # 本进程首次写入该文档，以数据库中最新版本的时间为准
+            latest_stmt = select(func.max(DocumentVersion.created_at)).where(
+                DocumentVersion.document_id == document_id
+            )
+            latest = (await db.execute(latest_stmt)).scalar()
+            age = (
+                datetime.now(timezone.utc) - (latest if latest.tzinfo else latest.replace(tzinfo=timezone.utc))
+            ).total_seconds() if latest else float("inf")
+            state = (time.monotonic() - age, 0)
 
-    async def get_document_versions(self, document_id: int, limit: int = 10) -> List[DocumentVersion]:
-        """获取文档版本历史"""
+        last_snapshot, accumulated = state
+        accumulated += delta
+        self._version_state[document_id] = (last_snapshot, accumulated)
+        return (
+            accumulated >= settings.DOCUMENT_VERSION_CHANGE_THRESHOLD
+            or time.monotonic() - last_snapshot >= settings.DOCUMENT_VERSION_INTERVAL
+        )
+
+    @staticmethod
+    def _operation_row(document_id: int, user_id: int, operation: Dict, created_at: datetime) -> Dict:
+        """操作记录转换为 document_operations 行"""
+        position = operation.get("position", 0)
+        return {
+            "document_id": document_id,
+            "user_id": user_id,
+            "operation_id": operation.get("id", f"op_{document_id}_{user_id}_{created_at.timestamp()}"),
+            "sequence_number": operation.get("sequence", 0),
+            "operation_type": OperationType.INSERT if operation.get("type") == "insert" else OperationType.DELETE,
+            "start_position": position,
+            "end_position": position + (len(operation.get("content", "")) or operation.get("length", 0)),
+            "content": operation.get("content", ""),
+            "created_at": created_at,
+        }
+
+    def get_metrics(self) -> Dict:
+        """写后合并队列指标"""
+        return {
+            **self.metrics,
+            "pending_documents": len(self.pending),
+            "pending_operations": self.pending_operations,
+            "reserved_operations": self.reserved_operations,
+            "pending_operations_limit": settings.DOCUMENT_SAVE_MAX_PENDING_OPS,
+        }
+
+    async def get_document_versions(
+        self, document_id: int, limit: int = 10, cursor: Optional[str] = None
+    ) -> Dict:
+        """获取文档版本历史，按 (version_number, id) 键集分页
+
+        Returns:
+            Dict: {"versions": 版本列表, "total": 版本总数（近似）, "next_cursor": 下一页游标}
+        """
+        paginator = Paginator(
+            [(DocumentVersion.version_number, True), (DocumentVersion.id, True)], cursor, limit
+        )
         try:
             async for db in get_db():
-                stmt = (
-                    select(DocumentVersion)
-                    .where(DocumentVersion.document_id == document_id)
-                    .order_by(desc(DocumentVersion.version_number))
-                    .limit(limit)
+                stmt = paginator.apply(
+                    select(DocumentVersion).where(DocumentVersion.document_id == document_id)
                 )
                 result = await db.execute(stmt)
-                versions = result.scalars().all()
-                return list(versions)
+                versions, next_cursor = paginator.page(result.scalars().all())
+                # 差异版本只保存了反向差异，返回前还原完整内容（不写回数据库）
+                contents = [await version_store.get_content(db, version) for version in versions]
+                db.expunge_all()
+                for version, content in zip(versions, contents):
+                    version.content = content
+                total = await count_cache.count(
+                    db,
+                    select(func.count()).select_from(DocumentVersion).where(
+                        DocumentVersion.document_id == document_id
+                    ),
+                )
+                return {"versions": versions, "total": total, "next_cursor": next_cursor}
         except Exception as e:
             print(f"❌ 获取版本历史失败: {e}")
-            return []
+            return {"versions": [], "total": 0, "next_cursor": None}
 
     async def create_version_snapshot(self, document_id: int, user_id: int, description: str):
         """创建版本快照 - 只有内容真正变化时才创建"""
@@ -214,7 +472,7 @@ class DocumentStorageService:
                     change_description=description
                 )
                 
-                db.add(new_version)
+                await version_store.add(db, new_version)
                 await db.commit()
                 print(f"✅ 版本快照已创建（内容变化）: document_id={document_id}, version={next_version}")
                 return True
@@ -272,7 +530,7 @@ class DocumentStorageService:
                     change_description=description
                 )
                 
-                db.add(new_version)
+                await version_store.add(db, new_version)
                 await db.commit()
                 print(f"✅ 版本快照已创建（指定内容变化）: document_id={document_id}, version={next_version}")
                 return True
@@ -305,13 +563,18 @@ class DocumentStorageService:
                     return False
                 
                 # 恢复文档内容
-                document.content = target_version.content
+                target_content = await version_store.get_content(db, target_version)
+                if target_content is None:
+                    return False
+                document.content = target_content
                 document.title = target_version.title
                 document.version += 1
                 document.last_editor_id = user_id
                 document.updated_at = datetime.utcnow()
                 
                 await db.commit()
+                await document_cache.invalidate_metadata(document_id)
+                await collaboration_bus.reset_document(document_id, target_content)
                 print(f"✅ 版本已恢复: document_id={document_id}, 恢复到版本={version_number}, 新版本={document.version}")
                 return True
                 
@@ -342,6 +605,10 @@ class DocumentStorageService:
                 if not document:
                     return None
                 
+                target_content = await version_store.get_content(db, target_version)
+                if target_content is None:
+                    return None
+                
                 # 创建当前内容的备份版本
                 backup_content_hash = hashlib.md5(document.content.encode()).hexdigest()
                 backup_version = DocumentVersion(
@@ -353,10 +620,10 @@ class DocumentStorageService:
                     changed_by=document.last_editor_id or document.owner_id,
                     change_description=f"恢复前的备份 - 版本 {document.version}"
                 )
-                db.add(backup_version)
+                await version_store.add(db, backup_version)
                 
                 # 恢复文档内容
-                document.content = target_version.content
+                document.content = target_content
                 document.title = target_version.title
                 document.version += 1
                 document.last_editor_id = user_id
@@ -373,10 +640,12 @@ class DocumentStorageService:
                     changed_by=user_id,
                     change_description=f"恢复到版本 {target_version.version_number}"
                 )
-                db.add(restore_version)
+                await version_store.add(db, restore_version)
                 
                 await db.commit()
                 await db.refresh(document)
+                await document_cache.invalidate_metadata(document_id)
+                await collaboration_bus.reset_document(document_id, target_content)
                 
                 print(f"✅ 版本已恢复（带内容）: document_id={document_id}, 恢复到版本={version_number}, 新版本={document.version}")
                 
@@ -402,7 +671,7 @@ class DocumentStorageService:
                 version = result.scalar_one_or_none()
                 
                 if version:
-                    return version.content
+                    return await version_store.get_content(db, version)
                 return None
                 
         except Exception as e:
@@ -0,0 +1,159 @@
+"""
+ShareDB 热文档缓冲
+正在编辑的文档以 Rope 形式常驻内存，操作直接作用于 Rope；
+整篇内容按防抖策略异步写回 MongoDB，空闲文档的缓冲会被回收。
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.rope import Rope
+
+
+class HotDocument:
+    """内存中的文档缓冲"""
+
+    __slots__ = (
+        "doc_id", "rope", "version", "created_at", "last_editor_id",
+        "updated_at", "first_dirty", "last_dirty", "last_access", "lease_token",
+        "content_hashes",
+    )
+
+    def __init__(self, doc: dict):
+        self.doc_id = doc["doc_id"]
+        self.rope = Rope(doc.get("content", ""))
+        self.version = doc.get("version", 0)
+        self.created_at: datetime = doc.get("created_at") or datetime.utcnow()
+        self.updated_at: datetime = doc.get("updated_at") or self.created_at
+        self.last_editor_id = doc.get("last_editor_id")
+        # 未写回的修改：首次和最近一次修改时间（monotonic），None 表示已写回
+        self.first_dirty: Optional[float] = None
+        self.last_dirty: Optional[float] = None
+        self.last_access = time.monotonic()
+        # 取得或最近一次确认缓冲时的租约 fencing token
+        self.lease_token: Optional[int] = None
+        # 最近若干版本的内容哈希（版本号 -> sha256），用于校验增量同步的基准
+        self.content_hashes: "OrderedDict[int, str]" = OrderedDict()
+
+    @property
+    def dirty(self) -> bool:
+        return self.first_dirty is not None
+
+    def mark_dirty(self, user_id: Optional[int]):
+        now = time.monotonic()
+        if self.first_dirty is None:
+            self.first_dirty = now
+        self.last_dirty = now
+        self.last_access = now
+        self.updated_at = datetime.utcnow()
+        if user_id is not None:
+            self.last_editor_id = user_id
+
+    def mark_clean(self):
+        self.first_dirty = None
+        self.last_dirty = None
+
+    def content_hash(self) -> str:
+        """当前内容的 sha256，按版本缓存"""
+        digest = self.content_hashes.get(self.version)
+        if digest is None:
+            hasher = hashlib.sha256()
+            for chunk in self.rope.chunks():
+                hasher.update(chunk.encode())
+            digest = hasher.hexdigest()
+            self.content_hashes[self.version] = digest
+            while len(self.content_hashes) > settings.SHAREDB_DELTA_HASH_HISTORY:
+                self.content_hashes.popitem(last=False)
+        return digest
+
+    def hash_at(self, version: int) -> Optional[str]:
+        """指定版本的内容哈希；当前版本按需计算，更早的版本只有记录过才知道"""
+        if version == self.version:
+            return self.content_hash()
+        return self.content_hashes.get(version)
+
+    def reset(self, content: str, version: int, user_id: Optional[int]):
+        """外部直接写入存储后（同步、恢复版本）以新内容覆盖缓冲"""
+        self.rope.set(content)
+        # 同步可能复用已有的版本号，之前记录的哈希不再可靠
+        self.content_hashes.clear()
+        self.version = version
+        self.updated_at = datetime.utcnow()
+        self.last_editor_id = user_id
+        self.last_access = time.monotonic()
+        self.mark_clean()
+
+    def to_dict(self) -> dict:
+        return {
+            "doc_id": self.doc_id,
+            "content": str(self.rope),
+            "version": self.version,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "last_editor_id": self.last_editor_id,
+            "content_hash": self.content_hash(),
+        }
+
+
+class HotDocumentCache:
+    """热文档缓冲池：决定何时写回、何时回收"""
+
+    def __init__(self):
+        self.documents: "OrderedDict[str, HotDocument]" = OrderedDict()
+        self.metrics = {"loads": 0, "flushes": 0, "flush_failures": 0, "fenced_writes": 0, "evictions": 0}
+
+    def get(self, doc_id: str) -> Optional[HotDocument]:
+        hot = self.documents.get(doc_id)
+        if hot is not None:
+            hot.last_access = time.monotonic()
+            self.documents.move_to_end(doc_id)
+        return hot
+
+    def put(self, hot: HotDocument):
+        self.documents[hot.doc_id] = hot
+        self.documents.move_to_end(hot.doc_id)
+        self.metrics["loads"] += 1
+
+    def discard(self, doc_id: str):
+        self.documents.pop(doc_id, None)
+
+    def due_for_flush(self, force: bool = False) -> List[HotDocument]:
+        """停止修改超过防抖时间、或首次修改后超过最长延迟的脏文档"""
+        now = time.monotonic()
+        return [
+            hot for hot in self.documents.values()
+            if hot.dirty and (
+                force
+                or now - hot.last_dirty >= settings.SHAREDB_HOT_FLUSH_DEBOUNCE
+                or now - hot.first_dirty >= settings.SHAREDB_HOT_FLUSH_MAX_DELAY
+            )
+        ]
+
+    def evict(self, in_use: Callable[[str], bool]) -> int:
+        """回收空闲或超出容量的已写回文档；正在被操作的文档跳过"""
+        now = time.monotonic()
+        overflow = len(self.documents) - settings.SHAREDB_HOT_MAX_DOCUMENTS
+        evicted = []
+        # 按最近访问从旧到新遍历
+        for doc_id, hot in self.documents.items():
+            idle = now - hot.last_access >= settings.SHAREDB_HOT_IDLE_SECONDS
+            if not idle and overflow <= len(evicted):
+                break
+            if hot.dirty or in_use(doc_id):
+                continue
+            evicted.append(doc_id)
+        for doc_id in evicted:
+            del self.documents[doc_id]
+        self.metrics["evictions"] += len(evicted)
+        return len(evicted)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            **self.metrics,
+            "documents": len(self.documents),
+            "dirty": sum(1 for hot in self.documents.values() if hot.dirty),
+        }
@@ -0,0 +1,286 @@
+"""
+分布式文档租约
+每个资源（如 ShareDB 文档）的修改都在租约内进行：
+  - 本 worker 内先取有界的本地锁表中的 asyncio.Lock，排队的协程不会重复访问 Redis
+  - 再通过 Redis SET NX PX 取得跨 worker 的租约，每次新取得租约时递增该资源的
+    fencing token；存储写入携带 token，已失去租约的旧持有者的写入会被拒绝
+  - 持有期间后台续期；释放后短暂保留（LEASE_LINGER）以便连续的修改复用同一租约
+
+Redis 键：
+  lease:{key}        当前持有者（带过期时间）
+  lease:{key}:fence  fencing token 计数器
+Redis 不可用时只使用本地锁（单 worker 模式），token 为 None。
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# KEYS: lease, fence  ARGV: 持有者, 过期毫秒
+_ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return 0
+"""
+
+# KEYS: lease  ARGV: 持有者, 过期毫秒
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lease  ARGV: 持有者
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseTimeout(Exception):
+    """等待租约超时"""
+
+
+class Lease:
+    """一次租约持有"""
+
+    __slots__ = ("key", "owner", "token", "expires_at", "idle_since", "lost")
+
+    def __init__(self, key: str, owner: Optional[str] = None, token: Optional[int] = None):
+        self.key = key
+        self.owner = owner
+        # 每次新取得租约递增；Redis 不可用时为 None
+        self.token = token
+        self.expires_at = time.monotonic() + settings.LEASE_TTL_MS / 1000
+        # 释放后进入保留期的时间，None 表示正在使用
+        self.idle_since: Optional[float] = None
+        self.lost = False
+
+    @property
+    def distributed(self) -> bool:
+        return self.token is not None
+
+
+class _LockEntry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # 正在等待或持有该锁的协程数，为 0 时才能从锁表中移除
+        self.users = 0
+
+
+class LeaseManager:
+    """分布式租约管理器"""
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.enabled = False
+        self.redis = redis_client.redis
+        self._acquire_script = self.redis.register_script(_ACQUIRE_SCRIPT)
+        self._renew_script = self.redis.register_script(_RENEW_SCRIPT)
+        self._release_script = self.redis.register_script(_RELEASE_SCRIPT)
+        # 本地锁表（LRU，有容量上限）
+        self._locks: "OrderedDict[str, _LockEntry]" = OrderedDict()
+        # 本 worker 持有（使用中或保留期内）的 Redis 租约
+        self._leases: Dict[str, Lease] = {}
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "acquired": 0,
+            "reused": 0,
+            "contended": 0,
+            "renewed": 0,
+            "released": 0,
+            "lost": 0,
+            "timeouts": 0,
+        }
+
+    @staticmethod
+    def _lease_key(key: str) -> str:
+        return f"lease:{key}"
+
+    @staticmethod
+    def _fence_key(key: str) -> str:
+        return f"lease:{key}:fence"
+
+    async def start(self):
+        """连接 Redis 并启动续期任务；Redis 不可用时只使用本地锁"""
+        try:
+            await self.redis.ping()
+        except Exception as e:
+            logger.warning(f"Redis unavailable, document leases are local to this worker: {e}")
+            return
+        self.enabled = True
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        """释放持有的所有租约"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        for lease in list(self._leases.values()):
+            await self._release(lease)
+        self.enabled = False
+
+    # ---- 本地锁表 ----
+
+    def _entry(self, key: str) -> _LockEntry:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _LockEntry()
+        self._locks.move_to_end(key)
+        return entry
+
+    def _evict_locks(self):
+        """超出容量时移除最久未用、无人使用且没有保留租约的锁"""
+        overflow = len(self._locks) - settings.LEASE_LOCAL_CACHE_SIZE
+        if overflow <= 0:
+            return
+        for key in [key for key, entry in self._locks.items() if not entry.users and key not in self._leases][:overflow]:
+            del self._locks[key]
+
+    def is_busy(self, key: str) -> bool:
+        """是否有协程正在持有或等待该资源"""
+        entry = self._locks.get(key)
+        return entry is not None and entry.users > 0
+
+    @asynccontextmanager
+    async def lease(self, key: str, distributed: bool = True) -> AsyncIterator[Lease]:
+        """在租约内执行修改；distributed=False 时只取本地锁"""
+        entry = self._entry(key)
+        entry.users += 1
+        try:
+            async with entry.lock:
+                if distributed and self.enabled:
+                    lease = await self._acquire(key)
+                else:
+                    lease = Lease(key)
+                try:
+                    yield lease
+                finally:
+                    if lease.distributed:
+                        await self._release_later(lease)
+        finally:
+            entry.users -= 1
+            self._evict_locks()
+
+    async def current_token(self, key: str) -> Optional[int]:
+        """资源最近一次发放的 fencing token（用于判断本地缓存是否被其他 worker 修改过）"""
+        if not self.enabled:
+            return None
+        value = await self.redis.get(self._fence_key(key))
+        return int(value) if value is not None else 0
+
+    # ---- Redis 租约 ----
+
+    async def _acquire(self, key: str) -> Lease:
+        lease = self._leases.get(key)
+        margin = settings.LEASE_TTL_MS / 1000 / 3
+        if lease is not None and not lease.lost and lease.expires_at - time.monotonic() > margin:
+            # 保留期内的租约直接复用
+            lease.idle_since = None
+            self.metrics["reused"] += 1
+            return lease
+
+        owner = f"{self.worker_id}:{uuid.uuid4().hex[:12]}"
+        deadline = time.monotonic() + settings.LEASE_ACQUIRE_TIMEOUT
+        delay = 0.005
+        waited = False
+        while True:
+            token = await self._acquire_script(
+                keys=[self._lease_key(key), self._fence_key(key)],
+                args=[owner, settings.LEASE_TTL_MS]
+            )
+            if token:
+                lease = Lease(key, owner, int(token))
+                self._leases[key] = lease
+                self.metrics["acquired"] += 1
+                if waited:
+                    self.metrics["contended"] += 1
+                return lease
+            if time.monotonic() + delay > deadline:
+                self.metrics["timeouts"] += 1
+                raise LeaseTimeout(f"Timed out waiting for lease {key}")
+            waited = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    async def _release_later(self, lease: Lease):
+        if lease.lost or settings.LEASE_LINGER <= 0:
+            await self._release(lease)
+        else:
+            lease.idle_since = time.monotonic()
+
+    async def _release(self, lease: Lease):
+        if self._leases.get(lease.key) is lease:
+            del self._leases[lease.key]
+        if lease.lost:
+            return
+        try:
+            await self._release_script(keys=[self._lease_key(lease.key)], args=[lease.owner])
+            self.metrics["released"] += 1
+        except Exception as e:
+            logger.warning(f"Failed to release lease {lease.key}: {e}")
+
+    async def _renew(self, lease: Lease):
+        try:
+            renewed = await self._renew_script(
+                keys=[self._lease_key(lease.key)], args=[lease.owner, settings.LEASE_TTL_MS]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to renew lease {lease.key}: {e}")
+            return
+        if renewed:
+            lease.expires_at = time.monotonic() + settings.LEASE_TTL_MS / 1000
+            self.metrics["renewed"] += 1
+        else:
+            # 已过期并可能被其他 worker 取得，之后的写入会被 fencing token 拒绝
+            lease.lost = True
+            self.metrics["lost"] += 1
+            if self._leases.get(lease.key) is lease:
+                del self._leases[lease.key]
+            logger.warning(f"Lease {lease.key} lost (token {lease.token})")
+
+    async def _maintenance_loop(self):
+        """续期使用中的租约，释放保留期已过的租约"""
+        interval = max(0.05, min(settings.LEASE_LINGER or 1.0, settings.LEASE_TTL_MS / 1000 / 3))
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for lease in list(self._leases.values()):
+                try:
+                    if lease.idle_since is not None and now - lease.idle_since >= settings.LEASE_LINGER:
+                        await self._release(lease)
+                    elif lease.expires_at - now <= settings.LEASE_TTL_MS / 1000 / 2:
+                        await self._renew(lease)
+                except Exception as e:
+                    logger.error(f"Lease maintenance error for {lease.key}: {e}")
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "distributed": self.enabled,
+            "held": len(self._leases),
+            "local_locks": len(self._locks),
+        }
+
+
+# 全局租约管理器实例
+lease_manager = LeaseManager()
@@ -7,6 +7,7 @@ from app.models.database import (
     Organization, OrganizationMember, 
     User, Document, DocumentCollaborator, PermissionLevel
 )
+from app.services.auth_cache import auth_cache
 
 
 class OrganizationService:
@@ -198,6 +199,7 @@ class OrganizationService:
         db.add(member)
         await db.commit()
         await db.refresh(member)
+        await auth_cache.invalidate_user_permissions(member.user_id)
         
         return member
     
@@ -282,6 +284,7 @@ class OrganizationService:
         member.role = new_role
         await db.commit()
         await db.refresh(member)
+        await auth_cache.invalidate_user_permissions(member.user_id)
         
         return member
     
@@ -325,6 +328,7 @@ class OrganizationService:
         # 软删除成员
         member.is_active = False
         await db.commit()
+        await auth_cache.invalidate_user_permissions(member.user_id)
         
         return True
 
@@ -0,0 +1,275 @@
+"""
+文本操作转换（OT）
+操作格式与 ot.js 一致：由组件组成的列表，
+正整数表示保留(retain)，负整数表示删除(delete)，字符串表示插入(insert)。
+例如在 "hello" 的第 5 个字符后插入 " world"：[5, " world"]
+"""
+from typing import Any, Dict, List, Tuple, Union
+
+Component = Union[int, str]
+TextOperation = List[Component]
+
+
+class OTError(ValueError):
+    """操作格式错误或与文档长度不匹配"""
+
+
+def is_retain(component: Component) -> bool:
+    return isinstance(component, int) and component > 0
+
+
+def is_delete(component: Component) -> bool:
+    return isinstance(component, int) and component < 0
+
+
+def is_insert(component: Component) -> bool:
+    return isinstance(component, str)
+
+
+def _push(op: TextOperation, component: Component):
+    """追加组件并合并相邻的同类组件，删除总是排在插入之前"""
+    if component == 0 or component == "":
+        return
+    if not op:
+        op.append(component)
+        return
+
+    last = op[-1]
+    if is_retain(component) and is_retain(last):
+        op[-1] = last + component
+    elif is_delete(component) and is_delete(last):
+        op[-1] = last + component
+    elif is_insert(component) and is_insert(last):
+        op[-1] = last + component
+    elif is_insert(component) and is_delete(last):
+        # 规范化：同一位置的插入放在删除前面
+        if len(op) >= 2 and is_insert(op[-2]):
+            op[-2] = op[-2] + component
+        else:
+            op.insert(len(op) - 1, component)
+    else:
+        op.append(component)
+
+
+def normalize(components: List[Any]) -> TextOperation:
+    """校验并规范化操作，去掉末尾多余的保留"""
+    if not isinstance(components, list):
+        raise OTError("operation must be a list")
+
+    op: TextOperation = []
+    for component in components:
+        if isinstance(component, bool) or not isinstance(component, (int, str)):
+            raise OTError(f"invalid component: {component!r}")
+        _push(op, component)
+
+    while op and is_retain(op[-1]):
+        op.pop()
+    return op
+
+
+def base_length(op: TextOperation) -> int:
+    """操作要求的原文档长度（不含末尾隐式保留）"""
+    return sum(abs(c) for c in op if isinstance(c, int))
+
+
+def target_length_delta(op: TextOperation) -> int:
+    """操作对文档长度的改变量"""
+    return sum(len(c) if is_insert(c) else (c if is_delete(c) else 0) for c in op)
+
+
+def is_noop(op: TextOperation) -> bool:
+    return all(is_retain(c) for c in op)
+
+
+def apply(content: str, op: TextOperation) -> str:
+    """将操作应用到文本，未覆盖的尾部内容原样保留"""
+    if base_length(op) > len(content):
+        raise OTError(
+            f"operation base length {base_length(op)} exceeds document length {len(content)}"
+        )
+
+    parts = []
+    index = 0
+    for component in op:
+        if is_retain(component):
+            parts.append(content[index:index + component])
+            index += component
+        elif is_insert(component):
+            parts.append(component)
+        else:
+            index -= component
+    parts.append(content[index:])
+    return "".join(parts)
+
+
+def transform(op1: TextOperation, op2: TextOperation) -> Tuple[TextOperation, TextOperation]:
+    """转换两个基于同一文档状态的并发操作
+
+    返回 (op1', op2')，满足 apply(apply(s, op1), op2') == apply(apply(s, op2), op1')。
+    同一位置同时插入时 op1 的插入排在前面。
+    """
+    # 末尾隐式保留显式化，保证两个操作覆盖相同长度
+    length = max(base_length(op1), base_length(op2))
+    ops1 = list(op1) + ([length - base_length(op1)] if length > base_length(op1) else [])
+    ops2 = list(op2) + ([length - base_length(op2)] if length > base_length(op2) else [])
+
+    op1_prime: TextOperation = []
+    op2_prime: TextOperation = []
+    i1 = i2 = 0
+    c1 = ops1[0] if ops1 else None
+    c2 = ops2[0] if ops2 else None
+
+    def next1():
+        nonlocal i1
+        i1 += 1
+        return ops1[i1] if i1 < len(ops1) else None
+
+    def next2():
+        nonlocal i2
+        i2 += 1
+        return ops2[i2] if i2 < len(ops2) else None
+
+    while c1 is not None or c2 is not None:
+        if c1 is not None and is_insert(c1):
+            _push(op1_prime, c1)
+            _push(op2_prime, len(c1))
+            c1 = next1()
+            continue
+        if c2 is not None and is_insert(c2):
+            _push(op1_prime, len(c2))
+            _push(op2_prime, c2)
+            c2 = next2()
+            continue
+        if c1 is None or c2 is None:
+            raise OTError("operations have different base lengths")
+
+        if is_retain(c1) and is_retain(c2):
+            step = min(c1, c2)
+            _push(op1_prime, step)
+            _push(op2_prime, step)
+        elif is_delete(c1) and is_delete(c2):
+            # 双方删除同一段文本，转换后都无需再删
+            step = min(-c1, -c2)
+        elif is_delete(c1) and is_retain(c2):
+            step = min(-c1, c2)
+            _push(op1_prime, -step)
+        else:  # retain / delete
+            step = min(c1, -c2)
+            _push(op2_prime, -step)
+
+        c1 = _consume(c1, step)
+        c2 = _consume(c2, step)
+        if c1 is None:
+            c1 = next1()
+        if c2 is None:
+            c2 = next2()
+
+    return normalize(op1_prime), normalize(op2_prime)
+
+
+def _consume(component: int, step: int):
+    """从保留/删除组件中消耗 step 个字符，耗尽返回 None"""
+    if component > 0:
+        remaining = component - step
+        return remaining if remaining > 0 else None
+    remaining = component + step
+    return remaining if remaining < 0 else None
+
+
+def transform_against(op: TextOperation, history: List[TextOperation]) -> TextOperation:
+    """将客户端操作依次转换过它未看到的服务端历史操作"""
+    for concurrent in history:
+        _, op = transform(concurrent, op)
+    return op
+
+
+def diff(old: str, new: str) -> TextOperation:
+    """根据公共前后缀生成把 old 变为 new 的操作（用于整文档更新）"""
+    if old == new:
+        return []
+
+    prefix = 0
+    max_prefix = min(len(old), len(new))
+    while prefix < max_prefix and old[prefix] == new[prefix]:
+        prefix += 1
+
+    suffix = 0
+    max_suffix = min(len(old), len(new)) - prefix
+    while suffix < max_suffix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    op: TextOperation = []
+    _push(op, prefix)
+    _push(op, -(len(old) - prefix - suffix))
+    _push(op, new[prefix:len(new) - suffix])
+    return normalize(op)
+
+
+def from_legacy(operation: Dict[str, Any]) -> TextOperation:
+    """兼容旧的 insert/delete/replace 位置操作格式"""
+    op_type = operation.get("type")
+    position = int(operation.get("position", 0))
+    if position < 0:
+        raise OTError("position must be non-negative")
+
+    if op_type == "insert":
+        return normalize([position, operation.get("text", operation.get("content", ""))])
+    if op_type == "delete":
+        return normalize([position, -int(operation.get("length", 0))])
+    if op_type == "replace":
+        return normalize([position, -int(operation.get("length", 0)), operation.get("text", "")])
+    raise OTError(f"unknown operation type: {op_type}")
+
+
+def to_legacy(op: TextOperation) -> List[Dict[str, Any]]:
+    """from_legacy 的逆过程：转换为依次应用的 insert/delete/replace 位置操作"""
+    operations: List[Dict[str, Any]] = []
+    position = 0
+    index = 0
+    while index < len(op):
+        if is_retain(op[index]):
+            position += op[index]
+            index += 1
+            continue
+        # 同一位置相邻的插入和删除合并为一个 replace
+        text = ""
+        length = 0
+        while index < len(op) and not is_retain(op[index]):
+            if is_insert(op[index]):
+                text += op[index]
+            else:
+                length -= op[index]
+            index += 1
+        if text and length:
+            operations.append({"type": "replace", "position": position, "length": length, "text": text})
+        elif length:
+            operations.append({"type": "delete", "position": position, "length": length})
+        else:
+            operations.append({"type": "insert", "position": position, "text": text})
+        position += len(text)
+    return operations
+
+
+def parse(operation: Dict[str, Any]) -> TextOperation:
+    """从客户端消息中解析操作：优先使用 ops 字段，否则按旧格式解析"""
+    if "ops" in operation:
+        return normalize(operation["ops"])
+    return from_legacy(operation)
+
+
+def summarize(op: TextOperation) -> Dict[str, Any]:
+    """提取操作的主要变化，用于写入 document_operations 记录"""
+    position = 0
+    for component in op:
+        if is_retain(component):
+            position += component
+            continue
+        inserted = "".join(c for c in op if is_insert(c))
+        deleted = -sum(c for c in op if is_delete(c))
+        return {
+            "type": "insert" if inserted else "delete",
+            "position": position,
+            "content": inserted,
+            "length": deleted,
+        }
+    return {"type": "retain", "position": position, "content": "", "length": 0}
@@ -1,62 +1,220 @@
-from typing import Optional, List
+from typing import Dict, Iterable, Optional, List, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select, and_, or_, func
+from sqlalchemy.orm import joinedload
 from fastapi import HTTPException, status
 
 from app.models.database import Document, DocumentCollaborator, PermissionLevel, Organization, OrganizationMember
 from app.models.database import User
+from app.services.auth_cache import auth_cache
+from app.services.document_search_service import document_search_service
+
+# 权限级别
+PERMISSION_HIERARCHY = {
+    PermissionLevel.READER: 1,
+    PermissionLevel.EDITOR: 2,
+    PermissionLevel.OWNER: 3
+}
+LEVEL_PERMISSIONS = {level: permission for permission, level in PERMISSION_HIERARCHY.items()}
+
+# 文档所属组织的有效成员可以查看文档
+ORGANIZATION_MEMBER_PERMISSION = PermissionLevel.READER
 
 class PermissionService:
     """权限管理服务"""
     
     @staticmethod
-    async def check_document_permission(
+    def _permission_query(user_condition):
+        """(文档, 用户, 所有者, 协作者权限, 组织成员) 查询：文档与满足条件的用户交叉连接，
+        协作者和组织成员按 (文档, 用户) 外连接"""
+        return (
+            select(
+                Document.id,
+                User.id,
+                Document.owner_id,
+                DocumentCollaborator.permission,
+                OrganizationMember.id,
+            )
+            .select_from(Document)
+            .join(User, user_condition)
+            .outerjoin(
+                DocumentCollaborator,
+                and_(
+                    DocumentCollaborator.document_id == Document.id,
+                    DocumentCollaborator.user_id == User.id
+                )
+            )
+            .outerjoin(
+                OrganizationMember,
+                and_(
+                    OrganizationMember.organization_id == Document.organization_id,
+                    OrganizationMember.user_id == User.id,
+                    OrganizationMember.is_active == True
+                )
+            )
+        )
+    
+    @staticmethod
+    def _effective_level(user_id: int, owner_id: int, collaborator_permission, org_member_id) -> int:
+        if owner_id == user_id:
+            return PERMISSION_HIERARCHY[PermissionLevel.OWNER]
+        level = PERMISSION_HIERARCHY.get(collaborator_permission, 0)
+        if org_member_id is not None:
+            level = max(level, PERMISSION_HIERARCHY[ORGANIZATION_MEMBER_PERMISSION])
+        return level
+    
+    @staticmethod
+    def permission_for_level(level: int) -> Optional[PermissionLevel]:
+        """权限级别转换为 PermissionLevel（0 表示无权限，返回 None）"""
+        return LEVEL_PERMISSIONS.get(level)
+    
+    @staticmethod
+    async def get_document_permission_level(
         db: AsyncSession,
         user_id: int,
-        document_id: int,
-        required_permission: PermissionLevel
-    ) -> bool:
-        """检查用户对文档的权限"""
-        
-        # 获取文档信息
-        stmt = select(Document).where(Document.id == document_id)
+        document_id: int
+    ) -> int:
+        """获取用户对文档的有效权限级别（0 表示无权限），结果会被缓存"""
+        level = auth_cache.get_permission(user_id, document_id)
+        if level is not None:
+            return level
+        
+        generation = auth_cache.generation
+        # 一次查询取出文档所有者、该用户的协作者权限和组织成员身份
+        stmt = (
+            PermissionService._permission_query(User.id == user_id)
+            .where(Document.id == document_id)
+        )
         result = await db.execute(stmt)
-        document = result.scalar_one_or_none()
+        row = result.first()
         
-        if not document:
+        if not row:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="文档不存在"
             )
         
-        # 检查是否为文档所有者
-        if document.owner_id == user_id:
-            return True
-        
-        # 检查协作者权限
-        stmt = select(DocumentCollaborator).where(
-            and_(
-                DocumentCollaborator.document_id == document_id,
-                DocumentCollaborator.user_id == user_id
+        level = PermissionService._effective_level(user_id, *row[2:])
+        auth_cache.set_permission(user_id, document_id, level, generation)
+        return level
+    
+    @staticmethod
+    async def resolve_permission_levels(
+        db: AsyncSession,
+        user_ids: Iterable[int],
+        document_ids: Iterable[int]
+    ) -> Dict[Tuple[int, int], int]:
+        """批量获取 {(用户, 文档): 有效权限级别}
+
+        未缓存的组合用一次集合查询计算，结果写入权限缓存；不存在的文档不出现在结果中。
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        document_ids = list(dict.fromkeys(document_ids))
+        levels: Dict[Tuple[int, int], int] = {}
+        missing_users, missing_documents = set(), set()
+        for user_id in user_ids:
+            for document_id in document_ids:
+                level = auth_cache.get_permission(user_id, document_id)
+                if level is None:
+                    missing_users.add(user_id)
+                    missing_documents.add(document_id)
+                else:
+                    levels[(user_id, document_id)] = level
+        if not missing_users:
+            return levels
+        
+        generation = auth_cache.generation
+        stmt = (
+            PermissionService._permission_query(User.id.in_(missing_users))
+            .where(Document.id.in_(missing_documents))
+        )
+        result = await db.execute(stmt)
+        for document_id, user_id, *row in result.all():
+            if (user_id, document_id) in levels:
+                continue
+            level = PermissionService._effective_level(user_id, *row)
+            levels[(user_id, document_id)] = level
+            auth_cache.set_permission(user_id, document_id, level, generation)
+        return levels
+    
+    @staticmethod
+    async def get_document_permission_levels(
+        db: AsyncSession,
+        user_id: int,
+        document_ids: Iterable[int]
+    ) -> Dict[int, int]:
+        """批量获取用户对一组文档的有效权限级别 {document_id: level}"""
+        levels = await PermissionService.resolve_permission_levels(db, [user_id], document_ids)
+        return {document_id: level for (_, document_id), level in levels.items()}
+    
+    @staticmethod
+    async def get_user_permission_levels(
+        db: AsyncSession,
+        document_id: int,
+        user_ids: Iterable[int]
+    ) -> Dict[int, int]:
+        """批量获取一组用户对文档的有效权限级别 {user_id: level}"""
+        levels = await PermissionService.resolve_permission_levels(db, user_ids, [document_id])
+        return {user_id: level for (user_id, _), level in levels.items()}
+    
+    @staticmethod
+    async def get_collaborator_summaries(
+        db: AsyncSession,
+        document_ids: Iterable[int],
+        limit: int = 5
+    ) -> Dict[int, Dict]:
+        """批量获取文档的协作者摘要 {document_id: {"count": 总数, "collaborators": 最近添加的 limit 个}}"""
+        document_ids = list(document_ids)
+        summaries = {document_id: {"count": 0, "collaborators": []} for document_id in document_ids}
+        if not document_ids:
+            return summaries
+        
+        # 每个文档按添加时间编号，只取前 limit 行
+        ranked = (
+            select(
+                DocumentCollaborator.id,
+                func.row_number().over(
+                    partition_by=DocumentCollaborator.document_id,
+                    order_by=(DocumentCollaborator.added_at.desc(), DocumentCollaborator.id.desc())
+                ).label("rank")
             )
+            .where(DocumentCollaborator.document_id.in_(document_ids))
+            .subquery()
+        )
+        stmt = (
+            select(DocumentCollaborator)
+            .options(joinedload(DocumentCollaborator.user))
+            .join(ranked, ranked.c.id == DocumentCollaborator.id)
+            .where(ranked.c.rank <= limit)
+            .order_by(DocumentCollaborator.document_id, ranked.c.rank)
         )
         result = await db.execute(stmt)
-        collaborator = result.scalar_one_or_none()
+        for collaborator in result.scalars().all():
+            summaries[collaborator.document_id]["collaborators"].append(collaborator)
         
-        if not collaborator:
-            return False
-        
-        # 权限级别检查
-        permission_hierarchy = {
-            PermissionLevel.READER: 1,
-            PermissionLevel.EDITOR: 2,
-            PermissionLevel.OWNER: 3
-        }
-        
-        user_permission_level = permission_hierarchy.get(collaborator.permission, 0)
-        required_permission_level = permission_hierarchy.get(required_permission, 0)
+        count_stmt = (
+            select(DocumentCollaborator.document_id, func.count())
+            .where(DocumentCollaborator.document_id.in_(document_ids))
+            .group_by(DocumentCollaborator.document_id)
+        )
+        for document_id, count in await db.execute(count_stmt):
+            summaries[document_id]["count"] = count
+        return summaries
+    
+    @staticmethod
+    async def check_document_permission(
+        db: AsyncSession,
+        user_id: int,
+        document_id: int,
+        required_permission: PermissionLevel
+    ) -> bool:
+        """检查用户对文档的权限"""
+        user_permission_level = await PermissionService.get_document_permission_level(
+            db, user_id, document_id
+        )
+        required_permission_level = PERMISSION_HIERARCHY.get(required_permission, 0)
         
-        return user_permission_level >= required_permission_level
+        return user_permission_level > 0 and user_permission_level >= required_permission_level
     
     @staticmethod
     async def check_organization_permission(
@@ -139,16 +297,14 @@ class PermissionService:
                 # 如果没有组织权限，只返回用户自己的文档
                 conditions.append(Document.owner_id == user_id)
         
-        if search:
-            search_condition = or_(
-                Document.title.contains(search),
-                Document.content.contains(search)
-            )
-            conditions.append(search_condition)
-        
         if category:
             conditions.append(Document.category == category)
         
+        # 正文保存在 ShareDB 中，搜索走全文索引并按相关度排序
+        if search and search.strip():
+            result = await document_search_service.search(db, search, conditions, skip, limit)
+            return result["documents"]
+        
         stmt = select(Document).where(and_(*conditions)).offset(skip).limit(limit).order_by(Document.updated_at.desc())
         
         result = await db.execute(stmt)
@@ -202,6 +358,7 @@ class PermissionService:
         db.add(collaborator)
         await db.commit()
         await db.refresh(collaborator)
+        await auth_cache.invalidate_permission(collaborator_user_id, document_id)
         
         return collaborator
     
@@ -246,6 +403,7 @@ class PermissionService:
         collaborator.permission = new_permission
         await db.commit()
         await db.refresh(collaborator)
+        await auth_cache.invalidate_permission(collaborator_user_id, document_id)
         
         return collaborator
     
@@ -288,6 +446,7 @@ class PermissionService:
         # 删除协作者记录
         await db.delete(collaborator)
         await db.commit()
+        await auth_cache.invalidate_permission(collaborator_user_id, document_id)
         
         return True
     
@@ -0,0 +1,150 @@
+"""
+在线状态服务
+- 光标合并：每个用户在一个发送周期内只转发最新的光标位置（默认 20Hz）
+- 在线用户：保存在 Redis 有序集合中，由各 worker 批量心跳续期，超时自动过期，
+  文档列表无需建立 WebSocket 即可查询实时编辑人数
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# (document_id, message, exclude_session_id) -> 广播
+CursorBroadcaster = Callable[[int, dict, Optional[str]], Awaitable[None]]
+# 返回本 worker 的在线情况 {document_id: {user_id: user_info}}
+LocalPresenceProvider = Callable[[], Dict[int, Dict[int, dict]]]
+
+
+class PresenceService:
+    """光标合并与在线状态服务"""
+
+    def __init__(self):
+        self.enabled = False
+        # 待发送的光标 {document_id: {user_id: (position, session_id)}}
+        self.pending_cursors: Dict[int, Dict[int, Tuple[dict, Optional[str]]]] = {}
+        self.broadcaster: Optional[CursorBroadcaster] = None
+        self.local_presence: Optional[LocalPresenceProvider] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def start(self, broadcaster: CursorBroadcaster, local_presence: LocalPresenceProvider):
+        """启动光标发送和心跳协程；Redis 不可用时在线状态只统计本 worker"""
+        self.broadcaster = broadcaster
+        self.local_presence = local_presence
+        self._ensure_flush_task()
+
+        try:
+            await redis_client.redis.ping()
+            self.enabled = True
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        except Exception as e:
+            logger.warning(f"Redis unavailable, presence limited to local connections: {e}")
+
+    async def stop(self):
+        """停止后台协程"""
+        self.enabled = False
+        for task in (self._flush_task, self._heartbeat_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = None
+        self._heartbeat_task = None
+
+    def _ensure_flush_task(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def queue_cursor(self, document_id: int, user_id: int, position: dict, session_id: str = None):
+        """记录用户最新光标，等待下一个发送周期"""
+        if self.broadcaster is None:
+            return
+        self._ensure_flush_task()
+        self.pending_cursors.setdefault(document_id, {})[user_id] = (position, session_id)
+
+    def discard_cursor(self, document_id: int, user_id: int):
+        """用户离开时丢弃尚未发送的光标"""
+        self.pending_cursors.get(document_id, {}).pop(user_id, None)
+
+    async def _flush_loop(self):
+        """按固定频率发送合并后的光标"""
+        interval = 1.0 / max(settings.PRESENCE_CURSOR_HZ, 1)
+        while True:
+            await asyncio.sleep(interval)
+            if not self.pending_cursors:
+                continue
+
+            pending, self.pending_cursors = self.pending_cursors, {}
+            for document_id, cursors in pending.items():
+                for user_id, (position, session_id) in cursors.items():
+                    message = {"type": "cursor", "user_id": user_id, "position": position}
+                    try:
+                        await self.broadcaster(document_id, message, session_id)
+                    except Exception as e:
+                        logger.error(f"Failed to broadcast cursor: {e}")
+
+    async def _heartbeat_loop(self):
+        """定期批量续期本 worker 上的在线用户"""
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                presence = {
+                    document_id: list(users.keys())
+                    for document_id, users in self.local_presence().items()
+                }
+                await redis_client.refresh_online_users(presence, settings.PRESENCE_TTL)
+            except Exception as e:
+                logger.error(f"Presence heartbeat failed: {e}")
+
+    async def join(self, document_id: int, user_id: int, user_info: dict):
+        """记录用户进入文档"""
+        if not self.enabled:
+            return
+        try:
+            await redis_client.add_online_user(document_id, user_id, user_info, settings.PRESENCE_TTL)
+        except Exception as e:
+            logger.error(f"Failed to record presence: {e}")
+
+    async def leave(self, document_id: int, user_id: int):
+        """记录用户离开文档（该用户在本 worker 上已无其他会话）"""
+        self.discard_cursor(document_id, user_id)
+        if not self.enabled:
+            return
+        try:
+            await redis_client.remove_online_user(document_id, user_id)
+        except Exception as e:
+            logger.error(f"Failed to remove presence: {e}")
+
+    async def get_online_users(self, document_id: int) -> List[dict]:
+        """获取文档的在线用户"""
+        if self.enabled:
+            try:
+                return await redis_client.get_online_users(document_id, settings.PRESENCE_TTL)
+            except Exception as e:
+                logger.error(f"Failed to read presence: {e}")
+
+        users = self.local_presence().get(document_id, {}) if self.local_presence else {}
+        return list(users.values())
+
+    async def get_editor_counts(self, document_ids: Iterable[int]) -> Dict[int, int]:
+        """批量获取文档的实时编辑人数"""
+        document_ids = list(document_ids)
+        if self.enabled:
+            try:
+                return await redis_client.count_online_users(document_ids, settings.PRESENCE_TTL)
+            except Exception as e:
+                logger.error(f"Failed to count presence: {e}")
+
+        local = self.local_presence() if self.local_presence else {}
+        return {document_id: len(local.get(document_id, {})) for document_id in document_ids}
+
+
+# 全局在线状态服务实例
+presence_service = PresenceService()
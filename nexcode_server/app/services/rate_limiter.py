@@ -0,0 +1,191 @@
+"""
+令牌桶限流
+每个请求按路由权重从若干令牌桶（API Key、用户、匿名请求的 IP）中扣除令牌：
+  - Redis 中用一个 Lua 脚本原子地检查并扣除所有桶，任一桶不足则都不扣除
+  - Redis 不可用时退化为本 worker 内的令牌桶（有容量上限的 LRU），
+    之后每隔 RATE_LIMIT_REDIS_RETRY 秒重新尝试 Redis
+
+Redis 键：ratelimit:{类型}:{标识}  哈希字段 tokens（剩余令牌）、ts（上次更新时间）
+"""
+
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# KEYS: 各令牌桶  ARGV: 消耗, 每个桶的 (容量, 每秒补充令牌数)
+# 返回 {是否允许, 需等待秒数, 各桶剩余令牌...}（小数以字符串返回）
+_TAKE_SCRIPT = """
+-- 使用 TIME 之前切换为按效果复制（Redis 7 起为默认行为）
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local allowed = 1
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local value = capacity
+    if state[1] then
+        value = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+    end
+    tokens[i] = value
+    if value < cost then
+        allowed = 0
+        wait = math.max(wait, (cost - value) / rate)
+    end
+end
+local result = {allowed, tostring(wait)}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    if allowed == 1 then
+        tokens[i] = tokens[i] - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens[i]) / rate * 1000) + 1000)
+    result[#result + 1] = tostring(tokens[i])
+end
+return result
+"""
+
+
+class Bucket(NamedTuple):
+    """令牌桶：每 period 秒补满 capacity 个令牌"""
+
+    key: str
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+class RateLimitDecision:
+    """一次限流检查的结果，按剩余令牌最少的桶生成响应头"""
+
+    __slots__ = ("allowed", "limit", "remaining", "reset", "retry_after", "period")
+
+    def __init__(self, allowed: bool, buckets: Sequence[Bucket], tokens: Sequence[float], wait: float):
+        self.allowed = allowed
+        index = min(range(len(buckets)), key=lambda i: tokens[i])
+        bucket = buckets[index]
+        self.limit = bucket.capacity
+        self.period = bucket.period
+        self.remaining = max(0, int(tokens[index]))
+        # 该桶补满所需的秒数
+        self.reset = math.ceil((bucket.capacity - tokens[index]) / bucket.rate)
+        self.retry_after = math.ceil(wait)
+
+    def headers(self) -> dict:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+            "RateLimit-Policy": f"{self.limit};w={int(self.period)}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, self.retry_after))
+        return headers
+
+
+class RateLimiter:
+    """Redis 令牌桶限流，Redis 不可用时使用本地令牌桶"""
+
+    def __init__(self):
+        self.enabled = False
+        self.redis = redis_client.redis
+        self._take_script = self.redis.register_script(_TAKE_SCRIPT)
+        # Redis 出错后在该时间（monotonic）之前只使用本地令牌桶
+        self._redis_retry_at = 0.0
+        # 本地令牌桶 {key: [剩余令牌, 上次更新时间]}
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.metrics = {"allowed": 0, "limited": 0, "local_decisions": 0, "redis_errors": 0}
+
+    async def start(self):
+        """检查 Redis 是否可用；不可用时只在本 worker 内限流"""
+        try:
+            await self.redis.ping()
+            self.enabled = True
+        except Exception as e:
+            logger.warning(f"Redis unavailable, rate limits are local to this worker: {e}")
+
+    async def hit(self, buckets: Sequence[Bucket], cost: int = 1) -> RateLimitDecision:
+        """从所有桶中扣除 cost 个令牌（全部足够时才扣除）"""
+        # 单次消耗超过桶容量时按容量计算，否则永远无法通过
+        cost = min(cost, min(bucket.capacity for bucket in buckets))
+        result = None
+        if self.enabled and time.monotonic() >= self._redis_retry_at:
+            result = await self._take_redis(buckets, cost)
+        if result is None:
+            result = self._take_local(buckets, cost)
+            self.metrics["local_decisions"] += 1
+
+        allowed, wait, tokens = result
+        self.metrics["allowed" if allowed else "limited"] += 1
+        return RateLimitDecision(allowed, buckets, tokens, wait)
+
+    async def _take_redis(
+        self, buckets: Sequence[Bucket], cost: int
+    ) -> Optional[Tuple[bool, float, List[float]]]:
+        args: List[float] = [cost]
+        for bucket in buckets:
+            args.extend((bucket.capacity, bucket.rate))
+        try:
+            result = await self._take_script(keys=[bucket.key for bucket in buckets], args=args)
+        except Exception as e:
+            self.metrics["redis_errors"] += 1
+            self._redis_retry_at = time.monotonic() + settings.RATE_LIMIT_REDIS_RETRY
+            logger.error(f"Rate limit check failed, falling back to local buckets: {e}")
+            return None
+        return bool(int(result[0])), float(result[1]), [float(value) for value in result[2:]]
+
+    def _take_local(self, buckets: Sequence[Bucket], cost: int) -> Tuple[bool, float, List[float]]:
+        now = time.monotonic()
+        states = []
+        for bucket in buckets:
+            state = self._local.get(bucket.key)
+            if state is None:
+                state = [float(bucket.capacity), now]
+                self._local[bucket.key] = state
+            else:
+                state[0] = min(bucket.capacity, state[0] + (now - state[1]) * bucket.rate)
+                state[1] = now
+            self._local.move_to_end(bucket.key)
+            states.append(state)
+
+        wait = max(
+            ((cost - state[0]) / bucket.rate for bucket, state in zip(buckets, states) if state[0] < cost),
+            default=0.0,
+        )
+        allowed = wait == 0.0
+        if allowed:
+            for state in states:
+                state[0] -= cost
+
+        while len(self._local) > settings.RATE_LIMIT_LOCAL_MAX_BUCKETS:
+            self._local.popitem(last=False)
+        return allowed, wait, [state[0] for state in states]
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "distributed": self.enabled and time.monotonic() >= self._redis_retry_at,
+            "local_buckets": len(self._local),
+        }
+
+
+# 全局实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,360 @@
+"""
+问答上下文检索服务
+基于BM25倒排索引，为 intelligent_qa / commit_qa 检索用户的提交历史和协作文档片段
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import desc, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.text_index import BM25Index
+from app.core.token_counter import approximate_tokens
+from app.models.database import (
+    CommitInfo,
+    Document,
+    DocumentCollaborator,
+    DocumentStatus,
+    OrganizationMember,
+)
+
+logger = logging.getLogger(__name__)
+
+# 单个片段的最大长度（字符）
+MAX_SNIPPET_CHARS = 1200
+# diff 片段的最大行数
+MAX_DIFF_CHUNK_LINES = 60
+# 单次查询时最多补充索引的文档数
+MAX_DOCUMENTS_PER_LOAD = 200
+
+
+def _split_diff(diff_content: str) -> List[str]:
+    """按文件切分diff，过长的文件再按行数切分"""
+    sections: List[List[str]] = []
+    for line in diff_content.splitlines():
+        if line.startswith("diff --git") or not sections:
+            sections.append([])
+        sections[-1].append(line)
+
+    chunks = []
+    for section in sections:
+        header = section[0] if section[0].startswith("diff --git") else ""
+        for start in range(0, len(section), MAX_DIFF_CHUNK_LINES):
+            lines = section[start:start + MAX_DIFF_CHUNK_LINES]
+            if start > 0 and header:
+                lines = [header] + lines
+            chunks.append("\n".join(lines)[:MAX_SNIPPET_CHARS])
+    return chunks
+
+
+def _split_paragraphs(content: str) -> List[str]:
+    """按空行切分文档，合并短段落，拆分超长段落"""
+    chunks: List[str] = []
+    current = ""
+    for paragraph in content.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > MAX_SNIPPET_CHARS:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:MAX_SNIPPET_CHARS])
+            paragraph = paragraph[MAX_SNIPPET_CHARS:]
+        if current and len(current) + len(paragraph) + 2 > MAX_SNIPPET_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class _UserCommitIndex:
+    """单个用户的提交历史索引"""
+
+    def __init__(self):
+        self.index = BM25Index()
+        # {commit_id: [chunk_key]}
+        self.chunks: Dict[int, List[Hashable]] = {}
+
+
+class RetrievalService:
+    """检索服务"""
+
+    def __init__(self):
+        # 按用户划分的提交索引（LRU）{user_id: _UserCommitIndex}
+        self._commit_indexes: "OrderedDict[int, _UserCommitIndex]" = OrderedDict()
+        self._loading_locks: Dict[int, asyncio.Lock] = {}
+        # 全局文档索引，查询时按权限过滤
+        self._document_index = BM25Index()
+        self._document_chunks: Dict[int, List[Hashable]] = {}
+        self._document_titles: Dict[int, str] = {}
+        # 待索引的文档内容 {document_id: content}，查询前统一刷新，避免每次编辑都重建索引
+        self._pending_documents: Dict[int, str] = {}
+
+    # ---- 提交历史 ----
+
+    def _commit_chunks(self, commit: CommitInfo) -> List[Dict[str, Any]]:
+        """将一条提交记录切分为可检索片段"""
+        location = commit.repository_name or "unknown"
+        if commit.branch_name:
+            location = f"{location}@{commit.branch_name}"
+        title = f"commit #{commit.id} ({location})"
+
+        message = commit.final_commit_message or ""
+        files = commit.files_changed or []
+        header = message
+        if files:
+            header = f"{message}\nfiles: {', '.join(str(f) for f in files[:20])}"
+
+        chunks = [{"title": title, "text": header[:MAX_SNIPPET_CHARS]}]
+        if commit.diff_content:
+            for diff_chunk in _split_diff(commit.diff_content):
+                chunks.append({"title": f"{title} diff", "text": diff_chunk})
+        return chunks
+
+    def _index_commit_into(self, user_index: _UserCommitIndex, commit: CommitInfo):
+        """把提交记录写入用户索引（替换旧片段）"""
+        self._remove_commit_from(user_index, commit.id)
+
+        keys = []
+        for i, chunk in enumerate(self._commit_chunks(commit)):
+            key = ("commit", commit.id, i)
+            payload = {"source": "commit", "id": commit.id, "title": chunk["title"], "text": chunk["text"]}
+            # 提交消息拼入每个diff片段的索引文本，使消息中的关键词也能命中diff
+            user_index.index.add(key, f"{commit.final_commit_message or ''}\n{chunk['text']}", payload)
+            keys.append(key)
+        user_index.chunks[commit.id] = keys
+
+    def _remove_commit_from(self, user_index: _UserCommitIndex, commit_id: int):
+        for key in user_index.chunks.pop(commit_id, []):
+            user_index.index.remove(key)
+
+    async def _get_user_index(self, db: AsyncSession, user_id: int) -> _UserCommitIndex:
+        """获取用户的提交索引，首次访问时从数据库加载"""
+        user_index = self._commit_indexes.get(user_id)
+        if user_index is not None:
+            self._commit_indexes.move_to_end(user_id)
+            return user_index
+
+        lock = self._loading_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            user_index = self._commit_indexes.get(user_id)
+            if user_index is not None:
+                return user_index
+
+            stmt = (
+                select(CommitInfo)
+                .where(CommitInfo.user_id == user_id)
+                .order_by(desc(CommitInfo.created_at))
+                .limit(settings.RETRIEVAL_MAX_COMMITS)
+            )
+            result = await db.execute(stmt)
+
+            user_index = _UserCommitIndex()
+            for commit in result.scalars().all():
+                self._index_commit_into(user_index, commit)
+
+            self._commit_indexes[user_id] = user_index
+            while len(self._commit_indexes) > settings.RETRIEVAL_MAX_USERS:
+                evicted_user, _ = self._commit_indexes.popitem(last=False)
+                self._loading_locks.pop(evicted_user, None)
+
+            logger.info(f"Built commit index for user {user_id}: {len(user_index.chunks)} commits")
+            return user_index
+
+    def index_commit(self, commit: CommitInfo):
+        """增量索引新建或更新的提交（用户索引未加载时跳过，加载时会包含该提交）"""
+        user_index = self._commit_indexes.get(commit.user_id)
+        if user_index is not None:
+            self._index_commit_into(user_index, commit)
+
+    def remove_commit(self, user_id: int, commit_id: int):
+        """从索引中移除提交"""
+        user_index = self._commit_indexes.get(user_id)
+        if user_index is not None:
+            self._remove_commit_from(user_index, commit_id)
+
+    # ---- 协作文档 ----
+
+    def index_document(self, document_id: int, content: str, title: Optional[str] = None):
+        """登记文档的新内容，实际索引延迟到下一次查询"""
+        self._pending_documents[int(document_id)] = content or ""
+        if title is not None:
+            self._document_titles[int(document_id)] = title
+
+    def remove_document(self, document_id: int):
+        """从索引中移除文档"""
+        document_id = int(document_id)
+        self._pending_documents.pop(document_id, None)
+        for key in self._document_chunks.pop(document_id, []):
+            self._document_index.remove(key)
+
+    def _flush_pending_documents(self):
+        """把待索引文档写入倒排索引"""
+        pending, self._pending_documents = self._pending_documents, {}
+        for document_id, content in pending.items():
+            for key in self._document_chunks.pop(document_id, []):
+                self._document_index.remove(key)
+
+            keys = []
+            for i, chunk in enumerate(_split_paragraphs(content)):
+                key = ("document", document_id, i)
+                self._document_index.add(key, chunk, {"source": "document", "id": document_id, "text": chunk})
+                keys.append(key)
+            self._document_chunks[document_id] = keys
+
+    async def _get_accessible_documents(self, db: AsyncSession, user_id: int) -> Dict[int, str]:
+        """获取用户可访问的文档 {document_id: title}"""
+        org_ids = select(OrganizationMember.organization_id).where(
+            OrganizationMember.user_id == user_id,
+            OrganizationMember.is_active == True,
+        )
+        stmt = (
+            select(Document.id, Document.title)
+            .where(
+                Document.status == DocumentStatus.ACTIVE,
+                or_(
+                    Document.owner_id == user_id,
+                    Document.id.in_(
+                        select(DocumentCollaborator.document_id).where(
+                            DocumentCollaborator.user_id == user_id
+                        )
+                    ),
+                    Document.organization_id.in_(org_ids),
+                ),
+            )
+            .order_by(desc(Document.updated_at))
+        )
+        result = await db.execute(stmt)
+        return {row.id: row.title for row in result}
+
+    async def _load_missing_documents(self, db: AsyncSession, document_ids: Sequence[int]):
+        """补充尚未索引的文档内容：一次批量读取 ShareDB，ShareDB 中没有的文档读取 PostgreSQL"""
+        missing = [
+            doc_id for doc_id in document_ids
+            if doc_id not in self._document_chunks and doc_id not in self._pending_documents
+        ][:MAX_DOCUMENTS_PER_LOAD]
+        if not missing:
+            return
+
+        from app.services.sharedb_service import get_sharedb_service
+
+        try:
+            contents = await get_sharedb_service().get_contents([str(doc_id) for doc_id in missing])
+        except Exception as e:
+            logger.warning(f"Failed to load documents from ShareDB for retrieval: {e}")
+            contents = {}
+        for doc_id in missing:
+            if str(doc_id) in contents:
+                self.index_document(doc_id, contents[str(doc_id)])
+
+        fallback = [doc_id for doc_id in missing if str(doc_id) not in contents]
+        if fallback:
+            result = await db.execute(
+                select(Document.id, Document.content).where(Document.id.in_(fallback))
+            )
+            for row in result:
+                self.index_document(row.id, row.content or "")
+
+    # ---- 检索 ----
+
+    async def retrieve(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        top_k: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        include_commits: bool = True,
+        include_documents: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """检索与问题相关的片段，并在token预算内截断
+
+        Returns:
+            List[Dict]: 片段列表，每项包含 source/id/title/text/score
+        """
+        top_k = top_k or settings.RETRIEVAL_TOP_K
+        token_budget = token_budget or settings.RETRIEVAL_TOKEN_BUDGET
+
+        candidates: List[Dict[str, Any]] = []
+
+        if include_commits:
+            user_index = await self._get_user_index(db, user_id)
+            for key, score in user_index.index.search(query, top_k):
+                candidates.append({**user_index.index.get_payload(key), "score": score})
+
+        if include_documents:
+            accessible = await self._get_accessible_documents(db, user_id)
+            self._document_titles.update(accessible)
+            await self._load_missing_documents(db, list(accessible))
+            self._flush_pending_documents()
+
+            hits = self._document_index.search(
+                query, top_k, key_filter=lambda key: key[1] in accessible
+            )
+            for key, score in hits:
+                payload = self._document_index.get_payload(key)
+                title = f"document #{payload['id']} {self._document_titles.get(payload['id'], '')}".strip()
+                candidates.append({**payload, "title": title, "score": score})
+
+        candidates.sort(key=lambda item: item["score"], reverse=True)
+
+        # 在token预算内按得分依次选取片段
+        selected = []
+        used_tokens = 0
+        for snippet in candidates[:top_k]:
+            # 预算只需估算，避免为每个片段加载分词器
+            tokens = approximate_tokens(f"{snippet['title']}\n{snippet['text']}")
+            if used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            selected.append(snippet)
+        return selected
+
+    async def build_qa_context(
+        self,
+        db: AsyncSession,
+        user_id: Optional[int],
+        question: str,
+        top_k: Optional[int] = None,
+        token_budget: Optional[int] = None,
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """为问答接口构建检索上下文
+
+        Returns:
+            Tuple[str, List[Dict]]: (提示词上下文文本, 引用来源列表)
+        """
+        if not user_id:
+            return self.format_context([]), []
+
+        try:
+            snippets = await self.retrieve(db, user_id, question, top_k, token_budget)
+        except Exception as e:
+            logger.warning(f"Retrieval failed for user {user_id}: {e}")
+            snippets = []
+
+        sources = [
+            {"source": s["source"], "id": s["id"], "title": s["title"], "score": round(s["score"], 4)}
+            for s in snippets
+        ]
+        return self.format_context(snippets), sources
+
+    @staticmethod
+    def format_context(snippets: List[Dict[str, Any]]) -> str:
+        """将片段格式化为提示词中的上下文文本"""
+        if not snippets:
+            return "(no related history found)"
+        parts = []
+        for i, snippet in enumerate(snippets, 1):
+            parts.append(f"[{i}] {snippet['title']}\n{snippet['text']}")
+        return "\n\n".join(parts)
+
+
+# 全局实例
+retrieval_service = RetrievalService()
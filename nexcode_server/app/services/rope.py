@@ -0,0 +1,164 @@
+"""
+绳索（Rope）文本结构
+文本被切成不超过 LEAF_SIZE 的分块，按随机优先级组织成平衡树（treap）。
+插入、删除只需沿树拆分 / 合并 O(log n) 个节点，不必像字符串切片那样复制整篇文档；
+小段编辑落在单个分块内时直接原地修改该分块。
+"""
+
+import random
+from typing import Iterator, List, Optional, Tuple
+
+LEAF_SIZE = 512  # 叶子分块的最大长度
+
+
+class _Node:
+    __slots__ = ("text", "priority", "size", "left", "right")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.priority = random.random()
+        self.size = len(text)
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> _Node:
+    node.size = len(node.text) + _size(node.left) + _size(node.right)
+    return node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """连接两棵树（left 的文本在前）"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _split(node: Optional[_Node], pos: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """按字符位置拆成两棵树，左树包含前 pos 个字符"""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if pos <= left_size:
+        left, right = _split(node.left, pos)
+        node.left = right
+        return left, _update(node)
+
+    offset = pos - left_size
+    if offset >= len(node.text):
+        left, right = _split(node.right, offset - len(node.text))
+        node.right = left
+        return _update(node), right
+
+    # 拆分点落在当前分块内部
+    left = _merge(node.left, _Node(node.text[:offset]))
+    right = _merge(_Node(node.text[offset:]), node.right)
+    return left, right
+
+
+def _build(chunks: List[str]) -> Optional[_Node]:
+    """按顺序把分块线性地建成 treap（笛卡尔树构造）"""
+    stack: List[_Node] = []
+    for chunk in chunks:
+        node = _Node(chunk)
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = _update(stack.pop())
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    while len(stack) > 1:
+        _update(stack.pop())
+    return _update(stack[0]) if stack else None
+
+
+def _chunk(text: str) -> List[str]:
+    return [text[i:i + LEAF_SIZE] for i in range(0, len(text), LEAF_SIZE)]
+
+
+def _edit_leaf(node: Optional[_Node], pos: int, length: int, text: str) -> bool:
+    """编辑范围落在单个分块内且不超长时原地修改，返回是否成功"""
+    if node is None:
+        return False
+    left_size = _size(node.left)
+    if pos < left_size:
+        edited = _edit_leaf(node.left, pos, length, text)
+    else:
+        offset = pos - left_size
+        if offset + length <= len(node.text):
+            if len(node.text) - length + len(text) > LEAF_SIZE:
+                return False
+            node.text = node.text[:offset] + text + node.text[offset + length:]
+            edited = True
+        elif offset >= len(node.text):
+            edited = _edit_leaf(node.right, offset - len(node.text), length, text)
+        else:
+            # 范围跨越多个分块
+            return False
+    if edited:
+        _update(node)
+    return edited
+
+
+class Rope:
+    """可高效插入和删除的文本"""
+
+    __slots__ = ("_root",)
+
+    def __init__(self, text: str = ""):
+        self._root = _build(_chunk(text))
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __str__(self) -> str:
+        return "".join(self.chunks())
+
+    def chunks(self) -> Iterator[str]:
+        """按顺序遍历文本分块"""
+        stack: List[_Node] = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            if node.text:
+                yield node.text
+            node = node.right
+
+    def _clamp(self, pos: int) -> int:
+        return max(0, min(pos, len(self)))
+
+    def replace(self, pos: int, length: int, text: str = ""):
+        """把 [pos, pos + length) 替换为 text"""
+        pos = self._clamp(pos)
+        length = max(0, min(length, len(self) - pos))
+        if not length and not text:
+            return
+        if _edit_leaf(self._root, pos, length, text):
+            return
+        left, rest = _split(self._root, pos)
+        _, right = _split(rest, length)
+        self._root = _merge(_merge(left, _build(_chunk(text))), right)
+
+    def insert(self, pos: int, text: str):
+        self.replace(pos, 0, text)
+
+    def delete(self, pos: int, length: int):
+        self.replace(pos, length)
+
+    def set(self, text: str):
+        """整体替换内容"""
+        self._root = _build(_chunk(text))
@@ -0,0 +1,92 @@
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.pagination import Paginator
+from app.core.search import match_rank, prefix_match, text_match
+from app.models.database import User
+from app.services.count_cache import count_cache
+
+
+class SearchService:
+    """用户搜索服务"""
+
+    @staticmethod
+    async def search_users(db: AsyncSession, query: str, limit: int = 10) -> List[User]:
+        """搜索活跃用户（用于邀请、@提及等自动补全场景）
+
+        先用前缀匹配取用户名/邮箱以查询词开头的用户（走 lower(column) 前缀索引），
+        数量不足时再用三元组模糊匹配补齐，结果按相关度排序
+        """
+        query = query.strip()
+        if not query:
+            return []
+
+        prefix_stmt = (
+            select(User)
+            .where(
+                prefix_match([User.username, User.email], query),
+                User.is_active == True,
+            )
+            .order_by(func.length(User.username), User.username)
+            .limit(limit)
+        )
+        result = await db.execute(prefix_stmt)
+        users = list(result.scalars().all())
+
+        if len(users) >= limit:
+            return users
+
+        columns = [User.username, User.email, User.full_name]
+        fuzzy_stmt = (
+            select(User)
+            .where(
+                text_match(db, columns, query),
+                User.is_active == True,
+            )
+            .order_by(desc(match_rank(db, columns, query)), User.username)
+            .limit(limit)
+        )
+        if users:
+            fuzzy_stmt = fuzzy_stmt.where(User.id.notin_([user.id for user in users]))
+
+        result = await db.execute(fuzzy_stmt)
+        users.extend(result.scalars().all())
+        return users[:limit]
+
+    @staticmethod
+    async def list_users(
+        db: AsyncSession,
+        search: str = None,
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """管理员用户列表，带搜索时按相关度排序（偏移游标），否则按 (created_at, id) 键集分页
+
+        Returns:
+            Dict: {"users": 当前页, "total": 总数（近似）, "next_cursor": 下一页游标}
+        """
+        conditions = []
+        if search:
+            columns = [User.username, User.email, User.full_name]
+            conditions.append(text_match(db, columns, search))
+            paginator = Paginator(
+                [
+                    (match_rank(db, columns, search), True),
+                    (User.created_at, True),
+                    (User.id, True),
+                ],
+                cursor, limit, skip, keyset=False
+            )
+        else:
+            paginator = Paginator([(User.created_at, True), (User.id, True)], cursor, limit, skip)
+
+        result = await db.execute(paginator.apply(select(User).where(*conditions)))
+        users, next_cursor = paginator.page(result.scalars().all())
+        total = await count_cache.count(db, select(func.count(User.id)).where(*conditions))
+        return {"users": users, "total": total, "next_cursor": next_cursor}
+
+
+search_service = SearchService()
@@ -2,79 +2,166 @@ import json
 import asyncio
 import hashlib
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+import time
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime, timedelta
 
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import Base
 from .document_service import DocumentService
 from app.models.database import Document, DocumentVersion
+from app.services.retrieval_service import retrieval_service
+from app.services.collaboration_bus import collaboration_bus
+from app.services.document_cache import document_cache
+from app.services.document_search_service import document_search_service
+from app.services.hot_documents import HotDocument, HotDocumentCache
+from app.services.lease_manager import Lease, LeaseTimeout, lease_manager
+from app.services.rope import Rope
+from app.services import ot
+from app.services.ot import OTError
+from app.services.version_store import version_store
 
 logger = logging.getLogger(__name__)
 
+BATCH_OPERATION_TYPES = ("insert", "delete", "replace", "full_update")
+# 可以与并发操作变换的位置操作（整篇替换之后的操作无法变换）
+TRANSFORMABLE_TYPES = ("insert", "delete", "replace")
+
 class ShareDBService:
     """ShareDB 协作服务 - 使用 HTTP 接口实现文档同步"""
     
     def __init__(self, mongo_url: str = "mongodb://localhost:27017", db_name: str = "nexcode_sharedb"):
-        """初始化 ShareDB 服务"""
-        self.mongo_client = MongoClient(mongo_url)
+        """初始化 ShareDB 服务（不在此处连接，索引在应用启动时创建）"""
+        # timeoutMS 为每个操作的超时时间（含服务器选择和网络往返）
+        self.mongo_client = AsyncIOMotorClient(
+            mongo_url,
+            maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            timeoutMS=settings.MONGODB_OPERATION_TIMEOUT_MS,
+        )
         self.db = self.mongo_client[db_name]
-        self.documents: Collection = self.db.documents
-        self.operations: Collection = self.db.operations
-        
-        # 文档锁，防止并发冲突
-        self.doc_locks: Dict[str, asyncio.Lock] = {}
+        self.documents: AsyncIOMotorCollection = self.db.documents
+        self.operations: AsyncIOMotorCollection = self.db.operations
+        # 每个文档保留最新一份快照，compacted_through 之前的操作可能已被清理
+        self.snapshots: AsyncIOMotorCollection = self.db.snapshots
         
-        # 创建索引
-        self._create_indexes()
+        self._index_task: Optional[asyncio.Task] = None
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._compaction_wakeup = asyncio.Event()
+        # 正在编辑的文档缓冲，整篇内容异步写回
+        self.hot_documents = HotDocumentCache()
+        self._hot_flush_task: Optional[asyncio.Task] = None
+        self.compaction_status: Dict[str, Any] = {
+            "running": False,
+            "runs": 0,
+            "started_at": None,
+            "finished_at": None,
+            "duration_seconds": None,
+            "docs_scanned": 0,
+            "docs_compacted": 0,
+            "snapshots_taken": 0,
+            "operations_removed": 0,
+            "total_operations_removed": 0,
+            "last_error": None,
+        }
+        # 同步请求统计：全量、增量、增量校验失败回退全量
+        self.sync_metrics = {"full": 0, "delta": 0, "delta_fallbacks": 0}
+    
+    def start(self):
+        """应用启动时在后台创建索引并启动操作日志压缩任务，MongoDB 不可用时不阻塞启动"""
+        if self._index_task is None:
+            self._index_task = asyncio.create_task(self.create_indexes())
+        if self._compaction_task is None:
+            self._compaction_task = asyncio.create_task(self._compaction_worker())
+        if self._hot_flush_task is None:
+            self._hot_flush_task = asyncio.create_task(self._hot_flush_worker())
     
-    def _create_indexes(self):
+    async def create_indexes(self):
         """创建必要的索引"""
         try:
-            # 文档集合索引
-            self.documents.create_index("doc_id", unique=True)
-            self.documents.create_index("version")
-            
-            # 操作集合索引
-            self.operations.create_index([("doc_id", 1), ("version", 1)])
-            self.operations.create_index("timestamp")
+            await asyncio.gather(
+                # 文档集合索引
+                self.documents.create_index("doc_id", unique=True),
+                self.documents.create_index("version"),
+                # 操作集合索引（唯一：同一版本只能写入一次，租约过期的 worker 无法覆盖）
+                self.operations.create_index([("doc_id", 1), ("version", 1)], unique=True),
+                self.operations.create_index("timestamp"),
+                # 快照集合索引
+                self.snapshots.create_index("doc_id", unique=True),
+            )
+            logger.info("ShareDB indexes ready")
         except Exception as e:
             logger.warning(f"Failed to create indexes: {e}")
     
-    def _get_doc_lock(self, doc_id: str) -> asyncio.Lock:
-        """获取文档锁"""
-        if doc_id not in self.doc_locks:
-            self.doc_locks[doc_id] = asyncio.Lock()
-        return self.doc_locks[doc_id]
+    @staticmethod
+    def _error(e: Exception, detail: str) -> HTTPException:
+        """MongoDB 超时返回 503，其他错误返回 500"""
+        if isinstance(e, HTTPException):
+            return e
+        if isinstance(e, PyMongoError) and e.timeout:
+            return HTTPException(status_code=503, detail=f"{detail}: ShareDB timeout")
+        if isinstance(e, LeaseTimeout):
+            return HTTPException(status_code=503, detail=f"{detail}: document is busy")
+        return HTTPException(status_code=500, detail=detail)
+    
+    @staticmethod
+    def _lease_key(doc_id: str) -> str:
+        return f"sharedb:{doc_id}"
     
-    async def get_document(self, doc_id: str) -> Dict[str, Any]:
-        """获取文档当前状态，确保返回最新版本"""
+    def _doc_lease(self, doc_id: str):
+        """文档租约：所有修改路径在租约内进行，跨 worker 互斥"""
+        return lease_manager.lease(self._lease_key(doc_id))
+    
+    @staticmethod
+    def _fence(query: Dict[str, Any], lease: Lease) -> Dict[str, Any]:
+        """写入条件附加 fencing token：已被更新的 token 写过的文档拒绝旧持有者的写入"""
+        if not lease.distributed:
+            return query
+        return {
+            **query,
+            "$or": [{"lease_token": {"$exists": False}}, {"lease_token": {"$lte": lease.token}}]
+        }
+    
+    async def get_document(self, doc_id: str, create: bool = True) -> Optional[Dict[str, Any]]:
+        """获取文档当前状态，确保返回最新版本；create 为 False 时文档不存在返回 None"""
         try:
-            # 使用排序确保获取最新状态
-            doc = self.documents.find_one(
+            hot = self.hot_documents.get(doc_id)
+            if hot is not None and await self._is_current(hot):
+                return hot.to_dict()
+            
+            # 其他 worker 的缓冲可能尚未写回，读取存储后重放之后的操作
+            current = await self._read_document(doc_id)
+            if current is not None:
+                return current.to_dict()
+            if not create:
+                return None
+            
+            # 检查是否应该从 PostgreSQL 同步内容
+            # 这里我们原子地创建一个空文档，让调用方决定是否同步
+            now = datetime.utcnow()
+            doc = await self.documents.find_one_and_update(
                 {"doc_id": doc_id},
-                sort=[("updated_at", -1)]  # 按更新时间降序排列
+                {
+                    "$setOnInsert": {
+                        "content": "",
+                        "version": 0,
+                        "created_at": now,
+                        "updated_at": now,
+                        "last_editor_id": None
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
-            
-            if not doc:
-                # 检查是否应该从 PostgreSQL 同步内容
-                # 这里我们创建一个空文档，让调用方决定是否同步
-                doc = {
-                    "doc_id": doc_id,
-                    "content": "",
-                    "version": 0,
-                    "created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow(),
-                    "last_editor_id": None
-                }
-                result = self.documents.insert_one(doc)
-                doc["_id"] = result.inserted_id
-                logger.info(f"Created new empty document {doc_id} in ShareDB")
+            logger.info(f"Created new empty document {doc_id} in ShareDB")
             
             return {
                 "doc_id": doc["doc_id"],
@@ -82,32 +169,49 @@ class ShareDBService:
                 "version": doc["version"],
                 "created_at": doc["created_at"].isoformat(),
                 "updated_at": doc["updated_at"].isoformat(),
-                "last_editor_id": doc.get("last_editor_id")
+                "last_editor_id": doc.get("last_editor_id"),
+                "content_hash": hashlib.sha256(doc["content"].encode()).hexdigest()
             }
         except Exception as e:
             logger.error(f"Failed to get document {doc_id}: {e}")
-            raise HTTPException(status_code=500, detail="Failed to get document")
-    
-    async def apply_operation(self, doc_id: str, operation: Dict[str, Any], user_id: int) -> Dict[str, Any]:
-        """应用操作到文档"""
-        lock = self._get_doc_lock(doc_id)
-        async with lock:
-            try:
+            raise self._error(e, "Failed to get document")
+
+    async def get_contents(self, doc_ids: List[str]) -> Dict[str, str]:
+        """批量读取文档内容（用于建立索引）：本 worker 的热缓冲优先，其余一次查询读取存储；
+        不存在的文档不会被创建，也不会出现在结果中"""
+        contents: Dict[str, str] = {}
+        stored_ids = []
+        for doc_id in doc_ids:
+            hot = self.hot_documents.documents.get(doc_id)
+            if hot is not None:
+                contents[doc_id] = str(hot.rope)
+            else:
+                stored_ids.append(doc_id)
+        if stored_ids:
+            cursor = self.documents.find(
+                {"doc_id": {"$in": stored_ids}}, {"doc_id": 1, "content": 1}
+            )
+            async for doc in cursor:
+                contents[doc["doc_id"]] = doc.get("content") or ""
+        return contents
+
+    async def apply_operation(self, doc_id: str, operation: Dict[str, Any], user_id: int,
+                              return_content: bool = True) -> Dict[str, Any]:
+        """应用操作到文档（作用于内存缓冲，整篇内容异步写回）"""
+        try:
+            async with self._doc_lease(doc_id) as lease:
                 # 获取当前文档
-                current_doc = self.documents.find_one({"doc_id": doc_id})
-                if not current_doc:
+                hot = await self._hot_document(doc_id, lease)
+                if hot is None:
                     raise HTTPException(status_code=404, detail="Document not found")
                 
                 # 验证版本
                 client_version = operation.get("version", 0)
-                current_version = current_doc["version"]
+                current_version = hot.version
                 
                 if client_version < current_version:
                     # 需要获取缺失的操作
-                    missing_ops = list(self.operations.find({
-                        "doc_id": doc_id,
-                        "version": {"$gt": client_version}
-                    }).sort("version", 1))
+                    missing_ops = await self._find_operations_since(doc_id, client_version)
                     
                     return {
                         "success": False,
@@ -116,23 +220,23 @@ class ShareDBService:
                         "missing_operations": [self._serialize_operation(op) for op in missing_ops]
                     }
                 
-                # 应用操作
-                new_content = self._apply_text_operation(current_doc["content"], operation)
-                new_version = current_version + 1
-                
-                # 更新文档
-                self.documents.update_one(
-                    {"doc_id": doc_id},
-                    {
-                        "$set": {
-                            "content": new_content,
-                            "version": new_version,
-                            "updated_at": datetime.utcnow()
-                        }
+                if operation.get("type") not in BATCH_OPERATION_TYPES:
+                    raise HTTPException(status_code=400, detail=f"Unsupported operation type: {operation.get('type')}")
+                if operation["type"] == "full_update" and not isinstance(operation.get("content"), str):
+                    raise HTTPException(status_code=400, detail="full_update requires content")
+                # 记录实际应用的（截断后的）操作，之后按历史计算长度和变换时与缓冲一致
+                applied = self._clamp_operations([operation], len(hot.rope))
+                if not applied:
+                    return {
+                        "success": True,
+                        "version": current_version,
+                        "content": str(hot.rope) if return_content else None,
+                        "operation_id": None
                     }
-                )
+                operation = {**applied[0], "version": client_version}
                 
-                # 保存操作记录
+                # 先持久化操作记录（写回前崩溃时可据此重放），再修改缓冲
+                new_version = current_version + 1
                 op_record = {
                     "doc_id": doc_id,
                     "version": new_version,
@@ -140,19 +244,177 @@ class ShareDBService:
                     "user_id": user_id,
                     "timestamp": datetime.utcnow()
                 }
-                self.operations.insert_one(op_record)
+                if not await self._insert_operations(doc_id, [op_record]):
+                    # 重新加载后按版本冲突处理，客户端应用缺失的操作后重试
+                    hot = await self._hot_document(doc_id, lease)
+                    if hot is None:
+                        raise HTTPException(status_code=404, detail="Document not found")
+                    missing_ops = await self._find_operations_since(doc_id, client_version)
+                    return {
+                        "success": False,
+                        "error": "version_mismatch",
+                        "current_version": hot.version,
+                        "missing_operations": [self._serialize_operation(op) for op in missing_ops]
+                    }
+                
+                self._apply_rope_operation(hot.rope, operation)
+                hot.version = new_version
+                hot.mark_dirty(user_id)
+                self._content_changed(doc_id)
                 
                 return {
                     "success": True,
                     "version": new_version,
-                    "content": new_content,
+                    "content": str(hot.rope) if return_content else None,
                     "operation_id": str(op_record["_id"])
                 }
                 
-            except Exception as e:
-                logger.error(f"Failed to apply operation to {doc_id}: {e}")
-                raise HTTPException(status_code=500, detail="Failed to apply operation")
-    
+        except Exception as e:
+            logger.error(f"Failed to apply operation to {doc_id}: {e}")
+            raise self._error(e, "Failed to apply operation")
+
+    async def apply_operations(self, doc_id: str, base_version: int, operations: List[Dict[str, Any]],
+                               user_id: int, return_content: bool = False) -> Dict[str, Any]:
+        """批量应用基于 base_version 的一组有序操作：一次加锁、一次 insert_many，
+        base_version 落后时先把这组操作变换到已提交的操作之后"""
+        try:
+            async with self._doc_lease(doc_id) as lease:
+                hot = await self._hot_document(doc_id, lease)
+                if hot is None:
+                    raise HTTPException(status_code=404, detail="Document not found")
+                result = await self._apply_operations_locked(hot, base_version, operations, user_id)
+                if result["success"]:
+                    result["content"] = str(hot.rope) if return_content else None
+                return result
+
+        except Exception as e:
+            logger.error(f"Failed to apply operation batch to {doc_id}: {e}")
+            raise self._error(e, "Failed to apply operations")
+
+    async def _apply_operations_locked(self, hot: HotDocument, base_version: int,
+                                       operations: List[Dict[str, Any]], user_id: int,
+                                       base_length: Optional[int] = None) -> Dict[str, Any]:
+        """批量应用操作（调用方需持有租约）；给出 base_length 时操作必须恰好作用于基准版本的内容"""
+        doc_id = hot.doc_id
+        if base_version > hot.version:
+            raise HTTPException(status_code=400, detail="Base version is ahead of the document")
+        for op in operations:
+            if op.get("type") not in BATCH_OPERATION_TYPES:
+                raise HTTPException(status_code=400, detail=f"Unsupported operation type: {op.get('type')}")
+            if op["type"] == "full_update" and not isinstance(op.get("content"), str):
+                raise HTTPException(status_code=400, detail="full_update requires content")
+
+        remote_operations: List[Dict[str, Any]] = []
+        history_ops: List[Dict[str, Any]] = []
+        if base_version < hot.version:
+            history = await self._find_operations_since(doc_id, base_version)
+            history_ops = [record.get("operation") for record in history]
+            # 整篇替换（同步、恢复版本、快照）之后的操作无法变换，客户端需重新同步
+            if not all(op and op.get("type") in TRANSFORMABLE_TYPES for op in history_ops):
+                return {
+                    "success": False,
+                    "error": "resync_required",
+                    "current_version": hot.version
+                }
+        # 基准版本的长度 = 当前长度减去其后各操作带来的长度变化
+        expected = len(hot.rope) - sum(self._length_change(op) for op in history_ops)
+        if base_length is not None and base_length != expected:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Delta base length {base_length} does not match version {base_version} ({expected})"
+            )
+        try:
+            operations = self._clamp_operations(operations, expected)
+            if base_version < hot.version:
+                full_updates = [i for i, op in enumerate(operations) if op["type"] == "full_update"]
+                if full_updates:
+                    # 整篇替换之后的操作不依赖旧内容，之前的操作被覆盖
+                    operations = operations[full_updates[-1]:]
+                else:
+                    operations, remote_operations = self._transform_operations(operations, history_ops)
+        except OTError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid operation: {e}")
+
+        # 生成操作记录
+        records = []
+        version = hot.version
+        now = datetime.utcnow()
+        for operation in operations:
+            version += 1
+            records.append({
+                "doc_id": doc_id,
+                "version": version,
+                "operation": {**operation, "version": version - 1},
+                "user_id": user_id,
+                "timestamp": now
+            })
+
+        if records:
+            # 先持久化操作记录，再修改缓冲
+            if not await self._insert_operations(doc_id, records):
+                return {
+                    "success": False,
+                    "error": "resync_required",
+                    "current_version": hot.version
+                }
+            for record in records:
+                self._apply_rope_operation(hot.rope, record["operation"])
+            hot.version = version
+            hot.mark_dirty(user_id)
+            self._content_changed(doc_id)
+
+        return {
+            "success": True,
+            "version": hot.version,
+            "applied": len(records),
+            "operations": [record["operation"] for record in records],
+            "remote_operations": remote_operations
+        }
+
+    @staticmethod
+    def _clamp_operations(operations: List[Dict[str, Any]], length: int) -> List[Dict[str, Any]]:
+        """把位置操作依次截断到文档范围内（与应用时的截断一致），去掉空操作"""
+        result = []
+        for operation in operations:
+            if operation["type"] == "full_update":
+                result.append(operation)
+                length = len(operation["content"])
+                continue
+            position = min(max(0, int(operation.get("position", 0))), length)
+            size = 0
+            if operation["type"] != "insert":
+                size = min(max(0, int(operation.get("length", 0))), length - position)
+            text = operation.get("text", "") if operation["type"] != "delete" else ""
+            for clamped in ot.to_legacy(ot.normalize([position, -size, text])):
+                result.append(clamped)
+                length += ShareDBService._length_change(clamped)
+        return result
+
+    @staticmethod
+    def _transform_operations(operations: List[Dict[str, Any]],
+                              history_ops: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """把基于同一版本的两组位置操作互相变换：返回 (operations 在 history_ops 之后的形式,
+        history_ops 在 operations 之后的形式)；同一位置插入时已提交的 history_ops 在前"""
+        remote = [ot.from_legacy(op) for op in history_ops]
+        transformed = []
+        for operation in operations:
+            op = ot.from_legacy(operation)
+            remote_next = []
+            for concurrent in remote:
+                concurrent, op = ot.transform(concurrent, op)
+                remote_next.append(concurrent)
+            transformed.append(op)
+            remote = remote_next
+        return (
+            [legacy for op in transformed for legacy in ot.to_legacy(op)],
+            [legacy for op in remote for legacy in ot.to_legacy(op)],
+        )
+
+    @staticmethod
+    def _length_change(operation: Dict[str, Any]) -> int:
+        """位置操作带来的文档长度变化（按码点计）"""
+        return len(operation.get("text", "")) - operation.get("length", 0)
+
     def _apply_text_operation(self, content: str, operation: Dict[str, Any]) -> str:
         """应用文本操作"""
         op_type = operation.get("type")
@@ -180,53 +442,402 @@ class ShareDBService:
             logger.warning(f"Unknown operation type: {op_type}")
             return content
     
+    def _apply_rope_operation(self, rope: Rope, operation: Dict[str, Any]):
+        """在 Rope 上应用文本操作，语义与 _apply_text_operation 相同"""
+        op_type = operation.get("type")
+        position = operation.get("position", 0)
+        
+        if op_type == "insert":
+            rope.insert(position, operation.get("text", ""))
+        elif op_type == "delete":
+            rope.delete(position, operation.get("length", 0))
+        elif op_type == "replace":
+            rope.replace(position, operation.get("length", 0), operation.get("text", ""))
+        elif op_type == "full_update":
+            if "content" in operation:
+                rope.set(operation["content"])
+        else:
+            logger.warning(f"Unknown operation type: {op_type}")
+    
+    # ---- 热文档缓冲 ----
+    
+    async def _read_document(self, doc_id: str) -> Optional[HotDocument]:
+        """读取存储中的文档并重放之后已记录的操作（其他 worker 或本进程尚未写回的修改）"""
+        doc = await self.documents.find_one({"doc_id": doc_id})
+        if not doc:
+            return None
+        hot = HotDocument(doc)
+        
+        tail = await self._find_operations_since(doc_id, hot.version)
+        for record in tail:
+            if "operation" in record and record["operation"] is not None:
+                self._apply_rope_operation(hot.rope, record["operation"])
+            elif "content" in record:
+                hot.rope.set(record["content"])
+            hot.version = record["version"]
+        if tail:
+            hot.mark_dirty(tail[-1].get("user_id"))
+        return hot
+    
+    @staticmethod
+    def _lease_continues(hot: HotDocument, lease: Lease) -> bool:
+        """缓冲取得后是否没有其他 worker 持有过租约（token 未跳号）"""
+        if not lease.distributed:
+            return True
+        return hot.lease_token is not None and lease.token in (hot.lease_token, hot.lease_token + 1)
+    
+    async def _is_current(self, hot: HotDocument) -> bool:
+        """不加租约的读取：缓冲之后没有发放过新的 token 才认为是最新的"""
+        if not lease_manager.enabled:
+            return True
+        return await lease_manager.current_token(self._lease_key(hot.doc_id)) == hot.lease_token
+    
+    async def _hot_document(self, doc_id: str, lease: Lease) -> Optional[HotDocument]:
+        """取得文档缓冲（调用方需持有租约）；缓冲可能已被其他 worker 的修改取代时重新加载"""
+        hot = self.hot_documents.get(doc_id)
+        if hot is not None and not self._lease_continues(hot, lease):
+            self.hot_documents.discard(doc_id)
+            hot = None
+        if hot is None:
+            hot = await self._read_document(doc_id)
+            if hot is None:
+                return None
+            self.hot_documents.put(hot)
+        hot.lease_token = lease.token
+        return hot
+    
+    async def _insert_operations(self, doc_id: str, records: List[Dict[str, Any]]) -> bool:
+        """写入操作记录；版本已存在说明持有更新 token 的 worker 写过，丢弃缓冲并返回 False"""
+        try:
+            if len(records) == 1:
+                await self.operations.insert_one(records[0])
+            else:
+                await self.operations.insert_many(records, ordered=True)
+            return True
+        except (DuplicateKeyError, BulkWriteError) as e:
+            if isinstance(e, BulkWriteError) and any(
+                error.get("code") != 11000 for error in e.details.get("writeErrors", [])
+            ):
+                raise
+        logger.warning(f"Operation log of {doc_id} was fenced off, discarding buffer")
+        self.hot_documents.discard(doc_id)
+        self.hot_documents.metrics["fenced_writes"] += 1
+        return False
+    
+    async def _write_document(self, doc_id: str, fields: Dict[str, Any], lease: Lease,
+                              record: Dict[str, Any]) -> bool:
+        """整篇写入文档（调用方已写入对应的操作记录）；写入失败时删除该记录，
+        避免操作日志中留下从未生效的整篇替换。被 fencing 拒绝时丢弃缓冲并返回 False"""
+        try:
+            await self.documents.update_one(
+                self._fence({"doc_id": doc_id}, lease), {"$set": fields}, upsert=True
+            )
+            return True
+        except Exception as e:
+            try:
+                await self.operations.delete_one({"_id": record["_id"]})
+            except Exception as delete_error:
+                logger.error(f"Failed to remove operation v{record['version']} of {doc_id}: {delete_error}")
+            if not isinstance(e, DuplicateKeyError):
+                raise
+        # 未匹配 fencing 条件时 upsert 插入新文档，与已有文档的 doc_id 唯一索引冲突
+        logger.warning(f"Document {doc_id} was fenced off, discarding buffer")
+        self.hot_documents.discard(doc_id)
+        self.hot_documents.metrics["fenced_writes"] += 1
+        return False
+    
+    async def _flush_hot_document(self, hot: HotDocument, lease: Lease):
+        """把缓冲内容写回存储（调用方需持有租约）"""
+        if not hot.dirty:
+            return
+        content = str(hot.rope)
+        fields = {
+            "content": content,
+            "version": hot.version,
+            "updated_at": hot.updated_at,
+            "last_editor_id": hot.last_editor_id
+        }
+        if lease.distributed:
+            fields["lease_token"] = lease.token
+        try:
+            result = await self.documents.update_one(
+                self._fence({"doc_id": hot.doc_id}, lease), {"$set": fields}
+            )
+        except Exception as e:
+            self.hot_documents.metrics["flush_failures"] += 1
+            logger.error(f"Failed to flush hot document {hot.doc_id}: {e}")
+            return
+        if not result.matched_count:
+            # 文档已被删除或由持有更新 token 的 worker 写过，缓冲作废
+            logger.warning(f"Hot document {hot.doc_id} was fenced off, discarding buffer")
+            self.hot_documents.discard(hot.doc_id)
+            return
+        hot.mark_clean()
+        self.hot_documents.metrics["flushes"] += 1
+        self._index_content(hot.doc_id, content)
+        await self._publish_content_change(hot.doc_id)
+    
+    async def flush_hot_documents(self, force: bool = False):
+        """写回到期的脏文档，并回收空闲缓冲"""
+        for hot in self.hot_documents.due_for_flush(force):
+            try:
+                async with self._doc_lease(hot.doc_id) as lease:
+                    if self.hot_documents.documents.get(hot.doc_id) is not hot:
+                        continue
+                    if not self._lease_continues(hot, lease):
+                        # 其他 worker 修改过，操作日志里已有全部操作，直接丢弃
+                        self.hot_documents.discard(hot.doc_id)
+                        continue
+                    hot.lease_token = lease.token
+                    await self._flush_hot_document(hot, lease)
+            except LeaseTimeout as e:
+                logger.warning(f"Skipped flushing {hot.doc_id}: {e}")
+        self.hot_documents.evict(lambda doc_id: lease_manager.is_busy(self._lease_key(doc_id)))
+    
+    async def _hot_flush_worker(self):
+        interval = max(0.1, settings.SHAREDB_HOT_FLUSH_DEBOUNCE / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_hot_documents()
+            except Exception as e:
+                logger.error(f"Hot document flush worker error: {e}")
+    
+    @staticmethod
+    def _content_changed(doc_id: str):
+        """本 worker 修改了缓冲内容：作废文档快照缓存中的内容"""
+        if doc_id.isdigit():
+            document_cache.content_changed(int(doc_id))
+    
+    @staticmethod
+    async def _publish_content_change(doc_id: str):
+        """内容已写入存储：通知所有 worker 作废文档快照缓存中的内容"""
+        if doc_id.isdigit():
+            await document_cache.invalidate_content(int(doc_id))
+    
+    def _index_content(self, doc_id: str, content: str):
+        """通知检索和搜索服务文档内容已更新"""
+        if doc_id.isdigit():
+            retrieval_service.index_document(int(doc_id), content)
+            document_search_service.index_document(int(doc_id), content)
+    
     def _serialize_operation(self, op_record: Dict[str, Any]) -> Dict[str, Any]:
-        """序列化操作记录"""
-        return {
+        """序列化操作记录（sync / version_restore / snapshot 记录携带完整内容）"""
+        serialized = {
             "doc_id": op_record["doc_id"],
             "version": op_record["version"],
-            "operation": op_record["operation"],
-            "user_id": op_record["user_id"],
+            "operation": op_record.get("operation"),
+            "user_id": op_record.get("user_id"),
             "timestamp": op_record["timestamp"].isoformat()
         }
+        if "operation_type" in op_record:
+            serialized["operation_type"] = op_record["operation_type"]
+        if "content" in op_record:
+            serialized["content"] = op_record["content"]
+        return serialized
+    
+    @staticmethod
+    async def _reset_collaboration(doc_id: str, content: str):
+        """整篇替换后让 WebSocket 协作的共享状态从新内容重新开始"""
+        if doc_id.isdigit():
+            await collaboration_bus.reset_document(int(doc_id), content)
+    
+    async def _find_operations_since(self, doc_id: str, since_version: int) -> List[Dict[str, Any]]:
+        """获取 since_version 之后的操作；所需操作已被压缩时返回快照加其后的操作"""
+        cursor = self.operations.find({
+            "doc_id": doc_id,
+            "version": {"$gt": since_version}
+        }).sort("version", 1)
+        operations = await cursor.to_list(length=None)
+        
+        # 操作连续时无需查快照
+        if operations and operations[0]["version"] == since_version + 1:
+            return operations
+        
+        snapshot = await self.snapshots.find_one({"doc_id": doc_id})
+        if not snapshot or snapshot.get("compacted_through", 0) <= since_version:
+            return operations
+        
+        # 快照之后的操作从不被清理，快照加尾部重放即可得到完整状态
+        snapshot_record = {
+            "doc_id": doc_id,
+            "version": snapshot["version"],
+            "operation_type": "snapshot",
+            "content": snapshot["content"],
+            "timestamp": snapshot["created_at"],
+        }
+        return [snapshot_record] + [op for op in operations if op["version"] > snapshot["version"]]
     
     async def get_operations_since(self, doc_id: str, since_version: int) -> List[Dict[str, Any]]:
         """获取指定版本之后的所有操作"""
         try:
-            operations = list(self.operations.find({
-                "doc_id": doc_id,
-                "version": {"$gt": since_version}
-            }).sort("version", 1))
-            
+            operations = await self._find_operations_since(doc_id, since_version)
             return [self._serialize_operation(op) for op in operations]
         except Exception as e:
             logger.error(f"Failed to get operations for {doc_id}: {e}")
-            raise HTTPException(status_code=500, detail="Failed to get operations")
+            raise self._error(e, "Failed to get operations")
+    
+    async def take_snapshot(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """把文档当前内容保存为快照（每个文档只保留最新一份）"""
+        async with self._doc_lease(doc_id) as lease:
+            hot = self.hot_documents.get(doc_id)
+            if hot is not None and self._lease_continues(hot, lease):
+                hot.lease_token = lease.token
+                await self._flush_hot_document(hot, lease)
+            doc = await self.documents.find_one({"doc_id": doc_id}, {"content": 1, "version": 1})
+            if not doc:
+                return None
+            snapshot = {
+                "version": doc["version"],
+                "content": doc["content"],
+                "created_at": datetime.utcnow(),
+            }
+            return await self.snapshots.find_one_and_update(
+                {"doc_id": doc_id},
+                {"$set": snapshot, "$setOnInsert": {"compacted_through": 0}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+    
+    async def compact_document(self, doc_id: str, snapshot: Dict[str, Any]) -> int:
+        """清理快照之前、超出保留条数或保留时长的操作，返回删除数量"""
+        snapshot_version = snapshot["version"]
+        age_cutoff = datetime.utcnow() - timedelta(seconds=settings.SHAREDB_OPLOG_RETAIN_SECONDS)
+        result = await self.operations.delete_many({
+            "doc_id": doc_id,
+            "version": {"$lte": snapshot_version},
+            "$or": [
+                {"version": {"$lte": snapshot_version - settings.SHAREDB_OPLOG_RETAIN_OPS}},
+                {"timestamp": {"$lt": age_cutoff}},
+            ],
+        })
+        if not result.deleted_count:
+            return 0
+        
+        # 记录已被清理到的版本，get_operations_since 据此决定是否回退到快照
+        oldest = await self.operations.find_one(
+            {"doc_id": doc_id}, {"version": 1}, sort=[("version", 1)]
+        )
+        if oldest and oldest["version"] <= snapshot_version:
+            compacted_through = oldest["version"] - 1
+        else:
+            compacted_through = snapshot_version
+        await self.snapshots.update_one(
+            {"doc_id": doc_id},
+            {"$max": {"compacted_through": compacted_through}}
+        )
+        return result.deleted_count
+    
+    def _needs_snapshot(self, doc: Dict[str, Any], snapshot: Optional[Dict[str, Any]]) -> bool:
+        if not snapshot:
+            return doc["version"] > 0
+        behind = doc["version"] - snapshot["version"]
+        if behind >= settings.SHAREDB_SNAPSHOT_EVERY_OPS:
+            return True
+        age = (datetime.utcnow() - snapshot["created_at"]).total_seconds()
+        return behind > 0 and age >= settings.SHAREDB_SNAPSHOT_INTERVAL
+    
+    async def run_compaction(self) -> Dict[str, Any]:
+        """扫描所有文档：需要时生成快照，并压缩快照之前的操作"""
+        status = self.compaction_status
+        if status["running"]:
+            return status
+        status.update(
+            running=True,
+            started_at=datetime.utcnow().isoformat(),
+            finished_at=None,
+            duration_seconds=None,
+            docs_scanned=0,
+            docs_compacted=0,
+            snapshots_taken=0,
+            operations_removed=0,
+            last_error=None,
+        )
+        started = time.monotonic()
+        batch_size = settings.SHAREDB_COMPACTION_BATCH_SIZE
+        try:
+            # 按 doc_id 分页，每批一个短查询，避免长游标超出单次操作超时
+            last_doc_id = None
+            while True:
+                query = {"doc_id": {"$gt": last_doc_id}} if last_doc_id is not None else {}
+                cursor = self.documents.find(query, {"doc_id": 1, "version": 1}).sort("doc_id", 1)
+                docs = await cursor.to_list(length=batch_size)
+                if not docs:
+                    break
+                last_doc_id = docs[-1]["doc_id"]
+                snapshots = {
+                    snapshot["doc_id"]: snapshot
+                    async for snapshot in self.snapshots.find(
+                        {"doc_id": {"$in": [doc["doc_id"] for doc in docs]}},
+                        {"content": 0}
+                    )
+                }
+                for doc in docs:
+                    snapshot = snapshots.get(doc["doc_id"])
+                    if self._needs_snapshot(doc, snapshot):
+                        snapshot = await self.take_snapshot(doc["doc_id"])
+                        status["snapshots_taken"] += 1
+                    if snapshot:
+                        removed = await self.compact_document(doc["doc_id"], snapshot)
+                        if removed:
+                            status["docs_compacted"] += 1
+                            status["operations_removed"] += removed
+                            status["total_operations_removed"] += removed
+                status["docs_scanned"] += len(docs)
+                logger.info(
+                    f"ShareDB compaction progress: {status['docs_scanned']} docs scanned, "
+                    f"{status['snapshots_taken']} snapshots, {status['operations_removed']} ops removed"
+                )
+        except Exception as e:
+            status["last_error"] = str(e)
+            logger.error(f"ShareDB compaction failed: {e}")
+        finally:
+            status["running"] = False
+            status["runs"] += 1
+            status["finished_at"] = datetime.utcnow().isoformat()
+            status["duration_seconds"] = round(time.monotonic() - started, 3)
+        return status
+    
+    def trigger_compaction(self):
+        """立即唤醒压缩任务"""
+        self._compaction_wakeup.set()
+    
+    async def _compaction_worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._compaction_wakeup.wait(), timeout=settings.SHAREDB_COMPACTION_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._compaction_wakeup.clear()
+            await self.run_compaction()
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "compaction": dict(self.compaction_status),
+            "hot_documents": self.hot_documents.get_metrics(),
+            "sync": dict(self.sync_metrics),
+        }
     
     async def sync_document(self, doc_id: str, version: int, content: str, 
                            user_id: int, create_version: bool = False, db_session: AsyncSession = None) -> dict:
         """同步文档到ShareDB，可选创建PostgreSQL版本快照"""
-        lock = self._get_doc_lock(doc_id)
-        async with lock:
-            try:
-                # ShareDB 版本号始终递增（用于协作同步检测）
-                new_sharedb_version = version + 1
-                
-                # 1. 更新 ShareDB (MongoDB) 中的文档内容
-                result = self.documents.update_one(
-                    {"doc_id": doc_id},
-                    {
-                        "$set": {
-                            "content": content,
-                            "version": new_sharedb_version,  # ShareDB 版本总是递增
-                            "updated_at": datetime.utcnow(),
-                            "last_editor_id": user_id
-                        }
-                    },
-                    upsert=True
-                )
+        try:
+            async with self._doc_lease(doc_id) as lease:
+                # ShareDB 版本号始终递增（用于协作同步检测），客户端版本落后时接在当前版本之后
+                hot = await self._hot_document(doc_id, lease)
+                new_sharedb_version = max(version, hot.version if hot is not None else 0) + 1
+                fields = {
+                    "content": content,
+                    "version": new_sharedb_version,  # ShareDB 版本总是递增
+                    "updated_at": datetime.utcnow(),
+                    "last_editor_id": user_id
+                }
+                if lease.distributed:
+                    fields["lease_token"] = lease.token
                 
-                # 2. 记录操作历史
+                # 1. 记录操作历史（版本已被占用时不覆盖文档）
                 operation = {
                     "doc_id": doc_id,
                     "version": new_sharedb_version,
@@ -235,7 +846,34 @@ class ShareDBService:
                     "timestamp": datetime.utcnow(),
                     "operation_type": "sync"
                 }
-                self.operations.insert_one(operation)
+                if not await self._insert_operations(doc_id, [operation]):
+                    return {
+                        "success": False,
+                        "error": "Document was modified concurrently, please resync",
+                        "content": content,
+                        "version": version,
+                        "operations": []
+                    }
+                
+                # 2. 更新 ShareDB (MongoDB) 中的文档内容（失败时撤回操作记录）
+                if not await self._write_document(doc_id, fields, lease, operation):
+                    return {
+                        "success": False,
+                        "error": "Document was modified concurrently, please resync",
+                        "content": content,
+                        "version": version,
+                        "operations": []
+                    }
+                if hot is not None:
+                    hot.reset(content, new_sharedb_version, user_id)
+                    hot.lease_token = lease.token
+                    content_hash = hot.content_hash()
+                else:
+                    content_hash = hashlib.sha256(content.encode()).hexdigest()
+                self._index_content(doc_id, content)
+                await self._publish_content_change(doc_id)
+                await self._reset_collaboration(doc_id, content)
+                self.sync_metrics["full"] += 1
                 
                 # 3. 可选：在PostgreSQL中创建版本快照（用于长期存储和恢复）
                 if create_version and db_session:
@@ -249,17 +887,78 @@ class ShareDBService:
                     "success": True,
                     "content": content,
                     "version": new_sharedb_version,  # 返回新的 ShareDB 版本号
-                    "operations": []
+                    "operations": [],
+                    "content_hash": content_hash
                 }
-            except Exception as e:
-                logger.error(f"Sync document failed: {e}")
+        except Exception as e:
+            logger.error(f"Sync document failed: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "content": content,
+                "version": version,
+                "operations": []
+            }
+    
+    async def sync_delta(self, doc_id: str, base_version: int, base_hash: str, delta: List[Any],
+                         user_id: int, create_version: bool = False, db_session: AsyncSession = None) -> dict:
+        """增量同步：客户端只上传基于 base_version 的差异（ot.js 格式）及基准内容的哈希，
+        响应只返回客户端缺少的操作；基准无法校验时返回整篇内容，由客户端改用全量同步"""
+        try:
+            operations = ot.to_legacy(ot.normalize(delta))
+        except OTError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid delta: {e}")
+        try:
+            async with self._doc_lease(doc_id) as lease:
+                hot = await self._hot_document(doc_id, lease)
+                if hot is None:
+                    raise HTTPException(status_code=404, detail="Document not found")
+                
+                # 基准版本的哈希只有当前版本或最近记录过的版本可以校验
+                expected_hash = hot.hash_at(base_version) if base_version <= hot.version else None
+                result = None
+                if expected_hash is not None and expected_hash == base_hash:
+                    # 差异按码点计算，必须恰好覆盖基准内容（含末尾保留），长度不符时拒绝而不是截断
+                    result = await self._apply_operations_locked(
+                        hot, base_version, operations, user_id, base_length=ot.base_length(delta)
+                    )
+                if result is None or not result["success"]:
+                    # 操作日志被其他 worker 抢先写入时缓冲已丢弃，按最新内容回复
+                    hot = await self._hot_document(doc_id, lease)
+                    if hot is None:
+                        raise HTTPException(status_code=404, detail="Document not found")
+                    self.sync_metrics["delta_fallbacks"] += 1
+                    logger.info(f"Delta sync of {doc_id} from v{base_version} needs a full sync")
+                    return {
+                        "success": False,
+                        "error": "full_sync_required",
+                        "mode": "delta",
+                        "version": hot.version,
+                        "content": str(hot.rope),
+                        "content_hash": hot.content_hash(),
+                        "operations": []
+                    }
+                self.sync_metrics["delta"] += 1
+                if result["applied"]:
+                    await self._reset_collaboration(doc_id, str(hot.rope))
+                
+                if create_version and db_session and result["applied"]:
+                    await self._create_version_snapshot(
+                        db_session, doc_id, str(hot.rope), user_id, hot.version
+                    )
+                
                 return {
-                    "success": False,
-                    "error": str(e),
-                    "content": content,
-                    "version": version,
-                    "operations": []
+                    "success": True,
+                    "mode": "delta",
+                    "version": hot.version,
+                    "content": None,
+                    "content_hash": hot.content_hash(),
+                    # 客户端在本地应用自己的差异后，再依次应用这些操作即得到服务端内容
+                    "operations": result["remote_operations"]
                 }
+        except Exception as e:
+            logger.error(f"Delta sync of {doc_id} failed: {e}")
+            raise self._error(e, "Failed to sync document")
     
     async def _create_version_snapshot(self, db_session: AsyncSession, doc_id: str, 
                                      content: str, user_id: int, version: int):
@@ -304,7 +1003,7 @@ class ShareDBService:
                 changed_by=user_id,
                 change_description=f"自动快照 - 版本 {version}",
             )
-            db_session.add(snapshot)
+            await version_store.add(db_session, snapshot)
             await db_session.commit()
             logger.info(f"✅ Version snapshot created for document {doc_id}, version {version} (content changed)")
             
@@ -332,43 +1031,61 @@ class ShareDBService:
                     "success": False,
                     "error": f"Version {target_version_number} not found"
                 }
+            target_content = await version_store.get_content(db_session, target_version)
+            if target_content is None:
+                return {
+                    "success": False,
+                    "error": f"Version {target_version_number} cannot be reconstructed"
+                }
             
-            # 获取当前 ShareDB 版本
-            current_doc = self.documents.find_one({"doc_id": doc_id})
-            current_sharedb_version = current_doc["version"] if current_doc else 0
-            
-            # 更新 ShareDB 内容
-            new_sharedb_version = current_sharedb_version + 1
-            self.documents.update_one(
-                {"doc_id": doc_id},
-                {
-                    "$set": {
-                        "content": target_version.content,
-                        "version": new_sharedb_version,
-                        "updated_at": datetime.utcnow(),
-                        "last_editor_id": user_id
+            async with self._doc_lease(doc_id) as lease:
+                # 获取当前 ShareDB 版本（缓冲中的版本可能比存储新）
+                hot = await self._hot_document(doc_id, lease)
+                current_sharedb_version = hot.version if hot is not None else 0
+                
+                # 更新 ShareDB 内容
+                new_sharedb_version = current_sharedb_version + 1
+                fields = {
+                    "content": target_content,
+                    "version": new_sharedb_version,
+                    "updated_at": datetime.utcnow(),
+                    "last_editor_id": user_id
+                }
+                if lease.distributed:
+                    fields["lease_token"] = lease.token
+                
+                # 记录恢复操作（版本已被占用时不覆盖文档）
+                operation = {
+                    "doc_id": doc_id,
+                    "version": new_sharedb_version,
+                    "content": target_content,
+                    "user_id": user_id,
+                    "timestamp": datetime.utcnow(),
+                    "operation_type": "version_restore",
+                    "restored_from_version": target_version_number
+                }
+                if not await self._insert_operations(doc_id, [operation]):
+                    return {
+                        "success": False,
+                        "error": "Document was modified concurrently, please retry"
                     }
-                },
-                upsert=True
-            )
-            
-            # 记录恢复操作
-            operation = {
-                "doc_id": doc_id,
-                "version": new_sharedb_version,
-                "content": target_version.content,
-                "user_id": user_id,
-                "timestamp": datetime.utcnow(),
-                "operation_type": "version_restore",
-                "restored_from_version": target_version_number
-            }
-            self.operations.insert_one(operation)
+                if not await self._write_document(doc_id, fields, lease, operation):
+                    return {
+                        "success": False,
+                        "error": "Document was modified concurrently, please retry"
+                    }
+                if hot is not None:
+                    hot.reset(target_content, new_sharedb_version, user_id)
+                    hot.lease_token = lease.token
+            self._index_content(doc_id, target_content)
+            await self._publish_content_change(doc_id)
+            await self._reset_collaboration(doc_id, target_content)
             
             logger.info(f"✅ Version restored in ShareDB: {doc_id} -> version {target_version_number} (ShareDB v{new_sharedb_version})")
             
             return {
                 "success": True,
-                "content": target_version.content,
+                "content": target_content,
                 "version": new_sharedb_version,
                 "restored_from_version": target_version_number
             }
@@ -381,7 +1098,11 @@ class ShareDBService:
             }
     
     async def close(self):
-        """关闭服务"""
+        """关闭服务（先写回所有未保存的缓冲）"""
+        for task in (self._index_task, self._compaction_task, self._hot_flush_task):
+            if task and not task.done():
+                task.cancel()
+        await self.flush_hot_documents(force=True)
         if self.mongo_client:
             self.mongo_client.close()
 
@@ -392,5 +1113,5 @@ def get_sharedb_service() -> ShareDBService:
     """获取 ShareDB 服务实例"""
     global sharedb_service
     if sharedb_service is None:
-        sharedb_service = ShareDBService()
+        sharedb_service = ShareDBService(settings.MONGODB_URL, settings.SHAREDB_DB_NAME)
     return sharedb_service 
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+文档版本存储
+版本以反向差异保存：每篇文档最新的版本、以及每隔 DOCUMENT_VERSION_KEYFRAME_INTERVAL 个版本
+保存完整内容（关键帧），其余版本只保存"从下一个较新版本还原到本版本"的差异。
+读取时从较新的关键帧依次应用差异还原，还原结果放入有界 LRU 缓存。
+"""
+
+import difflib
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.database import DocumentVersion
+from app.services import ot
+
+
+def encode_delta(base: str, target: str) -> ot.TextOperation:
+    """按行比较生成把 base 变为 target 的操作（ot.js 格式）"""
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    components: List[ot.Component] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        deleted = sum(len(line) for line in base_lines[i1:i2])
+        if tag == "equal":
+            components.append(deleted)
+            continue
+        components.append(-deleted)
+        components.append("".join(target_lines[j1:j2]))
+    return ot.normalize(components)
+
+
+class VersionStore:
+    """版本内容的写入（关键帧 + 反向差异）和还原"""
+
+    def __init__(self):
+        # 还原出的版本内容 {版本行 id: 内容}
+        self._cache: "OrderedDict[int, str]" = OrderedDict()
+        self.metrics = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "deltas_applied": 0,
+            "deltas_written": 0,
+            "bytes_saved": 0,
+        }
+
+    def _cached(self, version_id: Optional[int]) -> Optional[str]:
+        content = self._cache.get(version_id)
+        if content is not None:
+            self._cache.move_to_end(version_id)
+        return content
+
+    def _remember(self, version_id: int, content: Optional[str]):
+        if content is None or settings.DOCUMENT_VERSION_CACHE_SIZE <= 0:
+            return
+        self._cache[version_id] = content
+        self._cache.move_to_end(version_id)
+        while len(self._cache) > settings.DOCUMENT_VERSION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _is_keyframe_index(index: int) -> bool:
+        """按创建顺序的第 index 个版本（从 0 开始）是否固定保存完整内容"""
+        return index % max(1, settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL) == 0
+
+    def _to_delta(self, version: DocumentVersion, base: DocumentVersion, base_content: str) -> bool:
+        """把关键帧改存为相对 base 的反向差异；差异不比完整内容小时保留关键帧"""
+        content = version.content or ""
+        delta = encode_delta(base_content, content)
+        size = len(json.dumps(delta, ensure_ascii=False))
+        if size >= len(content):
+            return False
+        self._remember(version.id, content)
+        version.delta = delta
+        version.base_version_id = base.id
+        version.content = None
+        self.metrics["deltas_written"] += 1
+        self.metrics["bytes_saved"] += len(content) - size
+        return True
+
+    async def add(self, db: AsyncSession, version: DocumentVersion) -> DocumentVersion:
+        """新增版本（保存完整内容），并把该文档之前的最新版本改存为相对新版本的反向差异
+
+        调用方负责提交事务。
+        """
+        previous_stmt = (
+            select(DocumentVersion)
+            .where(DocumentVersion.document_id == version.document_id)
+            .order_by(desc(DocumentVersion.id))
+            .limit(1)
+        )
+        previous = (await db.execute(previous_stmt)).scalar_one_or_none()
+        db.add(version)
+        await db.flush()
+
+        if previous is not None and previous.delta is None:
+            count_stmt = select(func.count()).select_from(DocumentVersion).where(
+                DocumentVersion.document_id == version.document_id,
+                DocumentVersion.id <= previous.id
+            )
+            previous_index = (await db.execute(count_stmt)).scalar() - 1
+            if not self._is_keyframe_index(previous_index):
+                self._to_delta(previous, version, version.content or "")
+        return version
+
+    async def get_content(self, db: AsyncSession, version: DocumentVersion) -> Optional[str]:
+        """还原版本内容：从较新的关键帧（或缓存的版本）开始依次应用反向差异"""
+        if version.delta is None:
+            return version.content
+        content = self._cached(version.id)
+        if content is not None:
+            self.metrics["cache_hits"] += 1
+            return content
+        self.metrics["cache_misses"] += 1
+
+        # 差异链最长为关键帧间隔，一次查询取出之后的版本
+        rows_stmt = (
+            select(DocumentVersion)
+            .where(
+                DocumentVersion.document_id == version.document_id,
+                DocumentVersion.id > version.id
+            )
+            .order_by(DocumentVersion.id)
+            .limit(settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL)
+        )
+        rows: Dict[int, DocumentVersion] = {row.id: row for row in (await db.execute(rows_stmt)).scalars()}
+
+        chain = [version]
+        while True:
+            base_id = chain[-1].base_version_id
+            content = self._cached(base_id)
+            if content is not None:
+                break
+            base = rows.get(base_id) or await db.get(DocumentVersion, base_id)
+            if base is None:
+                print(f"❌ 版本 {chain[-1].id} 的差异基准 {base_id} 不存在，无法还原")
+                return None
+            if base.delta is None:
+                content = base.content or ""
+                self._remember(base.id, content)
+                break
+            chain.append(base)
+
+        for row in reversed(chain):
+            content = ot.apply(content, row.delta)
+            self.metrics["deltas_applied"] += 1
+            self._remember(row.id, content)
+        return content
+
+    async def convert_document(self, db: AsyncSession, document_id: int) -> Tuple[int, int]:
+        """把文档的历史版本改存为关键帧 + 反向差异，返回 (转换的版本数, 节省的字符数)
+
+        从新到旧逐个处理，同一时间只持有相邻两个版本的内容。调用方负责提交事务。
+        """
+        ids_stmt = (
+            select(DocumentVersion.id)
+            .where(DocumentVersion.document_id == document_id)
+            .order_by(DocumentVersion.id)
+        )
+        ids = list((await db.execute(ids_stmt)).scalars())
+        converted = saved = 0
+        newer: Optional[DocumentVersion] = None
+        newer_content = ""
+        for index in range(len(ids) - 1, -1, -1):
+            version = await db.get(DocumentVersion, ids[index])
+            content = await self.get_content(db, version)
+            if content is None:
+                # 差异链已损坏，之后的版本不能以此为基准
+                newer = None
+                continue
+            if (
+                newer is not None
+                and version.delta is None
+                and not self._is_keyframe_index(index)
+            ):
+                before = self.metrics["bytes_saved"]
+                if self._to_delta(version, newer, newer_content):
+                    converted += 1
+                    saved += self.metrics["bytes_saved"] - before
+                    await db.flush()
+            if newer is not None:
+                db.expunge(newer)
+            newer, newer_content = version, content
+        return converted, saved
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {**self.metrics, "cached_versions": len(self._cache)}
+
+
+# 全局实例
+version_store = VersionStore()
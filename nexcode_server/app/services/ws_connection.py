@@ -0,0 +1,215 @@
+"""
+协作 WebSocket 出站连接
+每个连接拥有有界发送队列和独立的写协程，广播方只负责入队，
+慢客户端不会拖慢同一文档的其他编辑者。
+支持批量的协议（msgpack）会把短时间窗口内的多条消息合并为一帧发送。
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+from app.services.ws_protocol import Codec, Frame, JSON_CODEC
+
+# 队列中的控制标记
+_RESYNC = object()
+_EVICT = object()
+
+
+class CollaborationMetrics:
+    """协作连接发送指标"""
+
+    def __init__(self, latency_window: int = 1000):
+        self.messages_sent = 0
+        self.frames_sent = 0
+        # 各协议发送的字节数 {codec_name: bytes}
+        self.bytes_sent: Dict[str, int] = {}
+        self.messages_dropped = 0
+        self.send_failures = 0
+        self.resyncs = 0
+        self.evictions = 0
+        # 最近若干次发送耗时（毫秒）
+        self.send_latencies: deque = deque(maxlen=latency_window)
+
+    def record_send(self, latency_ms: float, codec: str, messages: int, size: int):
+        self.messages_sent += messages
+        self.frames_sent += 1
+        self.bytes_sent[codec] = self.bytes_sent.get(codec, 0) + size
+        self.send_latencies.append(latency_ms)
+
+    def snapshot(self, connections) -> dict:
+        """汇总指标，connections 为当前所有 OutboundConnection"""
+        depths = [conn.queue_depth for conn in connections]
+        latencies = sorted(self.send_latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return {
+            "connections": len(depths),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            "queue_capacity": settings.WS_SEND_QUEUE_SIZE,
+            "messages_sent": self.messages_sent,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": dict(self.bytes_sent),
+            "messages_dropped": self.messages_dropped,
+            "send_failures": self.send_failures,
+            "resyncs": self.resyncs,
+            "evictions": self.evictions,
+            "send_latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1], 3) if latencies else 0.0,
+            },
+        }
+
+
+class OutboundConnection:
+    """带有界发送队列的WebSocket连接
+
+    队列溢出时：可丢弃的消息（如光标）直接丢弃；其他消息触发降级，清空队列，
+    由写协程发送一次完整的重新同步消息；多次溢出则断开该连接。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        metrics: CollaborationMetrics,
+        resync_provider: Callable[[], Optional[dict]],
+        on_closed: Callable[["OutboundConnection"], None],
+        codec: Codec = JSON_CODEC,
+    ):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.codec = codec
+        self.metrics = metrics
+        self.resync_provider = resync_provider
+        self.on_closed = on_closed
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.overflows = 0
+        self.resync_pending = False
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+        # 批量收集时取出的控制标记，留到本批发送后处理
+        self._held = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        """启动写协程"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+
+    def send(self, frame: Frame, droppable: bool = False) -> bool:
+        """将已按本连接协议编码的消息入队，不等待实际发送"""
+        if self.closed:
+            return False
+        if self.resync_pending and not droppable:
+            # 已安排重新同步，之前的增量消息都已包含在同步内容中
+            self.metrics.messages_dropped += 1
+            return False
+
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.metrics.messages_dropped += 1
+        if droppable:
+            return False
+
+        self.overflows += 1
+        self._clear_queue()
+        if self.overflows > settings.WS_MAX_QUEUE_OVERFLOWS:
+            print(f"⚠️ 会话 {self.session_id} 发送队列多次溢出，断开慢连接")
+            self.closed = True
+            self.queue.put_nowait(_EVICT)
+        else:
+            print(f"⚠️ 会话 {self.session_id} 发送队列溢出，降级为整体重新同步")
+            self.resync_pending = True
+            self.queue.put_nowait(_RESYNC)
+        return False
+
+    def _clear_queue(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def _next_batch(self):
+        """取出下一批待发送的消息；遇到控制标记时单独返回"""
+        item = self._held if self._held is not None else await self.queue.get()
+        self._held = None
+        if item is _EVICT or item is _RESYNC or not self.codec.batching:
+            return item
+
+        batch = [item]
+        if settings.WS_BATCH_WINDOW > 0:
+            await asyncio.sleep(settings.WS_BATCH_WINDOW)
+        while len(batch) < settings.WS_BATCH_MAX_MESSAGES and not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is _EVICT or item is _RESYNC:
+                self._held = item
+                break
+            batch.append(item)
+        return batch
+
+    async def _send_frames(self, frames: list):
+        started = time.perf_counter()
+        data = self.codec.join(frames)
+        if self.codec.binary:
+            send = self.websocket.send_bytes(data)
+        else:
+            send = self.websocket.send_text(data)
+        await asyncio.wait_for(send, timeout=settings.WS_SEND_TIMEOUT)
+        self.metrics.record_send(
+            (time.perf_counter() - started) * 1000, self.codec.name, len(frames), len(data)
+        )
+
+    async def _writer(self):
+        """逐批发送队列中的消息"""
+        try:
+            while True:
+                item = await self._next_batch()
+
+                if item is _EVICT:
+                    self.metrics.evictions += 1
+                    await asyncio.wait_for(
+                        self.websocket.close(code=1013, reason="Slow consumer"),
+                        timeout=settings.WS_SEND_TIMEOUT,
+                    )
+                    break
+
+                if item is _RESYNC:
+                    # 先清除标记再取快照，快照之后的消息正常入队
+                    self.resync_pending = False
+                    message = self.resync_provider()
+                    if message is None:
+                        continue
+                    self.metrics.resyncs += 1
+                    item = self.codec.encode(message)
+
+                await self._send_frames(item if isinstance(item, list) else [item])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics.send_failures += 1
+            print(f"❌ 会话 {self.session_id} 发送失败: {e}")
+        self.closed = True
+        self.on_closed(self)
+
+    def stop(self):
+        """停止写协程，丢弃未发送的消息"""
+        self.closed = True
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
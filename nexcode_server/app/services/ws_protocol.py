@@ -0,0 +1,148 @@
+"""
+协作 WebSocket 消息编码
+- json：默认协议，每帧一条 JSON 文本消息，兼容现有客户端
+- msgpack：客户端通过子协议 nexcode.msgpack.v1 协商启用，二进制帧，
+  字段名和消息类型使用短编码，每帧是一个消息数组，可在短时间窗口内批量发送
+"""
+
+import json
+from typing import Dict, List, Optional, Sequence, Union
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "nexcode.msgpack.v1"
+
+# 字段名短编码（编码时替换，未列出的字段保持原名）
+FIELD_CODES: Dict[str, str] = {
+    "type": "t",
+    "operation": "o",
+    "ops": "p",
+    "revision": "r",
+    "version": "v",
+    "sender_id": "s",
+    "user_id": "u",
+    "position": "c",
+    "content": "x",
+    "user": "us",
+    "users": "ul",
+    "message": "m",
+    "username": "n",
+    "email": "e",
+    "id": "i",
+}
+FIELD_NAMES: Dict[str, str] = {code: name for name, code in FIELD_CODES.items()}
+
+# 消息类型短编码
+TYPE_CODES: Dict[str, int] = {
+    "operation": 1,
+    "ack": 2,
+    "cursor": 3,
+    "content_update": 4,
+    "resync": 5,
+    "ping": 6,
+    "pong": 7,
+    "user_joined": 8,
+    "user_left": 9,
+    "online_users": 10,
+    "connected": 11,
+    "error": 12,
+}
+TYPE_NAMES: Dict[int, str] = {code: name for name, code in TYPE_CODES.items()}
+
+Frame = Union[str, bytes]
+
+# 解码失败时可能抛出的异常
+DECODE_ERRORS = (ValueError, msgpack.UnpackException)
+
+
+# 这些字段的值本身也是协议结构，需要递归编码；其他字段（如光标位置）原样保留
+_NESTED_FIELDS = ("operation", "user", "users")
+
+
+def _compact(message: dict) -> dict:
+    compacted = {}
+    for key, value in message.items():
+        if key == "type" and value in TYPE_CODES:
+            value = TYPE_CODES[value]
+        elif key in _NESTED_FIELDS:
+            value = [_compact(item) for item in value] if isinstance(value, list) else (
+                _compact(value) if isinstance(value, dict) else value
+            )
+        compacted[FIELD_CODES.get(key, key)] = value
+    return compacted
+
+
+def _expand(message: dict) -> dict:
+    expanded = {}
+    for key, value in message.items():
+        name = FIELD_NAMES.get(key, key)
+        if name == "type" and isinstance(value, int):
+            value = TYPE_NAMES.get(value, value)
+        elif name in _NESTED_FIELDS:
+            value = [_expand(item) for item in value] if isinstance(value, list) else (
+                _expand(value) if isinstance(value, dict) else value
+            )
+        expanded[name] = value
+    return expanded
+
+
+def _array_header(length: int) -> bytes:
+    """MessagePack 数组头，后接逐个编码好的元素即构成合法数组"""
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 0x10000:
+        return b"\xdc" + length.to_bytes(2, "big")
+    return b"\xdd" + length.to_bytes(4, "big")
+
+
+class JsonCodec:
+    """JSON 文本协议（每帧一条消息）"""
+
+    name = "json"
+    binary = False
+    batching = False
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+    def join(self, frames: Sequence[str]) -> str:
+        return frames[0]
+
+    def decode(self, data: Frame) -> List[dict]:
+        payload = json.loads(data)
+        return payload if isinstance(payload, list) else [payload]
+
+
+class MsgpackCodec:
+    """MessagePack 二进制协议（每帧一个消息数组）"""
+
+    name = "msgpack"
+    binary = True
+    batching = True
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(_compact(message), use_bin_type=True)
+
+    def join(self, frames: Sequence[bytes]) -> bytes:
+        return _array_header(len(frames)) + b"".join(frames)
+
+    def decode(self, data: Frame) -> List[dict]:
+        if isinstance(data, str):
+            # 协商了二进制协议的客户端仍可发送 JSON 文本帧
+            return JSON_CODEC.decode(data)
+        payload = msgpack.unpackb(data, raw=False)
+        messages = payload if isinstance(payload, list) else [payload]
+        return [_expand(message) for message in messages]
+
+
+JSON_CODEC = JsonCodec()
+MSGPACK_CODEC = MsgpackCodec()
+
+Codec = Union[JsonCodec, MsgpackCodec]
+
+
+def negotiate(requested_subprotocols: Sequence[str], protocol: Optional[str] = None) -> Codec:
+    """根据客户端请求的子协议（或 protocol 查询参数）选择编码"""
+    if MSGPACK_SUBPROTOCOL in requested_subprotocols or protocol == "msgpack":
+        return MSGPACK_CODEC
+    return JSON_CODEC
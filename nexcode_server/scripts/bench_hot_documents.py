@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+ShareDB 热文档缓冲基准测试
+N 个并发编辑者对同一篇大文档（默认 1MB）随机插入 / 删除，比较：
+  - string：原实现，每个操作切片重建整篇字符串，并整篇写回存储
+  - rope：  Rope 缓冲，操作 O(log n)，整篇内容按防抖间隔写回
+统计每个操作的应用延迟（p50/p99）、吞吐量和写回存储的字节数。
+
+指定 --mongo-url 时额外通过 ShareDBService.apply_operation 端到端测量
+（操作日志写入 + 内存缓冲 + 异步写回），使用独立的临时数据库，结束后删除。
+
+用法:
+  python scripts/bench_hot_documents.py [--doc-size 1000000] [--editors 20] [--ops 500]
+  python scripts/bench_hot_documents.py --mongo-url mongodb://localhost:27017
+"""
+
+import argparse
+import asyncio
+import random
+import string
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.core.config import settings
+from app.services.rope import Rope
+
+
+def random_operation(rng: random.Random, length: int) -> dict:
+    """模拟打字：大多是单字符插入，偶尔退格或粘贴一段"""
+    position = rng.randint(0, length)
+    roll = rng.random()
+    if roll < 0.75 or length == 0:
+        return {"type": "insert", "position": position, "text": rng.choice(string.ascii_letters)}
+    if roll < 0.95:
+        return {"type": "delete", "position": max(0, position - 1), "length": 1}
+    text = "".join(rng.choice(string.ascii_letters + " ") for _ in range(rng.randint(20, 200)))
+    return {"type": "insert", "position": position, "text": text}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class StringBuffer:
+    """原实现：切片重建字符串，每个操作整篇写回"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.bytes_written = 0
+
+    def apply(self, op: dict):
+        position = op["position"]
+        if op["type"] == "insert":
+            self.content = self.content[:position] + op["text"] + self.content[position:]
+        else:
+            self.content = self.content[:position] + self.content[position + op["length"]:]
+        self.bytes_written += len(self.content.encode())
+
+    def __len__(self):
+        return len(self.content)
+
+    def flush(self):
+        pass
+
+
+class RopeBuffer:
+    """Rope 缓冲：操作只改内存，整篇内容按防抖间隔写回"""
+
+    def __init__(self, content: str, debounce: float):
+        self.rope = Rope(content)
+        self.debounce = debounce
+        self.last_flush = time.monotonic()
+        self.dirty = False
+        self.bytes_written = 0
+
+    def apply(self, op: dict):
+        if op["type"] == "insert":
+            self.rope.insert(op["position"], op["text"])
+        else:
+            self.rope.delete(op["position"], op["length"])
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.rope)
+
+    def flush(self, force: bool = False):
+        now = time.monotonic()
+        if self.dirty and (force or now - self.last_flush >= self.debounce):
+            self.bytes_written += len(str(self.rope).encode())
+            self.last_flush = now
+            self.dirty = False
+
+
+async def run_buffer(name: str, buffer, editors: int, ops: int, think: float, seed: int) -> dict:
+    latencies: List[float] = []
+
+    async def editor(index: int):
+        rng = random.Random(seed + index)
+        for _ in range(ops):
+            op = random_operation(rng, len(buffer))
+            started = time.perf_counter()
+            buffer.apply(op)
+            latencies.append(time.perf_counter() - started)
+            buffer.flush()
+            await asyncio.sleep(think)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(editor(i) for i in range(editors)))
+    if isinstance(buffer, RopeBuffer):
+        buffer.flush(force=True)
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "ops": len(latencies),
+        "p50_us": percentile(latencies, 0.5) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "cpu_ms": sum(latencies) * 1e3,
+        "elapsed_s": elapsed,
+        "mb_written": buffer.bytes_written / 1e6,
+    }
+
+
+async def run_service(mongo_url: str, content: str, editors: int, ops: int, think: float, seed: int) -> dict:
+    """通过 ShareDBService 端到端测量（需要 MongoDB）"""
+    from app.services.sharedb_service import ShareDBService
+
+    db_name = f"bench_hot_{uuid.uuid4().hex[:8]}"
+    service = ShareDBService(mongo_url, db_name)
+    doc_id = "bench"
+    latencies: List[float] = []
+    try:
+        await service.create_indexes()
+        await service.documents.insert_one({
+            "doc_id": doc_id, "content": content, "version": 0,
+            "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(), "last_editor_id": None,
+        })
+        service.start()
+
+        async def editor(index: int):
+            rng = random.Random(seed + index)
+            for _ in range(ops):
+                hot = service.hot_documents.get(doc_id)
+                length = len(hot.rope) if hot else len(content)
+                while True:
+                    op = random_operation(rng, length)
+                    op["version"] = hot.version if hot else 0
+                    started = time.perf_counter()
+                    result = await service.apply_operation(doc_id, op, index + 1, return_content=False)
+                    if result["success"]:
+                        latencies.append(time.perf_counter() - started)
+                        break
+                    hot = service.hot_documents.get(doc_id)
+                await asyncio.sleep(think)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(editor(i) for i in range(editors)))
+        elapsed = time.perf_counter() - started
+        await service.flush_hot_documents(force=True)
+        stored = await service.documents.find_one({"doc_id": doc_id}, {"version": 1})
+        return {
+            "name": "service (mongo)",
+            "ops": len(latencies),
+            "p50_us": percentile(latencies, 0.5) * 1e6,
+            "p99_us": percentile(latencies, 0.99) * 1e6,
+            "cpu_ms": sum(latencies) * 1e3,
+            "elapsed_s": elapsed,
+            "flushes": service.hot_documents.metrics["flushes"],
+            "stored_version": stored["version"],
+        }
+    finally:
+        await service.close()
+        await service.mongo_client.drop_database(db_name)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="ShareDB 热文档缓冲基准测试")
+    parser.add_argument("--doc-size", type=int, default=1_000_000, help="文档大小（字符）")
+    parser.add_argument("--editors", type=int, default=20, help="并发编辑者数量")
+    parser.add_argument("--ops", type=int, default=500, help="每个编辑者的操作数")
+    parser.add_argument("--think", type=float, default=0.0, help="每次操作后的等待（秒）")
+    parser.add_argument("--debounce", type=float, default=settings.SHAREDB_HOT_FLUSH_DEBOUNCE, help="写回防抖间隔（秒）")
+    parser.add_argument("--mongo-url", help="同时通过 ShareDBService 端到端测量")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    content = "".join(rng.choice(string.ascii_letters + " \n") for _ in range(args.doc_size))
+
+    print(f"文档大小: {args.doc_size:,} 字符，编辑者: {args.editors}，每人操作: {args.ops}\n")
+    results = [
+        await run_buffer("string", StringBuffer(content), args.editors, args.ops, args.think, args.seed),
+        await run_buffer("rope", RopeBuffer(content, args.debounce), args.editors, args.ops, args.think, args.seed),
+    ]
+    if args.mongo_url:
+        results.append(await run_service(args.mongo_url, content, args.editors, args.ops, args.think, args.seed))
+
+    print(f"{'实现':<18}{'操作数':>8}{'p50 (us)':>12}{'p99 (us)':>12}{'CPU (ms)':>12}{'操作/秒':>12}{'写回 (MB)':>12}")
+    print("-" * 86)
+    for result in results:
+        written = f"{result['mb_written']:.1f}" if "mb_written" in result else f"{result['flushes']} 次"
+        print(
+            f"{result['name']:<18}{result['ops']:>8}{result['p50_us']:>12.1f}{result['p99_us']:>12.1f}"
+            f"{result['cpu_ms']:>12.1f}{result['ops'] / result['elapsed_s']:>12,.0f}{written:>12}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+登录吞吐基准测试（单 worker）
+模拟一波并发登录，比较密码校验的两种执行方式：
+  - inline：在事件循环中直接计算 bcrypt（AUTH_HASH_WORKERS=0）
+  - pool：  在密码哈希线程池中计算（AUTH_HASH_WORKERS=N）
+统计每秒完成的登录数、单次登录延迟（p50/p99），以及同时运行的心跳协程
+（代表 WebSocket 消息处理）每 10ms 一次的调度延迟，延迟大说明事件循环被阻塞。
+同时给出 JWT 签发 + 校验的单次耗时，作为是否需要移出事件循环的参考。
+
+用法:
+  python scripts/bench_login.py [--logins 64] [--concurrency 16] [--rounds 12] [--workers 1 2 4]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+TICK = 0.01
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def heartbeat(stop: asyncio.Event, lags: List[float]):
+    """每 TICK 秒醒来一次，记录实际醒来时间比预期晚了多少"""
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_wave(service, password_hash: str, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    lags: List[float] = []
+    stop = asyncio.Event()
+
+    async def login():
+        async with semaphore:
+            start = time.perf_counter()
+            verified, _ = await service.verify_and_update_password("correct horse", password_hash)
+            assert verified
+            service.verify_token(service.create_access_token({"sub": "1", "username": "bench"}))
+            latencies.append(time.perf_counter() - start)
+
+    ticker = asyncio.create_task(heartbeat(stop, lags))
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    return {
+        "throughput": logins / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "lag_p99": percentile(lags, 0.99),
+        "lag_max": max(lags, default=0.0),
+    }
+
+
+def jwt_cost(service, iterations: int = 2000) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        service.verify_token(service.create_access_token({"sub": "1", "username": "bench"}))
+    return (time.perf_counter() - start) / iterations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="登录吞吐基准测试")
+    parser.add_argument("--logins", type=int, default=64, help="登录次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的登录数")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt 成本因子")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="线程池大小")
+    args = parser.parse_args()
+
+    os.environ["AUTH_BCRYPT_ROUNDS"] = str(args.rounds)
+    from app.core.config import settings
+    from app.services.auth_service import AuthService, pwd_context
+
+    password_hash = pwd_context.hash("correct horse")
+    print(f"bcrypt rounds={args.rounds}, logins={args.logins}, concurrency={args.concurrency}")
+    print(f"JWT 签发 + 校验: {jwt_cost(AuthService()) * 1e6:.1f} µs/次")
+    print(f"{'mode':<10}{'logins/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'loop lag p99 ms':>18}{'lag max ms':>12}")
+
+    for workers in [0] + args.workers:
+        settings.AUTH_HASH_WORKERS = workers
+        service = AuthService()
+        try:
+            result = await run_wave(service, password_hash, args.logins, args.concurrency)
+        finally:
+            service.shutdown()
+        mode = "inline" if workers == 0 else f"pool={workers}"
+        print(
+            f"{mode:<10}{result['throughput']:>10.1f}{result['p50'] * 1000:>10.1f}"
+            f"{result['p99'] * 1000:>10.1f}{result['lag_p99'] * 1000:>18.1f}{result['lag_max'] * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
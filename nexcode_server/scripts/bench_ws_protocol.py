@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+协作 WebSocket 协议基准测试
+比较 JSON 整文档更新、JSON 增量操作、MessagePack 单条与批量发送的
+每次编辑字节数（含 permessage-deflate 压缩后）以及编解码吞吐量
+
+用法: python scripts/bench_ws_protocol.py [--edits 5000] [--doc-size 20000] [--batch 8]
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+import zlib
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import ot
+from app.services.ws_protocol import JSON_CODEC, MSGPACK_CODEC
+
+
+def generate_session(edits: int, doc_size: int, seed: int = 42):
+    """模拟一次编辑会话：每次编辑产生一个操作消息和一个光标消息"""
+    rng = random.Random(seed)
+    content = "".join(rng.choice(string.ascii_letters + " \n") for _ in range(doc_size))
+    contents, messages = [], []
+    revision = 0
+
+    for _ in range(edits):
+        position = rng.randrange(len(content) + 1)
+        if rng.random() < 0.8 or not content:
+            operation = ot.normalize([position, rng.choice(string.ascii_letters)])
+        else:
+            position = min(position, len(content) - 1)
+            operation = ot.normalize([position, -1])
+        content = ot.apply(content, operation)
+        revision += 1
+
+        contents.append(content)
+        messages.append({
+            "type": "operation",
+            "operation": {"ops": operation, "revision": revision},
+            "sender_id": 1,
+        })
+        messages.append({"type": "cursor", "user_id": 1, "position": {"index": position, "length": 0}})
+    return contents, messages
+
+
+def deflated_sizes(frames):
+    """模拟 permessage-deflate（保留上下文）后的每帧大小"""
+    compressor = zlib.compressobj(wbits=-15)
+    sizes = []
+    for frame in frames:
+        data = frame.encode() if isinstance(frame, str) else frame
+        # permessage-deflate 会去掉每帧末尾的 00 00 ff ff
+        sizes.append(len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4)
+    return sizes
+
+
+def measure(name, frames, edits):
+    raw = sum(len(f.encode()) if isinstance(f, str) else len(f) for f in frames)
+    deflated = sum(deflated_sizes(frames))
+    return {
+        "name": name,
+        "frames": len(frames),
+        "bytes_per_edit": raw / edits,
+        "deflated_bytes_per_edit": deflated / edits,
+    }
+
+
+def throughput(codec, messages, batch):
+    """编码 + 解码吞吐量（消息/秒）"""
+    started = time.perf_counter()
+    encoded = [codec.encode(message) for message in messages]
+    if codec.batching:
+        frames = [codec.join(encoded[i:i + batch]) for i in range(0, len(encoded), batch)]
+    else:
+        frames = encoded
+    decoded = 0
+    for frame in frames:
+        decoded += len(codec.decode(frame))
+    elapsed = time.perf_counter() - started
+    return decoded / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="协作 WebSocket 协议基准测试")
+    parser.add_argument("--edits", type=int, default=5000)
+    parser.add_argument("--doc-size", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=8, help="每帧合并的消息数")
+    args = parser.parse_args()
+
+    contents, messages = generate_session(args.edits, args.doc_size)
+    edits = args.edits
+
+    results = [
+        measure(
+            "json content_update",
+            [JSON_CODEC.encode({"type": "content_update", "content": c, "sender_id": 1}) for c in contents],
+            edits,
+        ),
+        measure("json operation+cursor", [JSON_CODEC.encode(m) for m in messages], edits),
+        measure(
+            "msgpack operation+cursor",
+            [MSGPACK_CODEC.join([MSGPACK_CODEC.encode(m)]) for m in messages],
+            edits,
+        ),
+    ]
+    encoded = [MSGPACK_CODEC.encode(m) for m in messages]
+    results.append(measure(
+        f"msgpack batched x{args.batch}",
+        [MSGPACK_CODEC.join(encoded[i:i + args.batch]) for i in range(0, len(encoded), args.batch)],
+        edits,
+    ))
+
+    print(f"编辑次数: {edits}，文档大小: {args.doc_size} 字符\n")
+    print(f"{'协议':<28}{'帧数':>8}{'字节/编辑':>14}{'压缩后字节/编辑':>18}")
+    print("-" * 70)
+    for result in results:
+        print(
+            f"{result['name']:<28}{result['frames']:>8}"
+            f"{result['bytes_per_edit']:>14.1f}{result['deflated_bytes_per_edit']:>18.1f}"
+        )
+
+    print(f"\n{'协议':<28}{'消息/秒（编码+解码）':>24}")
+    print("-" * 52)
+    print(f"{'json':<28}{throughput(JSON_CODEC, messages, args.batch):>24,.0f}")
+    print(f"{'msgpack batched x' + str(args.batch):<28}{throughput(MSGPACK_CODEC, messages, args.batch):>24,.0f}")
+
+
+if __name__ == "__main__":
+    main()
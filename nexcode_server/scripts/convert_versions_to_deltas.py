@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+把已有的 DocumentVersion 完整内容改存为关键帧 + 反向差异
+按文档分批处理，每批提交一次，可中断后重新运行（已转换的版本会跳过）。
+
+用法:
+  python scripts/convert_versions_to_deltas.py [--batch-size 50] [--document-id 123]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.database import DocumentVersion
+from app.services.version_store import version_store
+
+
+async def convert(batch_size: int, document_id: int = None):
+    started = time.monotonic()
+    total_documents = total_converted = total_saved = 0
+    last_id = 0
+    print(f"🔄 关键帧间隔: {settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL}，每批 {batch_size} 个文档")
+    while True:
+        async with AsyncSessionLocal() as db:
+            if document_id is not None:
+                document_ids = [document_id] if last_id == 0 else []
+            else:
+                stmt = (
+                    select(DocumentVersion.document_id)
+                    .where(DocumentVersion.document_id > last_id)
+                    .group_by(DocumentVersion.document_id)
+                    .order_by(DocumentVersion.document_id)
+                    .limit(batch_size)
+                )
+                document_ids = list((await db.execute(stmt)).scalars())
+            if not document_ids:
+                break
+
+            batch_converted = batch_saved = 0
+            for doc_id in document_ids:
+                converted, saved = await version_store.convert_document(db, doc_id)
+                batch_converted += converted
+                batch_saved += saved
+            await db.commit()
+
+            last_id = document_ids[-1]
+            total_documents += len(document_ids)
+            total_converted += batch_converted
+            total_saved += batch_saved
+            print(
+                f"✅ 文档 {document_ids[0]}-{last_id}: 转换 {batch_converted} 个版本，"
+                f"节省 {batch_saved / 1e6:.2f}M 字符"
+            )
+
+    print(
+        f"\n完成: {total_documents} 个文档，{total_converted} 个版本改存为差异，"
+        f"节省 {total_saved / 1e6:.2f}M 字符，耗时 {time.monotonic() - started:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把文档版本改存为关键帧 + 反向差异")
+    parser.add_argument("--batch-size", type=int, default=50, help="每批处理的文档数")
+    parser.add_argument("--document-id", type=int, help="只转换指定文档")
+    args = parser.parse_args()
+    asyncio.run(convert(args.batch_size, args.document_id))
+
+
+if __name__ == "__main__":
+    main()
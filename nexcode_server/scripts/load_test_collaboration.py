@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+"""
+协作 WebSocket 压测工具
+在本地启动服务（默认 SQLite，可指定本地 Postgres），为 M 个文档创建 N 个模拟编辑者，
+重放打字和光标轨迹，统计：
+  - 端到端传播延迟：编辑者按键 -> 其他编辑者收到操作（p50/p99）
+  - 光标传播延迟、ack 往返时间
+  - 服务端 CPU、内存（RSS）
+  - 丢弃/降级：服务端 messages_dropped、resyncs、evictions，客户端收到的 resync 与修订号缺口
+  - 收敛检查：结束后同一文档所有编辑者的内容必须一致
+
+协作路径不依赖 MongoDB；如需同时验证 ShareDB 接口，可用 --mongo-url 指向本地实例。
+
+用法:
+  python scripts/load_test_collaboration.py --editors 50 --documents 5 --duration 60
+  python scripts/load_test_collaboration.py --database-url postgresql+asyncpg://... --workers 4
+  python scripts/load_test_collaboration.py --trace traces/typing.jsonl --protocol msgpack
+  python scripts/load_test_collaboration.py --output result.json --max-p99-ms 200
+
+轨迹文件为 JSON Lines，每行一个事件（delay 为距上一事件的秒数）：
+  {"delay": 0.18, "type": "insert", "text": "a"}
+  {"delay": 0.25, "type": "delete", "count": 1}
+  {"delay": 1.40, "type": "move", "offset": -12}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import psutil
+import websockets
+
+# 添加项目根目录到路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog function return value import async await "
+    "document editor cursor latency server client update insert delete retain revision "
+    "协作 文档 编辑 测试 性能 延迟 光标 服务 数据"
+).split()
+
+
+# ---------------------------------------------------------------------------
+# 轨迹
+# ---------------------------------------------------------------------------
+
+def generate_trace(rng: random.Random, duration: float, cps: float) -> List[dict]:
+    """生成接近真实打字节奏的轨迹：按键间隔服从对数正态分布，
+    单词之间有空格，句子之间停顿，偶尔退格或把光标移到别处继续输入"""
+    events = []
+    elapsed = 0.0
+    mean_delay = 1.0 / cps
+
+    while elapsed < duration:
+        sentence_words = rng.randint(4, 14)
+        for _ in range(sentence_words):
+            word = rng.choice(WORDS) + " "
+            for char in word:
+                delay = rng.lognormvariate(0, 0.5) * mean_delay
+                elapsed += delay
+                events.append({"delay": delay, "type": "insert", "text": char})
+                if rng.random() < 0.04:
+                    # 打错字后退格
+                    elapsed += mean_delay
+                    events.append({"delay": mean_delay, "type": "delete", "count": 1})
+        # 句末停顿
+        pause = rng.uniform(0.5, 3.0)
+        elapsed += pause
+        events.append({"delay": pause, "type": "insert", "text": rng.choice([".\n", ". "])})
+        if rng.random() < 0.3:
+            # 移动光标到别处
+            events.append({"delay": rng.uniform(0.2, 1.0), "type": "move", "offset": rng.randint(-200, 200)})
+    return events
+
+
+def load_trace(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ---------------------------------------------------------------------------
+# 统计
+# ---------------------------------------------------------------------------
+
+class Stats:
+    """所有模拟编辑者共享的统计数据（同一进程内，时钟一致）"""
+
+    def __init__(self):
+        # (document_id, revision) -> 产生该操作的按键时间
+        self.op_edit_times: Dict[tuple, float] = {}
+        # (document_id, revision) -> [接收时间]
+        self.op_receive_times: Dict[tuple, List[float]] = {}
+        self.cursor_latencies: List[float] = []
+        self.ack_latencies: List[float] = []
+        self.ops_sent = 0
+        self.cursors_sent = 0
+        self.messages_received = 0
+        self.resyncs = 0
+        self.revision_gaps = 0
+        self.errors = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+
+    def propagation_latencies(self) -> List[float]:
+        latencies = []
+        for key, receive_times in self.op_receive_times.items():
+            edit_time = self.op_edit_times.get(key)
+            if edit_time is None:
+                continue
+            latencies.extend(t - edit_time for t in receive_times)
+        return latencies
+
+
+def summarize(values: List[float]) -> dict:
+    """毫秒级分位数"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+# ---------------------------------------------------------------------------
+# 模拟编辑者
+# ---------------------------------------------------------------------------
+
+class SimulatedEditor:
+    """一个协作编辑客户端
+
+    按 OT 客户端的方式工作：同一时间只有一个操作等待 ack，其余按键操作排队；
+    收到其他人的操作时，把它与所有未确认的本地操作互相转换后再应用。
+    """
+
+    def __init__(self, index: int, document_id: int, token: str, trace: List[dict], args, stats: Stats):
+        from app.services import ot
+        from app.services.ws_protocol import JSON_CODEC, MSGPACK_CODEC, MSGPACK_SUBPROTOCOL
+
+        self.ot = ot
+        self.index = index
+        self.document_id = document_id
+        self.token = token
+        self.trace = trace
+        self.args = args
+        self.stats = stats
+        self.codec = MSGPACK_CODEC if args.protocol == "msgpack" else JSON_CODEC
+        self.subprotocols = [MSGPACK_SUBPROTOCOL] if args.protocol == "msgpack" else None
+
+        self.websocket = None
+        self.content = ""
+        self.revision = 0
+        self.cursor = 0
+        # 未确认的本地操作 [(ops, 按键时间)]，第一个已发出等待 ack
+        self.pending: List[tuple] = []
+        self.sent_at: Optional[float] = None
+        self.last_activity = time.monotonic()
+        self.connected = asyncio.Event()
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending
+
+    async def run(self, url: str, stop_at: float):
+        try:
+            async with websockets.connect(
+                f"{url}/v1/documents/{self.document_id}/collaborate?token={self.token}"
+                f"{'&protocol=msgpack' if self.args.protocol == 'msgpack' else ''}",
+                subprotocols=self.subprotocols,
+                max_size=None,
+                open_timeout=30,
+            ) as websocket:
+                self.websocket = websocket
+                receiver = asyncio.create_task(self._receive_loop())
+                try:
+                    await asyncio.wait_for(self.connected.wait(), timeout=30)
+                    await self._replay(stop_at)
+                    # 停止输入后继续接收，直到所有编辑者都收敛
+                    await receiver
+                except asyncio.CancelledError:
+                    receiver.cancel()
+                    raise
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not self.connected.is_set():
+                self.stats.connect_failures += 1
+            else:
+                self.stats.disconnects += 1
+            print(f"❌ 编辑者 {self.index} 连接异常: {e}")
+
+    async def _send(self, message: dict):
+        frame = self.codec.encode(message)
+        await self.websocket.send(self.codec.join([frame]))
+
+    async def _replay(self, stop_at: float):
+        """按轨迹时间间隔产生编辑"""
+        position = 0
+        while time.monotonic() < stop_at:
+            event = self.trace[position % len(self.trace)]
+            position += 1
+            await asyncio.sleep(event.get("delay", 0) / self.args.speed)
+            if time.monotonic() >= stop_at:
+                break
+            await self._apply_event(event)
+
+    async def _apply_event(self, event: dict):
+        ot = self.ot
+        length = len(self.content)
+        self.cursor = max(0, min(self.cursor, length))
+
+        if event["type"] == "insert":
+            ops = ot.normalize([self.cursor, event["text"]])
+            self.cursor += len(event["text"])
+        elif event["type"] == "delete":
+            count = min(event.get("count", 1), self.cursor)
+            if count == 0:
+                return
+            ops = ot.normalize([self.cursor - count, -count])
+            self.cursor -= count
+        elif event["type"] == "move":
+            self.cursor = max(0, min(self.cursor + event.get("offset", 0), length))
+            await self._send_cursor()
+            return
+        else:
+            return
+
+        self.content = ot.apply(self.content, ops)
+        self.pending.append((ops, time.monotonic()))
+        if len(self.pending) == 1:
+            await self._send_pending()
+        await self._send_cursor()
+
+    async def _send_pending(self):
+        ops, _ = self.pending[0]
+        self.sent_at = time.monotonic()
+        self.stats.ops_sent += 1
+        await self._send({"type": "operation", "operation": {"ops": ops, "revision": self.revision}})
+
+    async def _send_cursor(self):
+        self.stats.cursors_sent += 1
+        # 发送时间放在位置信息里，服务端原样转发，接收方据此计算光标延迟
+        await self._send({
+            "type": "cursor",
+            "position": {"index": self.cursor, "length": 0, "sent_at": time.time()},
+        })
+
+    async def _receive_loop(self):
+        async for data in self.websocket:
+            now = time.monotonic()
+            self.last_activity = now
+            for message in self.codec.decode(data):
+                self.stats.messages_received += 1
+                await self._handle(message, now)
+
+    async def _handle(self, message: dict, now: float):
+        ot = self.ot
+        kind = message.get("type")
+
+        if kind == "connected":
+            self.content = message.get("content") or ""
+            self.revision = message.get("revision", 0)
+            self.connected.set()
+
+        elif kind == "ack":
+            ops, edit_time = self.pending.pop(0)
+            self.revision = message["revision"]
+            self.stats.op_edit_times[(self.document_id, self.revision)] = edit_time
+            self.stats.ack_latencies.append(now - self.sent_at)
+            if self.pending:
+                await self._send_pending()
+
+        elif kind == "operation":
+            operation = message["operation"]
+            revision = operation["revision"]
+            if revision != self.revision + 1:
+                self.stats.revision_gaps += 1
+            self.stats.op_receive_times.setdefault((self.document_id, revision), []).append(now)
+
+            # 远端操作与所有未确认的本地操作互相转换；与服务端一致，
+            # 已提交的操作作为第一个参数，同一位置插入时排在前面
+            remote = operation["ops"]
+            pending = []
+            for ops, edit_time in self.pending:
+                remote, ops = ot.transform(remote, ops)
+                pending.append((ops, edit_time))
+            self.pending = pending
+            self.content = ot.apply(self.content, remote)
+            self.cursor = self._transform_cursor(self.cursor, remote)
+            self.revision = revision
+
+        elif kind in ("resync", "content_update"):
+            if kind == "resync":
+                self.stats.resyncs += 1
+            # 整体同步后丢弃未确认的本地操作
+            self.content = message.get("content", "")
+            self.revision = message.get("revision", self.revision)
+            self.pending = []
+
+        elif kind == "cursor":
+            sent_at = (message.get("position") or {}).get("sent_at")
+            if sent_at:
+                self.stats.cursor_latencies.append(time.time() - sent_at)
+
+        elif kind == "error":
+            self.stats.errors += 1
+
+    def _transform_cursor(self, cursor: int, ops) -> int:
+        position = 0
+        for component in ops:
+            if position >= cursor:
+                break
+            if isinstance(component, str):
+                cursor += len(component)
+                position += len(component)
+            elif component > 0:
+                position += component
+            else:
+                cursor -= min(-component, cursor - position)
+        return cursor
+
+
+# ---------------------------------------------------------------------------
+# 准备数据与启动服务
+# ---------------------------------------------------------------------------
+
+async def seed(editors: int, documents: int) -> dict:
+    """创建编辑者账号、文档和会话令牌"""
+    from app.core.database import AsyncSessionLocal, engine, init_db
+    from app.models.database import Document, DocumentCollaborator, PermissionLevel, User
+    from app.services.auth_service import auth_service
+
+    engine.echo = False
+    await init_db()
+    run_id = f"{int(time.time())}{random.randint(100, 999)}"
+
+    async with AsyncSessionLocal() as db:
+        admin = User(username=f"loadtest_admin_{run_id}", email=f"admin_{run_id}@loadtest.local",
+                     is_active=True, is_superuser=True)
+        users = [
+            User(username=f"loadtest_{run_id}_{i}", email=f"editor{i}_{run_id}@loadtest.local", is_active=True)
+            for i in range(editors)
+        ]
+        db.add(admin)
+        db.add_all(users)
+        await db.commit()
+
+        docs = [
+            Document(title=f"loadtest {run_id} #{i}", content="", owner_id=admin.id, version=1)
+            for i in range(documents)
+        ]
+        db.add_all(docs)
+        await db.commit()
+
+        assignments = []
+        for i, user in enumerate(users):
+            document = docs[i % documents]
+            db.add(DocumentCollaborator(
+                document_id=document.id, user_id=user.id,
+                permission=PermissionLevel.EDITOR, added_by=admin.id
+            ))
+            assignments.append(document.id)
+        await db.commit()
+
+        tokens = [(await auth_service.create_user_session(db, user.id)).session_token for user in users]
+        admin_token = (await auth_service.create_user_session(db, admin.id)).session_token
+
+    await engine.dispose()
+    return {"tokens": tokens, "documents": assignments, "admin_token": admin_token}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, env: dict, port: int, log_path: str) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers),
+        "--ws", "websockets",
+        "--log-level", "warning",
+    ]
+    log = open(log_path, "w")
+    return subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_for_server(base_url: str, process: Optional[subprocess.Popen], timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError("服务进程已退出，请查看日志")
+            try:
+                if (await client.get(f"{base_url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("等待服务启动超时")
+
+
+async def fetch_server_metrics(base_url: str, admin_token: str) -> dict:
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{base_url}/v1/admin/monitoring/collaboration",
+                headers={"X-Session-Token": admin_token},
+            )
+            if response.status_code == 200:
+                return response.json()
+    except httpx.HTTPError:
+        pass
+    return {}
+
+
+class ResourceSampler:
+    """每秒采样服务进程（含 worker 子进程）的 CPU 和内存"""
+
+    def __init__(self, pid: int):
+        self.root = psutil.Process(pid)
+        self.cpu: List[float] = []
+        self.rss: List[float] = []
+        self._processes: Dict[int, psutil.Process] = {}
+
+    def _tree(self) -> List[psutil.Process]:
+        processes = [self.root] + self.root.children(recursive=True)
+        for process in processes:
+            if process.pid not in self._processes:
+                self._processes[process.pid] = process
+                process.cpu_percent(None)
+        return [self._processes[p.pid] for p in processes]
+
+    async def run(self):
+        self._tree()
+        while True:
+            await asyncio.sleep(1)
+            cpu = rss = 0.0
+            for process in self._tree():
+                try:
+                    cpu += process.cpu_percent(None)
+                    rss += process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.cpu.append(cpu)
+            self.rss.append(rss / 1024 / 1024)
+
+    def summary(self) -> dict:
+        if not self.cpu:
+            return {}
+        return {
+            "cpu_percent_avg": round(sum(self.cpu) / len(self.cpu), 1),
+            "cpu_percent_max": round(max(self.cpu), 1),
+            "rss_mb_max": round(max(self.rss), 1),
+            "rss_mb_end": round(self.rss[-1], 1),
+        }
+
+
+# ---------------------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------------------
+
+async def wait_until_quiet(editors: List[SimulatedEditor], quiet: float, timeout: float):
+    """等待所有编辑者的本地操作都被确认，并且一段时间内没有新消息"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        if all(e.idle and now - e.last_activity >= quiet for e in editors):
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+def check_convergence(editors: List[SimulatedEditor]) -> dict:
+    contents: Dict[int, set] = {}
+    for editor in editors:
+        if editor.connected.is_set():
+            contents.setdefault(editor.document_id, set()).add(editor.content)
+    diverged = [document_id for document_id, versions in contents.items() if len(versions) > 1]
+    return {"documents": len(contents), "diverged": diverged}
+
+
+def delta(before: dict, after: dict, key: str) -> int:
+    return after.get(key, 0) - before.get(key, 0)
+
+
+async def run(args) -> dict:
+    if args.workers > 1 and not args.redis_url:
+        print("⚠️ 多 worker 需要 Redis 协作总线，请通过 --redis-url 指定本地 Redis")
+
+    workdir = tempfile.mkdtemp(prefix="nexcode_loadtest_")
+    database_url = args.database_url or f"sqlite+aiosqlite:///{workdir}/loadtest.db"
+
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env["COLLAB_BUS_ENABLED"] = "True" if args.redis_url else "False"
+    if args.redis_url:
+        env["REDIS_URL"] = args.redis_url
+    if args.mongo_url:
+        env["MONGODB_URL"] = args.mongo_url
+    os.environ.update({k: env[k] for k in ("DATABASE_URL", "COLLAB_BUS_ENABLED")})
+
+    print(f"📦 准备数据: {args.editors} 个编辑者, {args.documents} 个文档 ({database_url})")
+    seeded = await seed(args.editors, args.documents)
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(workdir, "server.log")
+        print(f"🚀 启动服务: {base_url}（{args.workers} 个 worker，日志 {log_path}）")
+        process = start_server(args, env, port, log_path)
+
+    sampler_task = None
+    try:
+        await wait_for_server(base_url, process)
+        sampler = None
+        pid = process.pid if process else args.server_pid
+        if pid:
+            sampler = ResourceSampler(pid)
+            sampler_task = asyncio.create_task(sampler.run())
+
+        metrics_before = await fetch_server_metrics(base_url, seeded["admin_token"])
+
+        stats = Stats()
+        rng = random.Random(args.seed)
+        base_trace = load_trace(args.trace) if args.trace else None
+        editors = []
+        for i, (token, document_id) in enumerate(zip(seeded["tokens"], seeded["documents"])):
+            trace = base_trace or generate_trace(random.Random(rng.random()), args.duration, args.cps)
+            editors.append(SimulatedEditor(i, document_id, token, trace, args, stats))
+
+        ws_url = base_url.replace("http", "ws", 1)
+        stop_at = time.monotonic() + args.ramp_up + args.duration
+        tasks = []
+        print(f"✍️  模拟编辑 {args.duration}s（连接爬坡 {args.ramp_up}s，协议 {args.protocol}）")
+        for editor in editors:
+            tasks.append(asyncio.create_task(editor.run(ws_url, stop_at)))
+            await asyncio.sleep(args.ramp_up / max(len(editors), 1))
+
+        await asyncio.sleep(max(stop_at - time.monotonic(), 0))
+        converged = await wait_until_quiet(editors, quiet=2.0, timeout=args.settle_timeout)
+        # 在断开连接之前读取指标，避免把断开时的发送失败计入
+        metrics_after = await fetch_server_metrics(base_url, seeded["admin_token"])
+        convergence = check_convergence(editors)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        return {
+            "config": {
+                "editors": args.editors,
+                "documents": args.documents,
+                "duration": args.duration,
+                "workers": args.workers,
+                "protocol": args.protocol,
+                "database": database_url.split("://", 1)[0],
+            },
+            "propagation_latency": summarize(stats.propagation_latencies()),
+            "cursor_latency": summarize(stats.cursor_latencies),
+            "ack_rtt": summarize(stats.ack_latencies),
+            "throughput": {
+                "operations_sent": stats.ops_sent,
+                "cursors_sent": stats.cursors_sent,
+                "messages_received": stats.messages_received,
+                "operations_per_second": round(stats.ops_sent / args.duration, 1),
+            },
+            "drops": {
+                "server_messages_dropped": delta(metrics_before, metrics_after, "messages_dropped"),
+                "server_resyncs": delta(metrics_before, metrics_after, "resyncs"),
+                "server_evictions": delta(metrics_before, metrics_after, "evictions"),
+                "server_send_failures": delta(metrics_before, metrics_after, "send_failures"),
+                "client_resyncs": stats.resyncs,
+                "client_revision_gaps": stats.revision_gaps,
+                "client_errors": stats.errors,
+                "connect_failures": stats.connect_failures,
+                "disconnects": stats.disconnects,
+            },
+            "server": sampler.summary() if sampler else {},
+            "convergence": {**convergence, "settled": converged},
+        }
+    finally:
+        if sampler_task:
+            sampler_task.cancel()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def print_report(result: dict):
+    print("\n" + "=" * 60)
+    config = result["config"]
+    print(f"编辑者 {config['editors']}，文档 {config['documents']}，时长 {config['duration']}s，"
+          f"worker {config['workers']}，协议 {config['protocol']}，数据库 {config['database']}")
+    print("-" * 60)
+    for title, key in (("操作传播延迟", "propagation_latency"), ("光标传播延迟", "cursor_latency"), ("ack 往返", "ack_rtt")):
+        s = result[key]
+        if s.get("count"):
+            print(f"{title:<10} n={s['count']:<8} p50={s['p50_ms']:>8}ms  p99={s['p99_ms']:>8}ms  max={s['max_ms']:>8}ms")
+        else:
+            print(f"{title:<10} 无数据")
+    throughput = result["throughput"]
+    print(f"吞吐       发送操作 {throughput['operations_sent']}（{throughput['operations_per_second']}/s），"
+          f"光标 {throughput['cursors_sent']}，接收消息 {throughput['messages_received']}")
+    server = result["server"]
+    if server:
+        print(f"服务端     CPU 平均 {server['cpu_percent_avg']}% / 峰值 {server['cpu_percent_max']}%，"
+              f"RSS 峰值 {server['rss_mb_max']}MB")
+    print(f"丢弃/降级  {json.dumps(result['drops'], ensure_ascii=False)}")
+    convergence = result["convergence"]
+    status = "✅ 一致" if not convergence["diverged"] and convergence["settled"] else "❌ 不一致"
+    print(f"收敛       {status}（{convergence['documents']} 个文档，不一致: {convergence['diverged']}）")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="协作 WebSocket 压测工具")
+    parser.add_argument("--editors", type=int, default=20, help="模拟编辑者数量")
+    parser.add_argument("--documents", type=int, default=4, help="文档数量，编辑者轮流分配")
+    parser.add_argument("--duration", type=float, default=30, help="编辑时长（秒）")
+    parser.add_argument("--ramp-up", type=float, default=5, help="所有编辑者建立连接的时间（秒）")
+    parser.add_argument("--cps", type=float, default=6, help="生成轨迹时每个编辑者的平均打字速度（字符/秒）")
+    parser.add_argument("--speed", type=float, default=1.0, help="轨迹回放倍速")
+    parser.add_argument("--trace", help="轨迹文件（JSON Lines），不指定则按 --cps 生成")
+    parser.add_argument("--protocol", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--workers", type=int, default=1, help="服务 worker 数")
+    parser.add_argument("--database-url", help="数据库地址，默认使用临时 SQLite 文件")
+    parser.add_argument("--redis-url", help="Redis 地址，指定后启用跨 worker 协作总线")
+    parser.add_argument("--mongo-url", help="MongoDB 地址（仅 ShareDB 接口使用）")
+    parser.add_argument("--url", help="使用已运行的服务而不是自动启动（需与 --database-url 指向同一数据库）")
+    parser.add_argument("--server-pid", type=int, help="配合 --url 采样已运行服务的 CPU 和内存")
+    parser.add_argument("--settle-timeout", type=float, default=30, help="停止输入后等待收敛的最长时间（秒）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="将结果写入 JSON 文件，便于版本间对比")
+    parser.add_argument("--max-p99-ms", type=float, help="操作传播 p99 超过该值时以非零状态退出")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+    failed = bool(result["convergence"]["diverged"]) or not result["convergence"]["settled"]
+    p99 = result["propagation_latency"].get("p99_ms")
+    if args.max_p99_ms is not None and p99 is not None and p99 > args.max_p99_ms:
+        print(f"❌ 操作传播 p99 {p99}ms 超过阈值 {args.max_p99_ms}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ export interface DocumentState {
   version: number;
   created_at: string;
   updated_at: string;
+  content_hash?: string | null;
 }
 
 export interface Operation {
@@ -22,16 +23,16 @@ export interface SyncResponse {
   success: boolean;
   version: number;
   content: string;
-  operations: Array<{
-    doc_id: string;
-    version: number;
-    operation: Operation;
-    user_id: number;
-    timestamp: string;
-  }>;
+  // 增量同步时为客户端缺少的操作，应用本地差异后依次应用
+  operations: Operation[];
   error?: string;
+  mode?: 'full' | 'delta';
+  content_hash?: string | null;
 }
 
+// ot.js 格式的紧凑差异：正数保留，负数删除，字符串插入
+export type TextDelta = Array<number | string>;
+
 export interface OperationResponse {
   success: boolean;
   version?: number;
@@ -52,6 +53,8 @@ export class ShareDBClient {
   private docId: string;
   private currentVersion: number = 0;
   private currentContent: string = '';
+  // currentContent 的 sha256，有值时同步只上传差异
+  private currentHash: string | null = null;
   private syncTimeout: NodeJS.Timeout | null = null;
   private isOnline: boolean = true;
   private pendingOperations: Operation[] = [];
@@ -71,6 +74,7 @@ export class ShareDBClient {
       
       this.currentVersion = docState.version;
       this.currentContent = docState.content;
+      this.currentHash = docState.content_hash ?? null;
       this.lastSyncTime = new Date();
       this.isOnline = true;
       
@@ -83,7 +87,7 @@ export class ShareDBClient {
   }
 
   /**
-   * 同步文档状态
+   * 同步文档状态：已知基准内容的哈希时只上传差异，服务端校验失败时改为全量同步
    */
   async syncDocument(content: string): Promise<SyncResponse> {
     // 防止并发同步
@@ -100,26 +104,20 @@ export class ShareDBClient {
     this.syncInProgress = true;
 
     try {
-      const response = await api.post('/v1/sharedb/documents/sync', {
-        doc_id: this.docId,
-        version: this.currentVersion,
-        content: content,
-        create_version: false
-      });
-      
-      const syncResult = response.data as SyncResponse;
+      let syncResult: SyncResponse | null = null;
+      if (this.currentHash) {
+        syncResult = await this.syncDelta(content);
+      }
+      if (!syncResult) {
+        syncResult = await this.syncFull(content);
+      }
       
       if (syncResult.success) {
         this.currentVersion = syncResult.version;
         this.currentContent = syncResult.content;
+        this.currentHash = syncResult.content_hash ?? null;
         this.lastSyncTime = new Date();
         this.isOnline = true;
-        
-        // 如果有缺失的操作，应用它们
-        if (syncResult.operations && syncResult.operations.length > 0) {
-          console.log('Received operations:', syncResult.operations);
-          // TODO: 应用操作到本地内容
-        }
       } else {
         console.warn('Sync failed:', syncResult.error);
       }
@@ -142,6 +140,111 @@ export class ShareDBClient {
     }
   }
 
+  private async syncFull(content: string): Promise<SyncResponse> {
+    const response = await api.post('/v1/sharedb/documents/sync', {
+      doc_id: this.docId,
+      version: this.currentVersion,
+      content: content,
+      create_version: false
+    });
+    return response.data as SyncResponse;
+  }
+
+  /**
+   * 增量同步，返回 null 表示需要全量同步
+   */
+  private async syncDelta(content: string): Promise<SyncResponse | null> {
+    let response;
+    try {
+      response = await api.post('/v1/sharedb/documents/sync', {
+        doc_id: this.docId,
+        version: this.currentVersion,
+        base_hash: this.currentHash,
+        delta: this.diff(this.currentContent, content),
+        create_version: false
+      });
+    } catch (error: any) {
+      // 差异与基准内容长度不符时服务端拒绝（400），改用全量同步
+      if (error?.response?.status === 400) {
+        console.log('Delta sync rejected, falling back to full sync:', error.response.data?.detail);
+        return null;
+      }
+      throw error;
+    }
+    const result = response.data as SyncResponse;
+    if (!result.success) {
+      console.log('Delta sync rejected, falling back to full sync:', result.error);
+      return null;
+    }
+    
+    // 本地内容加上服务端返回的缺失操作即为服务端的最新内容
+    const merged = result.operations.reduce(
+      (text, operation) => this.applyLocalOperation(text, operation),
+      content
+    );
+    const mergedHash = await this.hashContent(merged);
+    if (mergedHash && result.content_hash && mergedHash !== result.content_hash) {
+      // 合并结果与服务端不一致，重新拉取整篇内容
+      const serverDoc = await apiService.getShareDBDocument(this.docId);
+      return { ...result, content: serverDoc.content, version: serverDoc.version, content_hash: serverDoc.content_hash };
+    }
+    return { ...result, content: merged };
+  }
+
+  /**
+   * 根据公共前后缀生成把 oldText 变为 newText 的差异
+   * 偏移按 Unicode 码点计算（与服务端一致），不能用 UTF-16 下标
+   */
+  private diff(oldValue: string, newValue: string): TextDelta {
+    const oldText = Array.from(oldValue);
+    const newText = Array.from(newValue);
+    let prefix = 0;
+    const maxPrefix = Math.min(oldText.length, newText.length);
+    while (prefix < maxPrefix && oldText[prefix] === newText[prefix]) {
+      prefix++;
+    }
+    let suffix = 0;
+    const maxSuffix = maxPrefix - prefix;
+    while (suffix < maxSuffix && oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]) {
+      suffix++;
+    }
+    
+    const delta: TextDelta = [];
+    if (prefix > 0) delta.push(prefix);
+    const deleted = oldText.length - prefix - suffix;
+    if (deleted > 0) delta.push(-deleted);
+    const inserted = newText.slice(prefix, newText.length - suffix).join('');
+    if (inserted) delta.push(inserted);
+    // 末尾保留不可省略，服务端要求差异恰好覆盖基准内容
+    if (suffix > 0) delta.push(suffix);
+    return delta;
+  }
+
+  /**
+   * 应用服务端返回的操作（位置和长度按 Unicode 码点计算）
+   */
+  private applyLocalOperation(content: string, operation: Operation): string {
+    if (operation.type === 'full_update') {
+      return operation.content ?? content;
+    }
+    const chars = Array.from(content);
+    const position = Math.min(operation.position ?? 0, chars.length);
+    const length = operation.type === 'insert' ? 0 : (operation.length ?? 0);
+    const text = operation.type === 'delete' ? '' : (operation.text ?? '');
+    return chars.slice(0, position).join('') + text + chars.slice(position + length).join('');
+  }
+
+  private async hashContent(content: string): Promise<string | null> {
+    // crypto.subtle 只在安全上下文（HTTPS / localhost）可用
+    if (typeof crypto === 'undefined' || !crypto.subtle) {
+      return null;
+    }
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(content));
+    return Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, '0'))
+      .join('');
+  }
+
   /**
    * 应用操作
    */
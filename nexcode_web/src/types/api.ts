@@ -123,6 +123,7 @@ export interface DocumentState {
   created_at: string;
   updated_at: string;
   last_editor_id?: string | null;
+  content_hash?: string | null;
 }
 
 export interface ShareDBSyncResponse {